@@ -0,0 +1,312 @@
+"""
+Headless bulk ingestion - index a whole directory tree into a workspace without the UI.
+
+    python bulk_ingest.py ./corpus --workspace shared --workers 8
+
+Every indexed batch is written to a JSON-lines checkpoint, so a run that is stopped
+(or hits the daily embed quota) picks up where it left off when started again.
+Files keep their path relative to the corpus root as document name.
+With --backend local nothing leaves the machine and no API key is needed.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import logging
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import google.generativeai as genai
+
+from document_processor import DocumentProcessor, INGEST_WORKERS, STREAM_MIN_MB, parse_file
+from embeddings import BACKENDS, get_backend
+from vector_store import (
+    DATA_DIR, DEFAULT_WORKSPACE, EMBED_BATCH_SIZE, EMBED_WORKERS, EmbeddingError, VectorStore,
+    get_ingest_cache, workspace_backend, workspace_collection, logger
+)
+
+
+# ============================================
+# 📌 CHECKPOINT
+# ============================================
+
+class Checkpoint:
+    """
+    Append-only record of finished files: {"path", "size", "mtime", "status", ...} per line.
+    A file counts as done while its size and mtime still match, so edited files are picked up again.
+    """
+    
+    DONE = ("done", "duplicate")
+    
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.done = {}
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # half-written last line of a killed run
+                    if entry.get("status") in self.DONE:
+                        self.done[entry["path"]] = (entry["size"], entry["mtime"])
+                    else:
+                        self.done.pop(entry.get("path"), None)
+        self._file = open(self.path, "a", encoding="utf-8")
+    
+    @staticmethod
+    def signature(path):
+        stat = path.stat()
+        return stat.st_size, stat.st_mtime_ns
+    
+    def is_done(self, name, path):
+        return self.done.get(name) == self.signature(path)
+    
+    def record(self, name, path, status, **info):
+        size, mtime = self.signature(path)
+        self._file.write(json.dumps({"path": name, "size": size, "mtime": mtime, "status": status, **info}) + "\n")
+    
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+    
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+# ============================================
+# 📥 BULK INGESTION
+# ============================================
+
+def find_files(root):
+    """Supported documents under root, in a stable order"""
+    return sorted(
+        path for path in Path(root).rglob("*")
+        if path.is_file() and path.suffix.lower() in DocumentProcessor.PAGE_READERS
+    )
+
+
+def sha256_path(path, block=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(block):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BulkIngestor:
+    def __init__(self, store: VectorStore, checkpoint: Checkpoint, workers: int = INGEST_WORKERS,
+                 batch_chunks: int = None, stream_min_mb: int = STREAM_MIN_MB):
+        self.store = store
+        self.checkpoint = checkpoint
+        self.workers = max(1, workers)
+        self.batch_chunks = batch_chunks or store.batch_size * store.workers
+        self.stream_min_bytes = stream_min_mb * 1024 * 1024
+        self.cache = get_ingest_cache()
+        self.indexed_ids = set(store.list_documents())
+        self.stats = {"docs": 0, "pages": 0, "chunks": 0, "skipped": 0, "duplicates": 0, "failed": 0}
+        self.batch = []
+    
+    def run(self, root):
+        root = Path(root)
+        started, calls_before = time.perf_counter(), self.store.limiter.requests
+        
+        pending = []
+        for path in find_files(root):
+            name = path.relative_to(root).as_posix()
+            if self.checkpoint.is_done(name, path):
+                self.stats["skipped"] += 1
+            else:
+                pending.append((name, path))
+        logger.info(f"{len(pending)} files to ingest ({self.stats['skipped']} already done)")
+        
+        to_parse = [(n, p) for n, p in pending if p.stat().st_size < self.stream_min_bytes]
+        to_stream = [(n, p) for n, p in pending if p.stat().st_size >= self.stream_min_bytes]
+        
+        try:
+            self._parse_and_index(to_parse)
+            for name, path in to_stream:
+                self._stream(name, path)
+        except EmbeddingError as e:
+            # Daily quota etc. - everything before this point is checkpointed
+            logger.error(f"Stopping: {e}")
+        finally:
+            self.checkpoint.flush()
+        
+        return self.report(time.perf_counter() - started, self.store.limiter.requests - calls_before)
+    
+    def _parse_and_index(self, files):
+        """Parse in worker processes while the main process embeds finished documents"""
+        if not files:
+            return
+        pdf_workers = max(1, (os.cpu_count() or 1) // self.workers)
+        ctx = multiprocessing.get_context("spawn")
+        files = iter(files)
+        
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx) as pool:
+            running = {}
+            
+            def submit_more():
+                # Only a couple of documents per worker in flight, so memory stays flat on huge corpora
+                while len(running) < self.workers * 2:
+                    item = next(files, None)
+                    if item is None:
+                        return
+                    running[pool.submit(parse_file, str(item[1]), item[0], pdf_workers)] = item
+            
+            submit_more()
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, path = running.pop(future)
+                    try:
+                        self._add(name, path, future.result())
+                    except EmbeddingError:
+                        raise
+                    except Exception as e:
+                        self._fail(name, path, e)
+                submit_more()
+            self._flush()
+    
+    def _add(self, name, path, doc):
+        if doc["id"] in self.indexed_ids:
+            self.stats["duplicates"] += 1
+            self.checkpoint.record(name, path, "duplicate", id=doc["id"])
+            return
+        self.indexed_ids.add(doc["id"])
+        self.batch.append((name, path, doc))
+        if sum(len(d["chunks"]) for _, _, d in self.batch) >= self.batch_chunks:
+            self._flush()
+    
+    def _flush(self):
+        """Embed + index the collected documents in shared batches, then checkpoint them"""
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        results = self.store.add_documents([(d["id"], d["chunks"], None, d["hash"]) for _, _, d in batch])
+        
+        failed = False
+        for (name, path, doc), indexed in zip(batch, results):
+            missing = len(doc["chunks"]) - len(indexed)
+            if missing:
+                # Partly indexed - drop it so the next run does it again from scratch
+                self.store.delete_document(doc["id"])
+                self.indexed_ids.discard(doc["id"])
+                self._fail(name, path, f"{missing} chunks not embedded")
+                failed = True
+                continue
+            self.cache.put(doc["hash"], doc, indexed, self.store.backend.tag)
+            self._done(name, path, doc, len(indexed))
+        self.checkpoint.flush()
+        
+        if failed and self.store.limiter.day_used_up():
+            raise EmbeddingError("Daily embedding quota used up")
+    
+    def _stream(self, name, path):
+        """Very large files: pages -> chunks -> index in bounded batches, like the UI does"""
+        try:
+            file_hash = sha256_path(path)
+            if file_hash[:16] in self.indexed_ids:
+                self.stats["duplicates"] += 1
+                self.checkpoint.record(name, path, "duplicate", id=file_hash[:16])
+                return
+            
+            processor = DocumentProcessor()
+            doc = processor.new_document(str(path), file_hash, name)
+            content_path = self.store.content_path(doc["id"], ".txt")
+            chunks = processor.stream(str(path), doc, str(content_path))
+            indexed, total = self.store.add_stream(doc["id"], chunks, doc_hash=file_hash)
+            if indexed < total:
+                self.store.delete_document(doc["id"])
+                self._fail(name, path, f"{total - indexed} chunks not embedded")
+                if self.store.limiter.day_used_up():
+                    raise EmbeddingError("Daily embedding quota used up")
+                return
+            
+            doc.update({"chunks": [], "chunk_count": total, "content_path": str(content_path)})
+            self.store.content_path(doc["id"], ".json").write_text(json.dumps(doc), encoding="utf-8")
+            self.indexed_ids.add(doc["id"])
+            self._done(name, path, doc, total)
+        except EmbeddingError:
+            raise
+        except Exception as e:
+            self._fail(name, path, e)
+        finally:
+            self.checkpoint.flush()
+    
+    def _done(self, name, path, doc, chunks):
+        self.stats["docs"] += 1
+        self.stats["pages"] += doc["pages"]
+        self.stats["chunks"] += chunks
+        self.checkpoint.record(name, path, "done", id=doc["id"], pages=doc["pages"], chunks=chunks)
+        logger.info(f"✅ {name} ({doc['pages']} pages, {chunks} chunks)")
+    
+    def _fail(self, name, path, error):
+        self.stats["failed"] += 1
+        self.checkpoint.record(name, path, "failed", error=str(error)[:200])
+        logger.warning(f"❌ {name}: {str(error)[:120]}")
+    
+    def report(self, seconds, embed_calls):
+        seconds = max(seconds, 1e-9)
+        return dict(
+            self.stats,
+            seconds=round(seconds, 2),
+            embed_calls=embed_calls,
+            docs_per_sec=round(self.stats["docs"] / seconds, 2),
+            pages_per_sec=round(self.stats["pages"] / seconds, 2),
+            chunks_per_sec=round(self.stats["chunks"] / seconds, 2)
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest a directory tree into a Doc Studio workspace")
+    parser.add_argument("root", help="Corpus directory (searched recursively)")
+    parser.add_argument("--workspace", default=DEFAULT_WORKSPACE, help=f"Workspace / username to fill (default: {DEFAULT_WORKSPACE})")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="Parser processes")
+    parser.add_argument("--embed-workers", type=int, default=EMBED_WORKERS, help="Concurrent embed requests")
+    parser.add_argument("--batch-chunks", type=int, default=None,
+                        help=f"Chunks per index batch (default: {EMBED_BATCH_SIZE} x embed workers)")
+    parser.add_argument("--backend", choices=list(BACKENDS), default=None,
+                        help="Embedding backend (default: the one picked for the workspace)")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint file (default: under the data dir)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start over")
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    
+    backend = args.backend or workspace_backend(args.workspace)
+    api_key = os.getenv("GEMINI_API_KEY", "")
+    if get_backend(backend).remote and not api_key:
+        parser.error("GEMINI_API_KEY is not set (or use --backend local)")
+    if not Path(args.root).is_dir():
+        parser.error(f"Not a directory: {args.root}")
+    if api_key:
+        genai.configure(api_key=api_key.strip())
+    
+    checkpoint_path = Path(args.checkpoint or DATA_DIR / "checkpoints" / f"{workspace_collection(args.workspace)}.jsonl")
+    if args.restart and checkpoint_path.exists():
+        checkpoint_path.unlink()
+    
+    store = VectorStore(namespace=args.workspace, workers=args.embed_workers, backend=backend)
+    checkpoint = Checkpoint(checkpoint_path)
+    try:
+        report = BulkIngestor(store, checkpoint, workers=args.workers, batch_chunks=args.batch_chunks).run(args.root)
+    finally:
+        checkpoint.close()
+    
+    print(json.dumps(report, indent=2))
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Near-duplicate chunk detection: MinHash signatures + banded LSH (no Streamlit)"""
+
+import os
+import re
+import zlib
+import threading
+
+import numpy as np
+
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))  # estimated Jaccard to merge, 0 = off
+MINHASH_PERMS = 64
+MINHASH_BANDS = 16          # 16 bands x 4 rows: pairs above ~0.6 Jaccard almost always collide
+SHINGLE_WORDS = 3
+
+_MERSENNE = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_SHINGLE_MUL = np.uint64(1000003)
+_WORD = re.compile(r"\w+")
+
+
+class MinHasher:
+    """
+    Fixed-seed MinHash over word shingles. Signatures are stable across processes
+    (crc32 shingles, seeded permutations), so they can be stored next to the index.
+    """
+    
+    def __init__(self, num_perm: int = MINHASH_PERMS, shingle_words: int = SHINGLE_WORDS, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.shingle_words = shingle_words
+        self.a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+    
+    def shingles(self, text) -> np.ndarray:
+        """Distinct 32-bit hashes of the word n-grams (rolled from per-word crc32s)"""
+        words = _WORD.findall(text.lower())
+        codes = np.fromiter((zlib.crc32(w.encode("utf-8")) for w in words), dtype=np.uint64, count=len(words))
+        n = min(self.shingle_words, len(codes))
+        if n == 0:
+            return np.zeros(1, dtype=np.uint64)
+        count = len(codes) - n + 1
+        rolled = codes[:count].copy()
+        for k in range(1, n):
+            rolled = (rolled * _SHINGLE_MUL) ^ codes[k:k + count]
+        return np.unique(rolled & _MAX_HASH)
+    
+    def signature(self, text) -> np.ndarray:
+        # (shingles x perms) universal hashes, min per permutation
+        permuted = ((np.outer(self.shingles(text), self.a) + self.b) % _MERSENNE) & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+    
+    def signatures(self, texts) -> np.ndarray:
+        return np.vstack([self.signature(t) for t in texts]) if texts else np.empty((0, self.num_perm), np.uint32)
+    
+    @staticmethod
+    def encode(signature) -> str:
+        return signature.astype("<u4").tobytes().hex()
+    
+    @staticmethod
+    def decode(text) -> np.ndarray:
+        return np.frombuffer(bytes.fromhex(text), dtype="<u4").astype(np.uint32)
+
+
+class LSHIndex:
+    """Banded LSH over MinHash signatures: key -> signature, plus band buckets for candidate lookup"""
+    
+    def __init__(self, num_perm: int = MINHASH_PERMS, bands: int = MINHASH_BANDS):
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.signatures = {}
+        self.buckets = [{} for _ in range(bands)]
+        self.loaded = False
+        self.lock = threading.RLock()
+    
+    def _band_keys(self, signature):
+        data = signature.tobytes()
+        step = self.rows * 4
+        return [data[i * step:(i + 1) * step] for i in range(self.bands)]
+    
+    def add(self, key, signature):
+        with self.lock:
+            self.remove(key)
+            self.signatures[key] = signature
+            for bucket, band in zip(self.buckets, self._band_keys(signature)):
+                bucket.setdefault(band, set()).add(key)
+    
+    def remove(self, key):
+        with self.lock:
+            signature = self.signatures.pop(key, None)
+            if signature is None:
+                return
+            for bucket, band in zip(self.buckets, self._band_keys(signature)):
+                keys = bucket.get(band)
+                if keys:
+                    keys.discard(key)
+                    if not keys:
+                        del bucket[band]
+    
+    def query(self, signature, threshold: float = DEDUP_THRESHOLD):
+        """(key, estimated Jaccard) of the closest stored signature at or above threshold, else (None, 0)"""
+        with self.lock:
+            candidates = set()
+            for bucket, band in zip(self.buckets, self._band_keys(signature)):
+                candidates |= bucket.get(band, set())
+            best, best_score = None, 0.0
+            for key in candidates:
+                score = float(np.mean(self.signatures[key] == signature))
+                if score >= threshold and score > best_score:
+                    best, best_score = key, score
+            return best, best_score
+    
+    def __len__(self):
+        return len(self.signatures)
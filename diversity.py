@@ -0,0 +1,48 @@
+"""Maximal marginal relevance re-ranking - a diverse top-k out of a larger candidate pool (no Streamlit)"""
+
+import os
+
+import numpy as np
+
+MMR_RERANK = os.getenv("MMR_RERANK", "0") == "1"    # default for search(diverse=None)
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))  # 1 = relevance only, 0 = diversity only
+MMR_POOL = int(os.getenv("MMR_POOL", "4"))          # candidates fetched per result kept
+
+
+def _normalise(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def mmr_select(vectors, k, relevance=None, lambda_=MMR_LAMBDA):
+    """
+    Positions of k candidates, picked greedily by
+        lambda * relevance - (1 - lambda) * max cosine to the ones already picked.
+    relevance: one score per candidate on a 0-1 scale, like the cosines it is traded
+    against (default: falling linearly with the position in the pool). The pool x pool
+    similarity matrix is computed once, each step only updates the running max.
+    """
+    vectors = _normalise(vectors)
+    count = len(vectors)
+    k = min(k, count)
+    if k == 0:
+        return []
+    if relevance is None:
+        relevance = 1.0 - np.arange(count, dtype=np.float32) / count
+    relevance = np.asarray(relevance, dtype=np.float32)
+    similarity = vectors @ vectors.T
+    
+    # -1 is the lowest cosine, so before the first pick the penalty is the same for all
+    redundancy = np.full(count, -1.0, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    picked = []
+    for _ in range(k):
+        scores = lambda_ * relevance - (1.0 - lambda_) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return picked
@@ -0,0 +1,516 @@
+"""Document parsing and chunking - kept free of Streamlit so worker processes can import it"""
+
+import io
+import os
+import re
+import hashlib
+import tempfile
+from array import array
+from collections.abc import Mapping
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Tuple, Union, BinaryIO
+from datetime import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Document Processing
+from PyPDF2 import PdfReader
+from docx import Document as DocxDocument
+from openpyxl import load_workbook
+from pptx import Presentation
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))  # smaller PDFs stay single-process
+UPLOAD_SPOOL_MB = int(os.getenv("UPLOAD_SPOOL_MB", "64"))  # bigger uploads are parsed from a temp file
+STREAM_MIN_MB = int(os.getenv("STREAM_MIN_MB", "25"))  # bigger uploads go through the streaming pipeline
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))  # files parsed at once
+XLSX_ROWS_PER_PAGE = int(os.getenv("XLSX_ROWS_PER_PAGE", "500"))  # rows per sheet "page"
+XLSX_MAX_ROWS = int(os.getenv("XLSX_MAX_ROWS", "100000"))  # per sheet; longer sheets are sampled, 0 = all
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "700"))  # ~500 words
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "140"))  # ~100 words
+CHARS_PER_TOKEN = 4  # usual estimate for English text with Gemini/GPT style tokenizers
+MIN_CHUNK_CHARS = 80
+
+_SPACE = re.compile(r"\s+")
+_NON_SPACE = re.compile(r"\S")
+
+# A path on disk, or the upload itself (bytes / memoryview / open binary file)
+Source = Union[str, Path, bytes, bytearray, memoryview, BinaryIO]
+
+
+# ============================================
+# 📄 DOCUMENT PROCESSOR
+# ============================================
+
+def file_sha256(data: bytes) -> str:
+    """Content address of an uploaded file"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def fingerprint(text: str) -> str:
+    """Short content hash of a page or chunk - equal text, equal fingerprint across versions"""
+    return hashlib.blake2b(text.encode("utf-8", "ignore"), digest_size=8).hexdigest()
+
+
+def _is_path(source) -> bool:
+    return isinstance(source, (str, Path))
+
+
+@contextmanager
+def open_upload(data, spool_mb: int = UPLOAD_SPOOL_MB):
+    """
+    File-like view of upload bytes for the readers: a zero-copy BytesIO, or above
+    spool_mb an anonymous temp file that the OS removes even if parsing fails.
+    """
+    if len(data) <= spool_mb * 1024 * 1024:
+        yield io.BytesIO(data)
+        return
+    with tempfile.TemporaryFile() as tmp:
+        tmp.write(data)
+        tmp.seek(0)
+        yield tmp
+
+
+def page_block(kind, page_num, text):
+    """How a page appears in the full document content (None = left out)"""
+    if kind == ".pdf":
+        return f"[Page {page_num}]\n{text}" if text else None
+    if kind == ".pptx":
+        return f"[Slide {page_num}]\n{text}"
+    return text
+
+
+class Chunk(Mapping):
+    """Read-only view of one chunk span; its text is sliced out of the page only when read"""
+    __slots__ = ("_spans", "_index")
+    KEYS = ("id", "text", "page", "file")
+    
+    def __init__(self, spans, index):
+        self._spans = spans
+        self._index = index
+    
+    def __getitem__(self, key):
+        spans, i = self._spans, self._index
+        if key == "text":
+            return spans.text(i)
+        if key == "page":
+            return spans.page_nums[i]
+        if key == "id":
+            return f"{spans.doc_id}_p{spans.page_nums[i]}_c{spans.starts[i]}"
+        if key == "file":
+            return spans.filename
+        raise KeyError(key)
+    
+    def __iter__(self):
+        return iter(self.KEYS)
+    
+    def __len__(self):
+        return len(self.KEYS)
+
+
+class ChunkSpans:
+    """
+    A document's chunks as (page, start, end) character offsets into its page texts,
+    stored in parallel arrays. The page texts double as the document content, so
+    nothing is copied until a chunk's text or the content is actually needed.
+    """
+    __slots__ = ("pages", "kind", "doc_id", "filename", "page_nums", "starts", "ends")
+    
+    def __init__(self, pages: Dict[int, str], kind: str, doc_id: str, filename: str):
+        self.pages = pages
+        self.kind = kind
+        self.doc_id = doc_id
+        self.filename = filename
+        self.page_nums = array("I")
+        self.starts = array("I")
+        self.ends = array("I")
+    
+    def add(self, page_num, start, end):
+        self.page_nums.append(page_num)
+        self.starts.append(start)
+        self.ends.append(end)
+    
+    def text(self, i):
+        return self.pages[self.page_nums[i]][self.starts[i]:self.ends[i]]
+    
+    def __len__(self):
+        return len(self.starts)
+    
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        return Chunk(self, i % len(self))
+    
+    def __iter__(self):
+        return (Chunk(self, i) for i in range(len(self)))
+    
+    def with_file(self, filename):
+        """Same spans cited under another file name (arrays and pages are shared)"""
+        other = ChunkSpans(self.pages, self.kind, self.doc_id, filename)
+        other.page_nums, other.starts, other.ends = self.page_nums, self.starts, self.ends
+        return other
+    
+    def with_id(self, doc_id):
+        """Same spans under another document id (a new version keeps its predecessor's id)"""
+        other = self.with_file(self.filename)
+        other.doc_id = doc_id
+        return other
+    
+    def page_fingerprints(self):
+        return {page_num: fingerprint(text) for page_num, text in self.pages.items()}
+    
+    def content(self, limit=None):
+        """Full document text, built from the pages - stops early once limit chars are there"""
+        parts, size = [], 0
+        for page_num, text in self.pages.items():
+            block = page_block(self.kind, page_num, text)
+            if block is None:
+                continue
+            if parts:
+                parts.append("\n\n")
+                size += 2
+            parts.append(block)
+            size += len(block)
+            if limit and size >= limit:
+                break
+        content = "".join(parts)
+        return content[:limit] if limit else content
+    
+    def to_json(self):
+        return {
+            "kind": self.kind,
+            "pages": {str(k): v for k, v in self.pages.items()},
+            "spans": [list(self.page_nums), list(self.starts), list(self.ends)]
+        }
+    
+    @classmethod
+    def from_json(cls, data, doc_id, filename):
+        spans = cls({int(k): v for k, v in data["pages"].items()}, data["kind"], doc_id, filename)
+        spans.page_nums, spans.starts, spans.ends = (array("I", column) for column in data["spans"])
+        return spans
+
+
+def diff_versions(old, new):
+    """
+    Page-level comparison of two versions of a document by page fingerprint.
+    Pages are matched by content, so pages that only moved count as unchanged.
+    """
+    old_prints = list(old.page_fingerprints().values())
+    new_prints = list(new.page_fingerprints().values())
+    remaining = {}
+    for fp in old_prints:
+        remaining[fp] = remaining.get(fp, 0) + 1
+    
+    unchanged = 0
+    for fp in new_prints:
+        if remaining.get(fp):
+            remaining[fp] -= 1
+            unchanged += 1
+    
+    changed = min(len(old_prints), len(new_prints)) - unchanged
+    return {
+        "unchanged": unchanged,
+        "changed": changed,
+        "added": max(0, len(new_prints) - len(old_prints)),
+        "removed": max(0, len(old_prints) - len(new_prints))
+    }
+
+
+def _extract_pdf_pages(path, start, end):
+    """Worker: text of pages [start, end) using its own PdfReader"""
+    reader = PdfReader(path)
+    return [(reader.pages[i].extract_text() or "").strip() for i in range(start, end)]
+
+
+class DocumentProcessor:
+    PAGE_READERS = {
+        ".pdf": "_iter_pdf",
+        ".docx": "_iter_docx",
+        ".xlsx": "_iter_excel",
+        ".pptx": "_iter_pptx",
+        ".txt": "_iter_txt",
+    }
+    
+    def __init__(self, pdf_workers: int = PDF_WORKERS, pdf_parallel_min_pages: int = PDF_PARALLEL_MIN_PAGES,
+                 xlsx_rows_per_page: int = XLSX_ROWS_PER_PAGE, xlsx_max_rows: int = XLSX_MAX_ROWS,
+                 chunk_tokens: int = CHUNK_TOKENS, chunk_overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+        self.pdf_workers = max(1, pdf_workers)
+        self.pdf_parallel_min_pages = pdf_parallel_min_pages
+        self.xlsx_rows_per_page = max(1, xlsx_rows_per_page)
+        self.xlsx_max_rows = xlsx_max_rows
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.chunk_overlap_tokens = min(max(0, chunk_overlap_tokens), self.chunk_tokens - 1)
+    
+    def process(self, source: Source, file_hash: str = None, name: str = None) -> Dict:
+        """Process uploaded document (path, or in-memory upload together with its name)"""
+        try:
+            doc = self.new_document(source, file_hash, name)
+            ext = Path(doc["name"]).suffix.lower()
+            pages = dict(self.iter_pages(source, doc["name"]))
+            blocks = (page_block(ext, k, v) for k, v in pages.items())
+            
+            # Content is served from the page texts via doc["chunks"].content()
+            doc.update({
+                "chunks": self._create_chunks(pages, doc["name"], doc["id"], ext),
+                "pages": len(pages),
+                "word_count": sum(len(block.split()) for block in blocks if block is not None)
+            })
+            return doc
+        except Exception as e:
+            raise Exception(f"Error: {str(e)}")
+    
+    def new_document(self, source: Source, file_hash: str = None, name: str = None) -> Dict:
+        """Document header (no content yet)"""
+        if not name and not _is_path(source):
+            raise ValueError("In-memory uploads need a file name")
+        name = name or Path(source).name
+        ext = Path(name).suffix.lower()
+        if ext not in self.PAGE_READERS:
+            raise ValueError(f"Unsupported: {ext}")
+        
+        # Same bytes -> same id, so re-uploads line up with the ingestion cache
+        if file_hash:
+            doc_id = file_hash[:16]
+        else:
+            doc_id = hashlib.md5(f"{name}{datetime.now()}".encode()).hexdigest()[:16]
+        
+        return {
+            "id": doc_id,
+            "hash": file_hash,
+            "name": name,
+            "type": ext[1:].upper(),
+            "pages": 0,
+            "size": self._size(source),
+            "uploaded": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "word_count": 0
+        }
+    
+    @staticmethod
+    def _size(source):
+        if _is_path(source):
+            return Path(source).stat().st_size
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return len(source)
+        position = source.tell()
+        size = source.seek(0, io.SEEK_END)
+        source.seek(position)
+        return size
+    
+    def stream(self, source: Source, doc: Dict, content_path: str = None) -> Iterator[Dict]:
+        """
+        Lazy pipeline: pages -> chunks with only the current page in memory.
+        Fills doc["pages"] / doc["word_count"] as it goes and spools the page text
+        to content_path so full content can be read back only when needed.
+        """
+        ext = Path(doc["name"]).suffix.lower()
+        out = open(content_path, "w", encoding="utf-8") if content_path else None
+        try:
+            first = True
+            for page_num, text in self.iter_pages(source, doc["name"]):
+                doc["pages"] += 1
+                block = page_block(ext, page_num, text)
+                if block is not None:
+                    doc["word_count"] += len(block.split())
+                    if out:
+                        out.write(block if first else "\n\n" + block)
+                    first = False
+                yield from self._create_chunks({page_num: text}, doc["name"], doc["id"], ext)
+        finally:
+            if out:
+                out.close()
+    
+    def iter_pages(self, source: Source, name: str = None) -> Iterator[Tuple[int, str]]:
+        """(page_number, text) one page at a time"""
+        ext = Path(name or source).suffix.lower()
+        if ext not in self.PAGE_READERS:
+            raise ValueError(f"Unsupported: {ext}")
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        elif not _is_path(source):
+            source.seek(0)
+        return getattr(self, self.PAGE_READERS[ext])(source)
+    
+    def _iter_pdf(self, source):
+        reader = PdfReader(source)
+        total = len(reader.pages)
+        
+        texts = None
+        if self.pdf_workers > 1 and total >= self.pdf_parallel_min_pages:
+            texts = self._extract_pdf_parallel(source, total)
+        if texts is None:
+            texts = ((page.extract_text() or "").strip() for page in reader.pages)
+        
+        yield from enumerate(texts, 1)
+    
+    def _extract_pdf_parallel(self, source, total):
+        """Shard the page range over worker processes, results merged in page order.
+        Returns None if the pool can't run so the caller falls back to serial."""
+        workers = min(self.pdf_workers, total)
+        shard = -(-total // (workers * 2))  # 2 shards per worker evens out slow pages
+        starts = list(range(0, total, shard))
+        ends = [min(start + shard, total) for start in starts]
+        
+        # Workers open the PDF by path; an in-memory upload is written out once for them
+        tmp_path = None
+        try:
+            if _is_path(source):
+                path = str(source)
+            else:
+                source.seek(0)
+                with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+                    while block := source.read(1024 * 1024):
+                        tmp.write(block)
+                    tmp_path = path = tmp.name
+            
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                parts = pool.map(_extract_pdf_pages, [path] * len(starts), starts, ends)
+                return [text for part in parts for text in part]
+        except Exception:
+            return None
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    def _iter_docx(self, source):
+        doc = DocxDocument(source)
+        paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
+        yield 1, "\n\n".join(paragraphs)
+    
+    def _iter_excel(self, source):
+        # read_only streams rows out of the sheet XML instead of building the whole object model
+        wb = load_workbook(source, read_only=True, data_only=True)
+        try:
+            page_num = 0
+            for name in wb.sheetnames:
+                sheet = wb[name]
+                if not hasattr(sheet, "iter_rows"):  # chartsheet
+                    continue
+                for text in self._iter_sheet_pages(name, sheet):
+                    page_num += 1
+                    yield page_num, text
+        finally:
+            wb.close()
+    
+    def _iter_sheet_pages(self, name, sheet):
+        """Sheet text in groups of xlsx_rows_per_page rows. Continuation pages repeat the
+        header row; sheets longer than xlsx_max_rows are sampled at an even stride."""
+        total = sheet.max_row or 0  # from the sheet's <dimension>, can be missing
+        step = 1
+        if self.xlsx_max_rows and total > self.xlsx_max_rows:
+            step = -(-total // self.xlsx_max_rows)
+        
+        title = f"[Sheet: {name}]"
+        if step > 1:
+            title += f"\n(sampled: every {step}th row of {total:,})"
+        header = None
+        rows, part, kept = [], 1, 0
+        
+        for index, row in enumerate(sheet.iter_rows(values_only=True)):
+            if index % step and header is not None:
+                continue
+            if self.xlsx_max_rows and kept >= self.xlsx_max_rows:
+                rows.append(f"(truncated after {kept:,} rows)")
+                break
+            r = " | ".join(str(c) if c else "" for c in row)
+            if not r.strip(" |"):
+                continue
+            if header is None:
+                header = r
+            rows.append(r)
+            kept += 1
+            
+            if len(rows) >= self.xlsx_rows_per_page:
+                yield title + "\n" + "\n".join(rows)
+                part += 1
+                title = f"[Sheet: {name} (part {part})]"
+                rows = [header]
+        
+        if part == 1 or len(rows) > 1:
+            yield title + "\n" + "\n".join(rows)
+    
+    def _iter_pptx(self, source):
+        prs = Presentation(source)
+        for i, slide in enumerate(prs.slides, 1):
+            texts = []
+            for shape in slide.shapes:
+                if hasattr(shape, "text") and shape.text.strip():
+                    texts.append(shape.text.strip())
+            yield i, "\n".join(texts)
+    
+    def _iter_txt(self, source):
+        if _is_path(source):
+            with open(source, "r", encoding="utf-8", errors="ignore") as f:
+                text = f.read()
+        else:
+            # Same newline handling as text-mode open()
+            reader = io.TextIOWrapper(source, encoding="utf-8", errors="ignore")
+            text = reader.read()
+            reader.detach()
+        yield 1, text
+    
+    def _create_chunks(self, pages, filename, doc_id, kind=""):
+        chunks = ChunkSpans(pages, kind, doc_id, filename)
+        for page_num, text in pages.items():
+            for start, end in self._page_spans(text):
+                if end - start > MIN_CHUNK_CHARS:
+                    chunks.add(page_num, start, end)
+        return chunks
+    
+    def _page_spans(self, text):
+        """(start, end) offsets of overlapping windows of ~chunk_tokens estimated tokens,
+        snapped to whitespace so no word is cut"""
+        window = self.chunk_tokens * CHARS_PER_TOKEN
+        overlap = self.chunk_overlap_tokens * CHARS_PER_TOKEN
+        length = len(text)
+        
+        first = _NON_SPACE.search(text)
+        start = first.start() if first else length
+        while start < length:
+            end = start + window
+            if end < length:
+                # back up to the last whitespace inside the window (hard cut if there is none)
+                cut = max(text.rfind(" ", start, end), text.rfind("\n", start, end))
+                if cut > start:
+                    end = cut
+            else:
+                end = length
+            
+            stop = end
+            while stop > start and text[stop - 1].isspace():
+                stop -= 1
+            yield start, stop
+            
+            if end >= length:
+                break
+            # next window starts at the first word boundary inside the overlap
+            gap = _SPACE.search(text, max(end - overlap, start + 1), end)
+            start = gap.end() if gap else end
+            next_word = _NON_SPACE.search(text, start)
+            start = next_word.start() if next_word else length
+
+
+def parse_upload(name: str, data: bytes, file_hash: str = None, pdf_workers: int = PDF_WORKERS) -> Dict:
+    """Parse raw upload bytes into a document. Top-level so a process pool can run it."""
+    with open_upload(data) as source:
+        return DocumentProcessor(pdf_workers=pdf_workers).process(source, file_hash=file_hash, name=name)
+
+
+def parse_file(path: str, name: str = None, pdf_workers: int = PDF_WORKERS) -> Dict:
+    """Parse a file on disk the same way as an upload (hash included). Top-level for process pools."""
+    data = Path(path).read_bytes()
+    return parse_upload(name or Path(path).name, data, file_sha256(data), pdf_workers)
+
+
+def stream_upload(name: str, data: bytes, file_hash: str = None, content_path: str = None):
+    """(doc, chunk iterator) for an upload. The doc's page/word counts are complete once
+    the iterator is exhausted."""
+    processor = DocumentProcessor()
+    doc = processor.new_document(data, file_hash, name)
+    
+    def chunks():
+        with open_upload(data) as source:
+            yield from processor.stream(source, doc, content_path)
+    
+    return doc, chunks()
@@ -0,0 +1,87 @@
+"""Embedding backends - the remote Gemini model and an offline CPU-only one (no Streamlit)"""
+
+import os
+import re
+import zlib
+from functools import lru_cache
+
+import numpy as np
+import google.generativeai as genai
+
+EMBED_MODEL = "models/embedding-001"
+LOCAL_EMBED_DIM = int(os.getenv("LOCAL_EMBED_DIM", "512"))
+
+_WORD = re.compile(r"\w+")
+
+
+class EmbeddingBackend:
+    """
+    embed(texts, task) -> one vector per text (a single string gives a single vector).
+    tag names the vector space: vectors with different tags must never share a collection.
+    remote backends go through the rate limiter, retries and the embedding cache.
+    """
+    name = ""
+    tag = ""
+    remote = False
+    
+    def embed(self, content, task="retrieval_document"):
+        raise NotImplementedError
+
+
+class GeminiBackend(EmbeddingBackend):
+    name = "gemini"
+    remote = True
+    
+    def __init__(self, model: str = EMBED_MODEL):
+        self.model = model
+        self.tag = f"gemini:{model}"
+    
+    def embed(self, content, task="retrieval_document"):
+        return genai.embed_content(model=self.model, content=content, task_type=task)['embedding']
+
+
+class LocalBackend(EmbeddingBackend):
+    """
+    Offline: word unigrams, bigrams and in-word char trigrams, signed-hashed into dim
+    buckets (a sparse random projection), log-scaled and L2-normalised. Deterministic,
+    no fitting, ~1 ms per chunk on one core.
+    """
+    name = "local"
+    
+    def __init__(self, dim: int = LOCAL_EMBED_DIM):
+        self.dim = dim
+        self.tag = f"local:hash{dim}"
+    
+    def _vector(self, text):
+        words = _WORD.findall(text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        features += [f"#{w[i:i + 3]}" for w in words if len(w) > 3 for i in range(len(w) - 2)]
+        if not features:
+            features = [""]
+        
+        hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features), dtype=np.uint32, count=len(features))
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+        vector = np.bincount(hashes % self.dim, weights=signs, minlength=self.dim)
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[0], norm = 1.0, 1.0  # cosine needs a non-zero vector
+        return (vector / norm).astype(np.float32).tolist()
+    
+    def embed(self, content, task="retrieval_document"):
+        if isinstance(content, str):
+            return self._vector(content)
+        return [self._vector(text) for text in content]
+
+
+BACKENDS = {
+    "gemini": GeminiBackend,
+    "local": LocalBackend,
+}
+
+
+@lru_cache(maxsize=None)
+def get_backend(name: str) -> EmbeddingBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {name} (choose from {', '.join(BACKENDS)})")
+    return BACKENDS[name]()
@@ -0,0 +1,164 @@
+"""
+HNSW parameters for Chroma collections, and an auto-tuner that picks them (no Streamlit).
+
+M (graph degree) and construction_ef are fixed when a collection is built; search_ef can
+be changed later but Chroma only picks it up when the index is next loaded. The tuner
+sweeps all three on held-out queries: every setting gets its own throwaway build, its
+recall@k is measured against exact cosine neighbours and its latency per query timed.
+The result is the recall / latency curve and the cheapest setting that meets the target.
+
+    python hnsw_tuning.py --workspace guest --recall 0.95 [--apply]
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import itertools
+
+import numpy as np
+
+# Chroma defaults: M 16, construction_ef 100, search_ef 100
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_CONSTRUCTION_EF = int(os.getenv("HNSW_CONSTRUCTION_EF", "100"))
+HNSW_SEARCH_EF = int(os.getenv("HNSW_SEARCH_EF", "100"))
+HNSW_PARAMS = ("M", "construction_ef", "search_ef")
+
+TUNE_GRID = {
+    "M": (8, 16, 32),
+    "construction_ef": (64, 128),
+    "search_ef": (16, 32, 64, 128, 256),
+}
+TUNE_QUERIES = 200       # held-out queries
+TUNE_SAMPLE = 10000      # vectors the test indexes are built from
+TUNE_RECALL = 0.95
+BUILD_BATCH = 1000
+
+
+def hnsw_params(params=None):
+    """Defaults overlaid with params (unknown keys dropped)"""
+    merged = {"M": HNSW_M, "construction_ef": HNSW_CONSTRUCTION_EF, "search_ef": HNSW_SEARCH_EF}
+    merged.update({key: int(value) for key, value in (params or {}).items() if key in HNSW_PARAMS and value})
+    return merged
+
+
+def hnsw_metadata(params=None):
+    """Chroma collection metadata keys for params"""
+    return {f"hnsw:{key}": value for key, value in hnsw_params(params).items()}
+
+
+def built_params(collection):
+    """The HNSW settings an existing Chroma collection actually has"""
+    try:
+        config = collection.configuration["hnsw"]
+        return {"M": config["max_neighbors"], "construction_ef": config["ef_construction"],
+                "search_ef": config["ef_search"]}
+    except:
+        return {}
+
+
+def exact_neighbours(vectors, queries, k):
+    """Top-k ids by cosine similarity, brute force"""
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    scores = queries @ vectors.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row) for row in top]
+
+
+def split_holdout(vectors, queries=TUNE_QUERIES, sample=TUNE_SAMPLE, seed=0):
+    """(index vectors, held-out query vectors) - the queries are never in the index"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    order = np.random.default_rng(seed).permutation(len(vectors))
+    queries = min(queries, len(vectors) // 2)
+    return vectors[order[queries:queries + sample]], vectors[order[:queries]]
+
+
+def benchmark(client, vectors, queries, k=5, grid=None):
+    """
+    One row per setting in the grid: its params, recall@k, ms per query and build seconds.
+    Test collections live in client (use an in-memory one) and are dropped afterwards.
+    """
+    grid = dict(TUNE_GRID, **(grid or {}))
+    k = min(k, len(vectors))
+    truth = exact_neighbours(vectors, queries, k)
+    ids = [str(i) for i in range(len(vectors))]
+    query_list = queries.tolist()
+    
+    curve = []
+    for m, construction_ef, search_ef in itertools.product(grid["M"], grid["construction_ef"], grid["search_ef"]):
+        params = {"M": m, "construction_ef": construction_ef, "search_ef": search_ef}
+        name = f"hnsw_tune_{uuid.uuid4().hex[:12]}"
+        collection = client.get_or_create_collection(name=name, metadata=dict(hnsw_metadata(params), **{"hnsw:space": "cosine"}))
+        try:
+            started = time.perf_counter()
+            for start in range(0, len(vectors), BUILD_BATCH):
+                collection.add(ids=ids[start:start + BUILD_BATCH], embeddings=vectors[start:start + BUILD_BATCH])
+            build = time.perf_counter() - started
+            
+            # One query per call - what an interactive search pays
+            hits = 0
+            started = time.perf_counter()
+            for query, expected in zip(query_list, truth):
+                found = collection.query(query_embeddings=[query], n_results=k, include=[])["ids"][0]
+                hits += len(expected.intersection(int(i) for i in found))
+            latency = (time.perf_counter() - started) / max(1, len(query_list))
+        finally:
+            client.delete_collection(name)
+        
+        curve.append(dict(params, recall=round(hits / max(1, k * len(query_list)), 4),
+                          ms_per_query=round(latency * 1000, 3), build_seconds=round(build, 2)))
+    return curve
+
+
+def pick(curve, target=TUNE_RECALL):
+    """Fastest setting with recall >= target (cheaper build breaks ties); best recall if none makes it"""
+    passing = [row for row in curve if row["recall"] >= target]
+    if not passing:
+        return max(curve, key=lambda row: (row["recall"], -row["ms_per_query"])) if curve else None
+    return min(passing, key=lambda row: (row["ms_per_query"], row["M"], row["construction_ef"], row["search_ef"]))
+
+
+def autotune(client, vectors, k=5, target=TUNE_RECALL, queries=TUNE_QUERIES, sample=TUNE_SAMPLE, grid=None):
+    """Benchmark the grid on held-out queries and pick a setting"""
+    index_vectors, query_vectors = split_holdout(vectors, queries, sample)
+    if len(query_vectors) == 0 or len(index_vectors) == 0:
+        raise ValueError("Not enough vectors to tune on")
+    curve = benchmark(client, index_vectors, query_vectors, k, grid)
+    best = pick(curve, target)
+    return {
+        "k": k,
+        "target_recall": target,
+        "vectors": len(index_vectors),
+        "queries": len(query_vectors),
+        "curve": curve,
+        "best": {key: best[key] for key in HNSW_PARAMS},
+        "met": best["recall"] >= target,
+    }
+
+
+def main(argv=None):
+    from vector_store import DEFAULT_WORKSPACE, VectorStore  # vector_store imports this module
+    
+    parser = argparse.ArgumentParser(description="Tune a workspace's HNSW parameters for a recall target")
+    parser.add_argument("--workspace", default=DEFAULT_WORKSPACE, help=f"Workspace / username (default: {DEFAULT_WORKSPACE})")
+    parser.add_argument("--k", type=int, default=5, help="Results per query to measure recall at")
+    parser.add_argument("--recall", type=float, default=TUNE_RECALL, help="Recall@k target")
+    parser.add_argument("--queries", type=int, default=TUNE_QUERIES, help="Held-out queries")
+    parser.add_argument("--sample", type=int, default=TUNE_SAMPLE, help="Vectors to build the test indexes from")
+    parser.add_argument("--apply", action="store_true",
+                        help="Save the pick for the workspace and rebuild its collections with it")
+    args = parser.parse_args(argv)
+    
+    store = VectorStore(namespace=args.workspace)
+    report = store.tune_hnsw(k=args.k, target=args.recall, queries=args.queries, sample=args.sample)
+    if args.apply:
+        store.apply_hnsw(report["best"], rebuild=True)
+    print(json.dumps(report, indent=2))
+    return 0 if report["met"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""In-process BM25 inverted index - keyword retrieval with no API calls (no Streamlit)"""
+
+import re
+import math
+import heapq
+import threading
+from collections import Counter
+from operator import itemgetter
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN = re.compile(r"\w+")
+# Most frequent English words - they would only make every posting list huge
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have in is it its of on or that the this to was were will with
+""".split())
+
+
+def tokenize(text):
+    return [t for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Inverted index: term -> {key: term frequency}, plus per-key lengths for BM25's
+    length normalisation. Keys are index entry ids; add() replaces an existing key.
+    """
+    
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.lengths = {}
+        self.terms = {}
+        self.total_length = 0
+        self.loaded = False
+        self.lock = threading.RLock()
+    
+    def add(self, key, text):
+        counts = Counter(tokenize(text))
+        with self.lock:
+            self.remove(key)
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[key] = tf
+            self.terms[key] = tuple(counts)
+            self.lengths[key] = sum(counts.values())
+            self.total_length += self.lengths[key]
+    
+    def remove(self, key):
+        with self.lock:
+            if key not in self.lengths:
+                return
+            for term in self.terms.pop(key):
+                posting = self.postings[term]
+                del posting[key]
+                if not posting:
+                    del self.postings[term]
+            self.total_length -= self.lengths.pop(key)
+    
+    def clear(self):
+        with self.lock:
+            self.postings, self.lengths, self.terms = {}, {}, {}
+            self.total_length = 0
+    
+    def search(self, query, k=5, keys=None):
+        """[(key, score)] best first. keys: only score these (a set), e.g. one document's entries"""
+        with self.lock:
+            n = len(self.lengths)
+            if not n:
+                return []
+            avg_length = self.total_length / n or 1
+            scores = {}
+            for term in set(tokenize(query)):
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for key, tf in posting.items():
+                    if keys is not None and key not in keys:
+                        continue
+                    norm = 1 - self.b + self.b * self.lengths[key] / avg_length
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return heapq.nlargest(k, scores.items(), key=itemgetter(1))
+    
+    def keys(self):
+        with self.lock:
+            return set(self.lengths)
+    
+    def __len__(self):
+        return len(self.lengths)
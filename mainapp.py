@@ -1,33 +1,37 @@
-import tempfile
 import streamlit as st
 import google.generativeai as genai
 from pathlib import Path
 import os
+import io
+import hmac
+import uuid
 import hashlib
-from typing import Dict, List
+from typing import List
 from datetime import datetime
 import time
 import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+# Before the project modules - they read their settings from the environment on import
+load_dotenv()
 
 # Document Processing
-from PyPDF2 import PdfReader
-from docx import Document as DocxDocument
-from openpyxl import load_workbook
-from pptx import Presentation
+from document_processor import (
+    DocumentProcessor, ChunkSpans, INGEST_WORKERS, STREAM_MIN_MB,
+    file_sha256, diff_versions, parse_upload, stream_upload
+)
 
 # Vector DB
-import chromadb
-from chromadb.config import Settings as ChromaSettings
+from vector_store import DEFAULT_WORKSPACE, VectorStore, get_ingest_cache, set_workspace_backend
 
 # Data & Visualization
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 
-from dotenv import load_dotenv
-
-load_dotenv()
-
 # ============================================
 # ⚙️ CONFIGURATION
 # ============================================
@@ -35,6 +39,12 @@ load_dotenv()
 API_KEY = os.getenv("GEMINI_API_KEY", "")
 CREATOR = "Hammad Naeem"
 VERSION = "3.0 LUXE"
+# Accounts with a persistent workspace: "name:sha256(password),..." - everyone else
+# (guests, any other login) gets a private in-memory workspace for the session
+AUTH_USERS = dict(
+    entry.strip().split(":", 1) for entry in os.getenv("AUTH_USERS", "").split(",") if ":" in entry
+)
+
 
 # ============================================
 # 🎨 PAGE CONFIG
@@ -836,6 +846,48 @@ def show_warning(message):
 def show_info(message):
     st.markdown(f'<div class="info-box">💡 {message}</div>', unsafe_allow_html=True)
 
+PROMPT_CONTENT_CHARS = 15000  # AIAssistant never reads past this
+
+
+def doc_content(doc, limit=None):
+    """Document text, built on demand: from the page texts behind the chunk spans,
+    or from disk for streamed documents"""
+    if "content" in doc:
+        return doc["content"][:limit] if limit else doc["content"]
+    if isinstance(doc.get("chunks"), ChunkSpans):
+        return doc["chunks"].content(limit)
+    try:
+        with open(doc["content_path"], "r", encoding="utf-8") as f:
+            return f.read(limit) if limit else f.read()
+    except (KeyError, OSError):
+        return ""
+
+
+def doc_chunk_count(doc):
+    return doc.get("chunk_count", len(doc.get("chunks", [])))
+
+
+def chunks_for_file(chunks, name):
+    """Point chunk citations at the name the document was uploaded under"""
+    if isinstance(chunks, ChunkSpans):
+        return chunks.with_file(name)
+    return [dict(c, file=name) for c in chunks]
+
+
+def result_sources(result):
+    """Every file/page a search hit stands for - deduplicated chunks cite all their copies"""
+    meta = result.get("meta", {}) or {}
+    return result.get("sources") or [{"file": meta.get("file"), "page": meta.get("page")}]
+
+
+def source_label(result, default="Unknown"):
+    sources = result_sources(result)
+    label = f"{sources[0]['file'] or default} - Page {sources[0]['page'] or '?'}"
+    if len(sources) > 1:
+        label += " (also: " + ", ".join(f"{s['file']} p.{s['page']}" for s in sources[1:4]) + ")"
+    return label
+
+
 def add_watermark(content: str) -> str:
     """Add creator watermark"""
     header = f"""
@@ -919,216 +971,6 @@ def find_model(api_key: str):
         return None, f"Model discovery failed: {last_error[:120]}"
 
 
-# ============================================
-# 📄 DOCUMENT PROCESSOR
-# ============================================
-
-class DocumentProcessor:
-    def process(self, path: str) -> Dict:
-        """Process uploaded document"""
-        p = Path(path)
-        ext = p.suffix.lower()
-        
-        try:
-            if ext == ".pdf":
-                content, pages = self._read_pdf(path)
-            elif ext == ".docx":
-                content, pages = self._read_docx(path)
-            elif ext == ".xlsx":
-                content, pages = self._read_excel(path)
-            elif ext == ".pptx":
-                content, pages = self._read_pptx(path)
-            elif ext == ".txt":
-                content, pages = self._read_txt(path)
-            else:
-                raise ValueError(f"Unsupported: {ext}")
-            
-            doc_id = hashlib.md5(f"{p.name}{datetime.now()}".encode()).hexdigest()[:16]
-            
-            return {
-                "id": doc_id,
-                "name": p.name,
-                "type": ext[1:].upper(),
-                "content": content,
-                "chunks": self._create_chunks(pages, p.name, doc_id),
-                "pages": len(pages),
-                "size": p.stat().st_size,
-                "uploaded": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "word_count": len(content.split())
-            }
-        except Exception as e:
-            raise Exception(f"Error: {str(e)}")
-    
-    def _read_pdf(self, path):
-        reader = PdfReader(path)
-        pages = {}
-        for i, page in enumerate(reader.pages, 1):
-            text = page.extract_text() or ""
-            pages[i] = text.strip()
-        content = "\n\n".join([f"[Page {k}]\n{v}" for k, v in pages.items() if v])
-        return content, pages
-    
-    def _read_docx(self, path):
-        doc = DocxDocument(path)
-        paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
-        text = "\n\n".join(paragraphs)
-        return text, {1: text}
-    
-    def _read_excel(self, path):
-        wb = load_workbook(path, data_only=True)
-        pages = {}
-        for i, name in enumerate(wb.sheetnames, 1):
-            sheet = wb[name]
-            rows = []
-            for row in sheet.iter_rows(values_only=True):
-                r = " | ".join(str(c) if c else "" for c in row)
-                if r.strip(" |"):
-                    rows.append(r)
-            pages[i] = f"[Sheet: {name}]\n" + "\n".join(rows)
-        return "\n\n".join(pages.values()), pages
-    
-    def _read_pptx(self, path):
-        prs = Presentation(path)
-        pages = {}
-        for i, slide in enumerate(prs.slides, 1):
-            texts = []
-            for shape in slide.shapes:
-                if hasattr(shape, "text") and shape.text.strip():
-                    texts.append(shape.text.strip())
-            pages[i] = "\n".join(texts)
-        content = "\n\n".join([f"[Slide {k}]\n{v}" for k, v in pages.items()])
-        return content, pages
-    
-    def _read_txt(self, path):
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            text = f.read()
-        return text, {1: text}
-    
-    def _create_chunks(self, pages, filename, doc_id):
-        chunks = []
-        chunk_size = 500
-        overlap = 100
-        
-        for page_num, text in pages.items():
-            if not text.strip():
-                continue
-            words = text.split()
-            
-            for i in range(0, len(words), chunk_size - overlap):
-                chunk_words = words[i:i + chunk_size]
-                chunk_text = " ".join(chunk_words)
-                
-                if len(chunk_text) > 80:
-                    chunks.append({
-                        "id": f"{doc_id}_p{page_num}_c{i}",
-                        "text": chunk_text,
-                        "page": page_num,
-                        "file": filename
-                    })
-        return chunks
-
-
-# ============================================
-# 🗄️ VECTOR DATABASE
-# ============================================
-
-class VectorStore:
-    def __init__(self):
-        # Memory-based DB setup (Vercel ke liye best)
-        os.environ['ANONYMIZED_TELEMETRY'] = 'False'
-        
-        self.client = chromadb.EphemeralClient(
-            settings=ChromaSettings(
-                anonymized_telemetry=False,
-                allow_reset=True
-            )
-        )
-        self.collection = self.client.get_or_create_collection(
-            name="docs",
-            metadata={"hnsw:space": "cosine"}
-        )
-    
-    
-    def _embed(self, text, task="retrieval_document"):
-        try:
-            result = genai.embed_content(
-                model="models/embedding-001",
-                content=text[:8000],
-                task_type=task
-            )
-            return result['embedding']
-        except:
-            return [0.0] * 768
-    
-    def add_document(self, doc_id, chunks):
-        if not chunks:
-            return
-        
-        ids, embeddings, documents, metadatas = [], [], [], []
-        
-        for chunk in chunks:
-            try:
-                ids.append(f"{doc_id}_{chunk['id']}")
-                embeddings.append(self._embed(chunk['text']))
-                documents.append(chunk['text'])
-                metadatas.append({
-                    "doc_id": doc_id,
-                    "page": str(chunk['page']),
-                    "file": chunk['file']
-                })
-            except:
-                continue
-        
-        if ids:
-            try:
-                self.collection.add(
-                    ids=ids,
-                    embeddings=embeddings,
-                    documents=documents,
-                    metadatas=metadatas
-                )
-            except Exception as e:
-                pass
-    
-    def search(self, query, k=5):
-        try:
-            count = self.collection.count()
-            if count == 0:
-                return []
-            
-            embedding = self._embed(query, "retrieval_query")
-            results = self.collection.query(
-                query_embeddings=[embedding],
-                n_results=min(k, count)
-            )
-            
-            output = []
-            if results['documents'] and results['documents'][0]:
-                for i, doc in enumerate(results['documents'][0]):
-                    output.append({
-                        "text": doc,
-                        "meta": results['metadatas'][0][i] if results['metadatas'] else {},
-                        "distance": results['distances'][0][i] if results.get('distances') else 0
-                    })
-            return sorted(output, key=lambda x: x.get('distance', 999))
-        except:
-            return []
-    
-    def delete_document(self, doc_id):
-        try:
-            results = self.collection.get(where={"doc_id": doc_id})
-            if results['ids']:
-                self.collection.delete(ids=results['ids'])
-        except:
-            pass
-    
-    def count(self):
-        try:
-            return self.collection.count()
-        except:
-            return 0
-
-
 # ============================================
 # 🤖 AI ASSISTANT
 # ============================================
@@ -1196,8 +1038,7 @@ class AIAssistant:
         """Answer question from context"""
         context_text = ""
         for i, c in enumerate(context, 1):
-            meta = c.get("meta", {})
-            context_text += f"\n[Source {i}: {meta.get('file', 'Unknown')} - Page {meta.get('page', '?')}]\n{c['text']}\n"
+            context_text += f"\n[Source {i}: {source_label(c)}]\n{c['text']}\n"
         
         lang_note = "Answer in roman (roman )" if language == "hi" else "Answer in clear English"
         
@@ -1223,14 +1064,11 @@ ANSWER:"""
         sources = []
         seen = set()
         for c in context[:5]:
-            meta = c.get("meta", {})
-            key = f"{meta.get('file', '')}-{meta.get('page', '')}"
-            if key not in seen and meta.get('file'):
-                sources.append({
-                    "file": meta.get("file"),
-                    "page": meta.get("page")
-                })
-                seen.add(key)
+            for source in result_sources(c):
+                key = f"{source['file']}-{source['page']}"
+                if key not in seen and source['file']:
+                    sources.append(source)
+                    seen.add(key)
         
         return {"answer": answer, "sources": sources}
     
@@ -1324,24 +1162,37 @@ Create {count} flashcards:"""
 # 🎯 SMART ANSWER ENGINE (ChatGPT Style)
 # ============================================
 
-def smart_answer_engine(question, language="en"):
+def suggestion_results(suggestions):
+    """Retrieval for all suggestion buttons in one batched search - reused until the docs change"""
+    if not (st.session_state.db and st.session_state.docs):
+        return [None] * len(suggestions)
+    key = (tuple(suggestions), st.session_state.db.count())
+    cached = st.session_state.get("suggestion_results")
+    if not cached or cached[0] != key:
+        cached = (key, st.session_state.db.search_many(suggestions, k=5))
+        st.session_state.suggestion_results = cached
+    return cached[1]
+
+
+def smart_answer_engine(question, language="en", doc_results=None):
     """
     Hybrid AI - ALWAYS answers from both documents AND general knowledge
     Kabhi bhi "not found" nahi bolega
+    doc_results: already retrieved chunks (e.g. from search_many) - skips the search
     """
     try:
         # Step 1: Documents mein search karo
-        doc_results = []
         doc_context = ""
         has_docs = False
         
-        if st.session_state.db and st.session_state.docs:
-            doc_results = st.session_state.db.search(question, k=5)
-            if doc_results and len(doc_results) > 0:
-                has_docs = True
-                for i, result in enumerate(doc_results[:3], 1):
-                    meta = result.get("meta", {})
-                    doc_context += f"\n[Source {i}: {meta.get('file', 'Doc')} - Page {meta.get('page', '?')}]\n{result['text']}\n"
+        if doc_results is None:
+            doc_results = []
+            if st.session_state.db and st.session_state.docs:
+                doc_results = st.session_state.db.search(question, k=5)
+        if doc_results and len(doc_results) > 0:
+            has_docs = True
+            for i, result in enumerate(doc_results[:3], 1):
+                doc_context += f"\n[Source {i}: {source_label(result, 'Doc')}]\n{result['text']}\n"
         
         # Step 2: ALWAYS use general knowledge + documents (hybrid approach)
         if language == "hi":
@@ -1450,12 +1301,11 @@ Answer:"""
         if has_docs:
             seen = set()
             for result in doc_results[:3]:
-                meta = result.get("meta", {})
-                file = meta.get('file', '')
-                page = meta.get('page', '')
-                if file and f"{file}-{page}" not in seen:
-                    sources.append({"file": file, "page": page})
-                    seen.add(f"{file}-{page}")
+                for source in result_sources(result):
+                    file, page = source['file'] or '', source['page'] or ''
+                    if file and f"{file}-{page}" not in seen:
+                        sources.append({"file": file, "page": page})
+                        seen.add(f"{file}-{page}")
         
         return {
             "answer": answer,
@@ -1484,6 +1334,7 @@ if 'initialized' not in st.session_state:
     st.session_state.initialized = True
     st.session_state.logged_in = False
     st.session_state.username = ""
+    st.session_state.workspace = ""
     st.session_state.docs = {}
     st.session_state.chat = []
     st.session_state.student_chat = []
@@ -1496,12 +1347,30 @@ if 'initialized' not in st.session_state:
     st.session_state.processor = DocumentProcessor()
     st.session_state.api_key = None
     st.session_state.connection_error = None
+    st.session_state.ingest_report = []
+    st.session_state.ingest_failed = set()
+    st.session_state.upload_hashes = {}
 
 
 # ============================================
 # 🔐 LOGIN PAGE
 # ============================================
 
+def verified_login(username, password):
+    """True only for an AUTH_USERS account with the right password"""
+    expected = AUTH_USERS.get(username.strip().lower())
+    if not expected:
+        return False
+    return hmac.compare_digest(hashlib.sha256(password.encode("utf-8")).hexdigest(), expected.lower())
+
+
+def start_session(username, verified=False):
+    st.session_state.logged_in = True
+    st.session_state.username = username
+    # Persistent workspaces are keyed by name - only a checked password may open one
+    st.session_state.workspace = username if verified else f"session_{uuid.uuid4().hex[:12]}"
+
+
 def show_login_page():
     """Display login page"""
     st.markdown('<h1 class="hero-header">✨ AI Document Studio</h1>', unsafe_allow_html=True)
@@ -1535,8 +1404,7 @@ def show_login_page():
                 if username and password:
                     # Simple authentication (in production, use proper auth)
                     if len(username) >= 3 and len(password) >= 4:
-                        st.session_state.logged_in = True
-                        st.session_state.username = username
+                        start_session(username, verified_login(username, password))
                         st.rerun()
                     else:
                         show_error("Invalid credentials. Username min 3 chars, Password min 4 chars.")
@@ -1547,8 +1415,7 @@ def show_login_page():
         
         # Guest Access
         if st.button("👁️ Continue as Guest", use_container_width=True):
-            st.session_state.logged_in = True
-            st.session_state.username = "Guest"
+            start_session("Guest")
             st.rerun()
     
     # Features Section
@@ -1598,6 +1465,252 @@ def show_login_page():
 # 📱 SIDEBAR
 # ============================================
 
+def streamed_doc_path(doc_id, suffix):
+    """Where a streamed document's spooled content (.txt) and header (.json) live"""
+    return st.session_state.db.content_path(doc_id, suffix)
+
+
+def remove_streamed_files(doc):
+    if "content_path" in doc:
+        for path in (Path(doc["content_path"]), streamed_doc_path(doc["id"], ".json")):
+            if path.exists():
+                path.unlink()
+
+
+def upload_hash(file):
+    """sha256 of an upload, remembered per uploader file so reruns don't hash it again"""
+    key = getattr(file, "file_id", None) or f"{file.name}:{file.size}"
+    if key not in st.session_state.upload_hashes:
+        st.session_state.upload_hashes[key] = file_sha256(file.getvalue())
+    return st.session_state.upload_hashes[key]
+
+
+def id_shared(name, doc_id):
+    """Is this index entry also behind another loaded document?"""
+    return any(d["id"] == doc_id for other, d in st.session_state.docs.items() if other != name)
+
+
+def is_new_version(file):
+    """Same name as a loaded document but different bytes"""
+    loaded = st.session_state.docs.get(file.name)
+    return bool(loaded and loaded.get("hash") and upload_hash(file) != loaded["hash"])
+
+
+def private_workspace():
+    workspace = st.session_state.get("workspace")
+    return not workspace or workspace.startswith("session_")
+
+
+def open_workspace():
+    """Attach the session to the user's workspace and restore its documents. Private
+    (unverified) workspaces live in the session's own in-memory index and start empty."""
+    if private_workspace():
+        st.session_state.workspace = st.session_state.get("workspace") or f"session_{uuid.uuid4().hex[:12]}"
+        # Reopening (backend switch, restored snapshot) keeps the session's own index
+        previous = st.session_state.get("db")
+        client = previous.client if previous is not None and previous.private and previous.namespace == st.session_state.workspace else None
+        st.session_state.db = VectorStore(namespace=st.session_state.workspace, private=True, client=client)
+    else:
+        st.session_state.db = VectorStore(namespace=st.session_state.workspace)
+    cache = get_ingest_cache()
+    
+    for doc_id, info in st.session_state.db.list_documents().items():
+        name = info["file"]
+        if name in st.session_state.docs:
+            continue
+        
+        cached = cache.get(info["hash"]) if info["hash"] else None
+        header = streamed_doc_path(doc_id, ".json")
+        if cached:
+            doc = dict(cached[0], name=name)
+            doc["chunks"] = chunks_for_file(doc["chunks"], name)
+        elif header.exists():
+            # Streamed document - content stays on disk
+            doc = dict(json.loads(header.read_text(encoding="utf-8")), name=name)
+        else:
+            # Ingestion cache evicted it - rebuild from the indexed chunks
+            chunks = st.session_state.db.get_document_chunks(doc_id)
+            content = "\n\n".join(c["text"] for c in chunks)
+            doc = {
+                "id": doc_id,
+                "hash": info["hash"],
+                "name": name,
+                "type": Path(name).suffix[1:].upper(),
+                "content": content,
+                "chunks": chunks,
+                "pages": len({c["page"] for c in chunks}),
+                "size": 0,
+                "uploaded": "",
+                "word_count": len(content.split())
+            }
+        st.session_state.docs[name] = doc
+
+
+def ingest_uploads(files):
+    """
+    Batch ingestion: parse all new uploads in parallel worker processes, embed their
+    chunks together in shared batches, and show a per-file progress table. A file
+    whose name is already loaded replaces that document as its next version.
+    Returns the number of documents added or updated.
+    """
+    cache = get_ingest_cache()
+    table = st.empty()
+    rows = {f.name: {"File": f.name, "Status": "⏳ Queued", "Chunks": 0} for f in files}
+    
+    def refresh():
+        table.dataframe(pd.DataFrame(list(rows.values())), hide_index=True, use_container_width=True)
+    
+    # 1. Cache hits skip parsing and embedding
+    ready, to_parse, to_stream = [], [], []
+    for file in files:
+        data = file.getvalue()
+        file_hash = upload_hash(file)
+        # Vectors only come back if they were made by this workspace's embedding backend
+        cached = cache.get(file_hash, st.session_state.db.backend.tag)
+        if cached:
+            doc, vectors = cached
+            doc = dict(doc, name=file.name, uploaded=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            doc["chunks"] = chunks_for_file(doc["chunks"], file.name)
+            ready.append((file, file_hash, doc, vectors or None))
+            rows[file.name].update(Status="⚡ Cached" if vectors else "✅ Parsed", Chunks=len(doc["chunks"]))
+        elif file.size >= STREAM_MIN_MB * 1024 * 1024:
+            to_stream.append((file, data, file_hash))
+        else:
+            to_parse.append((file, data, file_hash))
+            rows[file.name]["Status"] = "⚙️ Parsing"
+    refresh()
+    
+    # 2. Parsing is CPU-bound - spread it over processes when there is more than one file
+    def parse_results():
+        if len(to_parse) <= 1 or INGEST_WORKERS <= 1:
+            for file, data, file_hash in to_parse:
+                try:
+                    yield file, file_hash, parse_upload(file.name, data, file_hash), None
+                except Exception as e:
+                    yield file, file_hash, None, e
+            return
+        
+        # Share the cores between files so big PDFs don't spawn a full page pool each
+        pdf_workers = max(1, (os.cpu_count() or 1) // len(to_parse))
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(INGEST_WORKERS, len(to_parse)), mp_context=ctx) as pool:
+            futures = {pool.submit(parse_upload, file.name, data, file_hash, pdf_workers): (file, file_hash)
+                       for file, data, file_hash in to_parse}
+            for future in as_completed(futures):
+                file, file_hash = futures[future]
+                try:
+                    yield file, file_hash, future.result(), None
+                except Exception as e:
+                    yield file, file_hash, None, e
+    
+    for file, file_hash, doc, error in parse_results():
+        if error is not None:
+            rows[file.name]["Status"] = f"❌ {str(error)[:80]}"
+            st.session_state.ingest_failed.add(f"{file.name}:{file.size}")
+        else:
+            ready.append((file, file_hash, doc, None))
+            rows[file.name].update(Status="✅ Parsed", Chunks=len(doc["chunks"]))
+        refresh()
+    
+    # 3. New versions of loaded documents: only changed chunks are embedded and swapped
+    updated = set()
+    for file, file_hash, doc, vectors in ready:
+        previous = st.session_state.docs.get(file.name)
+        if not previous or id_shared(file.name, previous["id"]):
+            continue
+        
+        rows[file.name]["Status"] = "🔁 Updating"
+        refresh()
+        doc["id"], doc["chunks"] = previous["id"], doc["chunks"].with_id(previous["id"])
+        doc["version"] = previous.get("version", 1) + 1
+        indexed, stats = st.session_state.db.update_document(doc["id"], doc["chunks"], doc_hash=file_hash)
+        if not stats["failed"]:
+            cache.put(file_hash, doc, indexed, st.session_state.db.backend.tag)
+        remove_streamed_files(previous)
+        
+        status = f"🔁 v{doc['version']}: {stats['kept'] + stats['reused'] + stats['merged']} kept, {stats['embedded']} re-embedded"
+        if isinstance(previous.get("chunks"), ChunkSpans):
+            pages = diff_versions(previous["chunks"], doc["chunks"])
+            status += f" ({pages['changed'] + pages['added']} pages changed)"
+        if stats["failed"]:
+            status = f"⚠️ {stats['failed']} chunks not embedded"
+        rows[file.name]["Status"] = status
+        updated.add(file.name)
+    refresh()
+    
+    # 4. One embedding stage for every new document (same content already loaded ho to skip)
+    loaded_ids = {d["id"] for d in st.session_state.docs.values()}
+    items, targets = [], []
+    for file, file_hash, doc, vectors in ready:
+        if file.name in updated:
+            continue
+        if doc["id"] not in loaded_ids:
+            loaded_ids.add(doc["id"])
+            items.append((doc["id"], doc["chunks"], vectors, file_hash))
+            targets.append((file, file_hash, doc, vectors))
+            if vectors is None:
+                rows[file.name]["Status"] = "🧠 Embedding"
+    refresh()
+    
+    if items:
+        with st.spinner(f"Embedding {sum(len(i[1]) for i in items)} chunks..."):
+            results = st.session_state.db.add_documents(items)
+        
+        for (file, file_hash, doc, vectors), indexed in zip(targets, results):
+            missing = len(doc["chunks"]) - len(indexed)
+            # Sirf complete aur real embeddings cache karo
+            if vectors is None and not missing and all(any(v) for v in indexed):
+                cache.put(file_hash, doc, indexed, st.session_state.db.backend.tag)
+            if missing:
+                rows[file.name]["Status"] = f"⚠️ {missing} chunks not embedded"
+            elif vectors is None:
+                rows[file.name]["Status"] = "✅ Done"
+    
+    # 5. Very large files: pages -> chunks -> index in bounded batches, never whole in memory
+    for file, data, file_hash in to_stream:
+        if file_hash[:16] in loaded_ids:
+            rows[file.name]["Status"] = "⚡ Already loaded"
+            refresh()
+            continue
+        
+        # Streamed files are indexed straight from the page stream - a new version replaces the old one
+        previous = st.session_state.docs.get(file.name)
+        if previous and not id_shared(file.name, previous["id"]):
+            st.session_state.db.delete_document(previous["id"])
+            remove_streamed_files(previous)
+        
+        try:
+            content_path = streamed_doc_path(file_hash[:16], ".txt")
+            doc, chunks = stream_upload(file.name, data, file_hash, content_path=str(content_path))
+            
+            def progress(indexed, total, name=file.name):
+                rows[name].update(Status=f"🌊 Streaming ({indexed}/{total} indexed)", Chunks=total)
+                refresh()
+            
+            indexed, total = st.session_state.db.add_stream(doc["id"], chunks, doc_hash=file_hash, on_batch=progress)
+            doc.update({"chunks": [], "chunk_count": total, "content_path": str(content_path)})
+            if previous:
+                doc["version"] = previous.get("version", 1) + 1
+            streamed_doc_path(doc["id"], ".json").write_text(json.dumps(doc), encoding="utf-8")
+            
+            loaded_ids.add(doc["id"])
+            ready.append((file, file_hash, doc, None))
+            missing = total - indexed
+            rows[file.name].update(Status=f"⚠️ {missing} chunks not embedded" if missing else "✅ Done", Chunks=total)
+        except Exception as e:
+            rows[file.name]["Status"] = f"❌ {str(e)[:80]}"
+            st.session_state.ingest_failed.add(f"{file.name}:{file.size}")
+        refresh()
+    
+    # 6. Session mein save karna
+    for file, file_hash, doc, vectors in ready:
+        st.session_state.docs[file.name] = doc
+    
+    refresh()
+    st.session_state.ingest_report = list(rows.values())
+    return len(ready)
+
+
 def show_sidebar():
     """Display sidebar"""
     with st.sidebar:
@@ -1638,7 +1751,7 @@ def show_sidebar():
                     genai.configure(api_key=api_key.strip())
                     st.session_state.api_key = api_key.strip()
                     st.session_state.model = model
-                    st.session_state.db = VectorStore()
+                    open_workspace()
                     st.session_state.ai = AIAssistant(model)
                     st.session_state.connected = True
                     st.session_state.connection_error = None
@@ -1655,7 +1768,7 @@ def show_sidebar():
                     genai.configure(api_key=api_key.strip())
                     st.session_state.api_key = api_key.strip()
                     st.session_state.model = model
-                    st.session_state.db = VectorStore()
+                    open_workspace()
                     st.session_state.ai = AIAssistant(model)
                     st.session_state.connected = True
                     st.session_state.connection_error = None
@@ -1694,6 +1807,23 @@ def show_sidebar():
         if st.session_state.connected:
             st.markdown("### 📁 Documents")
             
+            # Embedding backend is per workspace - every session of this user indexes into the same space
+            backends = {"☁️ Gemini": "gemini", "💻 Local (offline)": "local"}
+            current = st.session_state.db.backend.name
+            choice = st.radio(
+                "Embeddings",
+                list(backends),
+                index=list(backends.values()).index(current) if current in backends.values() else 0,
+                horizontal=True,
+                help="Local embeddings run on this machine - no API calls, no quota, somewhat less precise"
+            )
+            if backends[choice] != current:
+                set_workspace_backend(st.session_state.workspace, backends[choice])
+                open_workspace()
+                st.rerun()
+            if st.session_state.db.fell_back:
+                st.caption("⚠️ Gemini embedding quota used up - new documents are indexed offline")
+            
             files = st.file_uploader(
                 "Upload files",
                 type=["pdf", "docx", "xlsx", "pptx", "txt"],
@@ -1702,33 +1832,20 @@ def show_sidebar():
             )
             
             if files:
-                for file in files:
-                    if file.name not in st.session_state.docs:
-                        with st.spinner(f"Processing {file.name}..."):
-                            try:
-                                # 1. Temporary file banana (Vercel RAM ke liye)
-                                with tempfile.NamedTemporaryFile(delete=False, suffix=Path(file.name).suffix) as tmp:
-                                    tmp.write(file.getvalue())
-                                    tmp_path = tmp.name
-                                
-                                # 2. Document process karna
-                                doc = st.session_state.processor.process(tmp_path)
-                                
-                                # 3. Vector Database mein add karna
-                                st.session_state.db.add_document(doc["id"], doc["chunks"])
-                                
-                                # 4. Session mein save karna
-                                st.session_state.docs[file.name] = doc
-                                
-                                # 5. Temporary file delete karna (Disk clean rakhne ke liye)
-                                if os.path.exists(tmp_path):
-                                    os.remove(tmp_path)
-                                
-                                st.success(f"✅ {file.name} successfully processed!")
-                                time.sleep(0.3)
-                                st.rerun()
-                            except Exception as e:
-                                st.error(f"❌ Error processing {file.name}: {str(e)}")
+                # Last upload per name wins - a re-uploaded name is a new version of that document
+                latest = {f.name: f for f in files}.values()
+                new_files = [
+                    f for f in latest
+                    if (f.name not in st.session_state.docs or is_new_version(f))
+                    and f"{f.name}:{f.size}" not in st.session_state.ingest_failed
+                ]
+                if new_files and ingest_uploads(new_files):
+                    time.sleep(0.3)
+                    st.rerun()
+            
+            if st.session_state.ingest_report:
+                with st.expander("📋 Last upload", expanded=False):
+                    st.dataframe(pd.DataFrame(st.session_state.ingest_report), hide_index=True, use_container_width=True)
             
             # Document List
             if st.session_state.docs:
@@ -1736,22 +1853,56 @@ def show_sidebar():
                 
                 for name, doc in list(st.session_state.docs.items()):
                     with st.expander(f"📄 {name[:20]}...", expanded=False):
-                        st.caption(f"Type: {doc['type']} | Pages: {doc['pages']}")
+                        version = f" | v{doc['version']}" if doc.get("version", 1) > 1 else ""
+                        st.caption(f"Type: {doc['type']} | Pages: {doc['pages']}{version}")
                         st.caption(f"Words: {doc['word_count']:,}")
                         
                         if st.button("🗑️ Remove", key=f"rm_{name}", use_container_width=True):
-                            st.session_state.db.delete_document(doc['id'])
                             del st.session_state.docs[name]
+                            # Same content kisi aur naam se loaded ho to index rehne do
+                            if not any(d["id"] == doc["id"] for d in st.session_state.docs.values()):
+                                st.session_state.db.delete_document(doc['id'])
+                                remove_streamed_files(doc)
                             st.rerun()
                 
                 if st.button("🗑️ Clear All", use_container_width=True, type="secondary"):
+                    st.session_state.db.delete_documents({doc['id'] for doc in st.session_state.docs.values()})
                     for doc in st.session_state.docs.values():
-                        st.session_state.db.delete_document(doc['id'])
+                        remove_streamed_files(doc)
                     st.session_state.docs = {}
                     st.session_state.chat = []
                     st.session_state.student_chat = []
                     st.rerun()
         
+            # Snapshot - poora workspace ek file mein, restore pe koi embedding call nahi
+            with st.expander("💾 Snapshot", expanded=False):
+                if st.session_state.docs and st.button("📦 Prepare export", use_container_width=True):
+                    buffer = io.BytesIO()
+                    with st.spinner("Packing workspace..."):
+                        st.session_state.db.export_snapshot(buffer, st.session_state.docs.values())
+                    st.session_state.snapshot_bytes = buffer.getvalue()
+                if st.session_state.get("snapshot_bytes"):
+                    st.download_button(
+                        "⬇️ Download snapshot",
+                        st.session_state.snapshot_bytes,
+                        file_name=f"{st.session_state.username or DEFAULT_WORKSPACE}.dssnap",
+                        mime="application/zip",
+                        use_container_width=True
+                    )
+                
+                snapshot = st.file_uploader("Restore snapshot", type=["dssnap"], key="snapshot_upload")
+                if snapshot:
+                    key = getattr(snapshot, "file_id", None) or f"{snapshot.name}:{snapshot.size}"
+                    if key != st.session_state.get("snapshot_loaded"):
+                        try:
+                            with st.spinner("Restoring..."):
+                                report = st.session_state.db.import_snapshot(snapshot)
+                            st.session_state.snapshot_loaded = key
+                            open_workspace()
+                            show_success(f"Restored {len(report['documents'])} documents ({report['entries']:,} chunks)")
+                        except Exception as e:
+                            show_error(f"Snapshot restore failed: {str(e)[:120]}")
+        
         st.markdown('<div class="fancy-divider"></div>', unsafe_allow_html=True)
         
         # Language
@@ -1774,12 +1925,29 @@ def show_sidebar():
         with col2:
             st.metric("Chunks", st.session_state.db.count() if st.session_state.db else 0)
         
+        if st.session_state.db:
+            cache_stats = st.session_state.db.embed_cache.stats()
+            st.caption(
+                f"⚡ Embed cache: {cache_stats['hits']:,} embeddings reused "
+                f"({cache_stats['hit_rate']:.0%} hit rate, {cache_stats['entries']:,} stored)"
+            )
+        
         st.markdown('<div class="fancy-divider"></div>', unsafe_allow_html=True)
         
         # Logout
         if st.button("🚪 Logout", use_container_width=True):
+            if st.session_state.db and private_workspace():
+                # Nobody can reopen a private workspace - free it now
+                st.session_state.db.drop()
             st.session_state.logged_in = False
             st.session_state.username = ""
+            st.session_state.workspace = ""
+            # Workspace is per user - next login reopens its own
+            st.session_state.connected = False
+            st.session_state.db = None
+            st.session_state.docs = {}
+            st.session_state.chat = []
+            st.session_state.student_chat = []
             st.rerun()
 
 
@@ -1816,6 +1984,14 @@ def enterprise_mode():
             
             st.markdown('<div class="fancy-divider"></div>', unsafe_allow_html=True)
             
+            # Scope - ek document chuno to search sirf usi ke chunks mein hota hai
+            scope = None
+            if len(st.session_state.docs) > 1:
+                all_docs = "📚 All documents"
+                picked = st.selectbox("Search in", [all_docs] + list(st.session_state.docs.keys()), key="ent_scope")
+                if picked != all_docs:
+                    scope = st.session_state.docs[picked]["id"]
+            
             # Input
             col1, col2 = st.columns([5, 1])
             
@@ -1834,7 +2010,7 @@ def enterprise_mode():
                 st.session_state.chat.append({"role": "user", "content": question})
                 
                 with st.spinner("🔍 Analyzing documents..."):
-                    results = st.session_state.db.search(question, k=5)
+                    results = st.session_state.db.search(question, k=5, doc_id=scope)
                     
                     if not results:
                         response = {"answer": "No relevant information found in documents.", "sources": []}
@@ -1876,7 +2052,7 @@ def enterprise_mode():
             if st.button("✨ Generate Summary", use_container_width=True, key="sum_btn"):
                 with st.spinner("Creating summary..."):
                     style_map = {"Brief": "brief", "Detailed": "detailed", "Bullet Points": "bullets", "Cheat Sheet": "cheatsheet"}
-                    content = st.session_state.docs[doc_name]["content"]
+                    content = doc_content(st.session_state.docs[doc_name], PROMPT_CONTENT_CHARS)
                     summary = st.session_state.ai.summarize(content, style_map[style], st.session_state.lang)
                     
                     st.markdown("### 📋 Summary")
@@ -1901,7 +2077,7 @@ def enterprise_mode():
             col1, col2, col3, col4 = st.columns(4)
             
             total_pages = sum(d["pages"] for d in st.session_state.docs.values())
-            total_chunks = sum(len(d["chunks"]) for d in st.session_state.docs.values())
+            total_chunks = sum(doc_chunk_count(d) for d in st.session_state.docs.values())
             total_words = sum(d["word_count"] for d in st.session_state.docs.values())
             
             with col1:
@@ -1939,7 +2115,7 @@ def enterprise_mode():
             
             with col2:
                 names = [n[:12] for n in st.session_state.docs.keys()]
-                chunks = [len(d["chunks"]) for d in st.session_state.docs.values()]
+                chunks = [doc_chunk_count(d) for d in st.session_state.docs.values()]
                 
                 fig = go.Figure(data=[go.Bar(
                     x=names,
@@ -1970,7 +2146,7 @@ def enterprise_mode():
                 
                 if st.button("🔍 Extract Keywords", key="kw_btn"):
                     with st.spinner("Extracting..."):
-                        prompt = f"Extract top {num} keywords and key concepts from:\n\n{st.session_state.docs[doc]['content'][:10000]}\n\nFormat as a list with brief explanations."
+                        prompt = f"Extract top {num} keywords and key concepts from:\n\n{doc_content(st.session_state.docs[doc], 10000)}\n\nFormat as a list with brief explanations."
                         result = st.session_state.ai.generate(prompt)
                         st.markdown(f'<div class="content-box">{result}</div>', unsafe_allow_html=True)
             
@@ -1985,7 +2161,7 @@ def enterprise_mode():
                             "Topics": "Identify main topics and themes:",
                             "Readability": "Assess readability level and target audience:"
                         }
-                        prompt = f"{prompts[analysis]}\n\n{st.session_state.docs[doc]['content'][:10000]}"
+                        prompt = f"{prompts[analysis]}\n\n{doc_content(st.session_state.docs[doc], 10000)}"
                         result = st.session_state.ai.generate(prompt)
                         st.markdown(f'<div class="content-box">{result}</div>', unsafe_allow_html=True)
             
@@ -2001,10 +2177,10 @@ def enterprise_mode():
                             prompt = f"""Compare these documents:
 
 Document 1: {doc1}
-{st.session_state.docs[doc1]['content'][:5000]}
+{doc_content(st.session_state.docs[doc1], 5000)}
 
 Document 2: {doc2}
-{st.session_state.docs[doc2]['content'][:5000]}
+{doc_content(st.session_state.docs[doc2], 5000)}
 
 Provide: similarities, differences, unique insights from each."""
                             result = st.session_state.ai.generate(prompt)
@@ -2085,7 +2261,8 @@ def student_mode():
                         st.session_state.student_chat.append({"role": "user", "content": suggestions[i]})
                         
                         with st.spinner("Thinking..." if st.session_state.lang == "en" else "Soch raha hoon..."):
-                            response = smart_answer_engine(suggestions[i], st.session_state.lang)
+                            retrieved = suggestion_results(suggestions)[i]
+                            response = smart_answer_engine(suggestions[i], st.session_state.lang, retrieved)
                             
                             st.session_state.student_chat.append({
                                 "role": "assistant",
@@ -2160,7 +2337,7 @@ def student_mode():
             if st.button("✨ Generate Notes", use_container_width=True, key="notes_btn"):
                 with st.spinner("Creating your notes..."):
                     style_map = {"Detailed Notes": "detailed", "Quick Revision": "revision", "Cheat Sheet": "cheatsheet"}
-                    content = st.session_state.docs[doc]["content"]
+                    content = doc_content(st.session_state.docs[doc], PROMPT_CONTENT_CHARS)
                     notes = st.session_state.ai.create_notes(content, style_map[style], st.session_state.lang)
                     
                     st.markdown("### 📚 Your Study Notes")
@@ -2193,7 +2370,7 @@ def student_mode():
             
             if st.button("🎯 Generate Quiz", use_container_width=True, key="mcq_btn"):
                 with st.spinner("Creating your quiz..."):
-                    content = st.session_state.docs[doc]["content"]
+                    content = doc_content(st.session_state.docs[doc], PROMPT_CONTENT_CHARS)
                     mcqs = st.session_state.ai.create_mcqs(content, num, st.session_state.lang)
                     
                     st.markdown("### ❓ Practice Quiz")
@@ -2226,7 +2403,7 @@ def student_mode():
             
             if st.button("🎴 Generate Flashcards", use_container_width=True, key="fc_btn"):
                 with st.spinner("Creating flashcards..."):
-                    content = st.session_state.docs[doc]["content"]
+                    content = doc_content(st.session_state.docs[doc], PROMPT_CONTENT_CHARS)
                     cards = st.session_state.ai.create_flashcards(content, num, st.session_state.lang)
                     
                     st.markdown("### 🎴 Your Flashcards")
@@ -2265,7 +2442,7 @@ def student_mode():
                     with st.spinner("Creating your plan..."):
                         prompt = f"""Create a {days}-day study plan for this material:
 
-{st.session_state.docs[doc]['content'][:10000]}
+{doc_content(st.session_state.docs[doc], 10000)}
 
 Include daily schedule, topics, and revision time."""
                         result = st.session_state.ai.generate(prompt)
@@ -2278,7 +2455,7 @@ Include daily schedule, topics, and revision time."""
                     with st.spinner("Analyzing..."):
                         prompt = f"""Identify most important exam topics from:
 
-{st.session_state.docs[doc]['content'][:12000]}
+{doc_content(st.session_state.docs[doc], 12000)}
 
 Rank by importance with explanations."""
                         result = st.session_state.ai.generate(prompt)
@@ -2289,7 +2466,7 @@ Rank by importance with explanations."""
                     with st.spinner("Creating..."):
                         prompt = f"""Create a 15-minute last-minute revision guide for:
 
-{st.session_state.docs[doc]['content'][:10000]}
+{doc_content(st.session_state.docs[doc], 10000)}
 
 Include key points, formulas, and must-remember facts."""
                         result = st.session_state.ai.generate(prompt)
@@ -2304,7 +2481,7 @@ Include key points, formulas, and must-remember facts."""
                     with st.spinner("Predicting..."):
                         prompt = f"""Predict {num} most likely exam questions from:
 
-{st.session_state.docs[doc]['content'][:12000]}
+{doc_content(st.session_state.docs[doc], 12000)}
 
 Include question, difficulty level, and key answer points."""
                         result = st.session_state.ai.generate(prompt)
@@ -0,0 +1,684 @@
+"""
+Exact-search vector index on a plain NumPy matrix (no Streamlit, no HNSW).
+
+NumpyCollection / NumpyClient speak the slice of the Chroma collection API that
+VectorStore uses (get / query / upsert / update / delete / count), so either can sit
+behind a workspace. Vectors are L2-normalised rows of one contiguous float32 (or
+float16) matrix; a query is a matrix product plus argpartition, exact and
+deterministic. Ids, chunk texts and metadata live in SQLite next to the matrix, not in
+memory. Meant for small and medium corpora - a few hundred thousand chunks at most.
+"""
+
+import os
+import json
+import sqlite3
+import tempfile
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:     # Windows - no cross-process lock, keep one writing process per folder
+    fcntl = None
+
+import numpy as np
+
+# "float16" halves memory, but every query upcasts the rows it scores - several times slower than float32
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")
+QUERY_BLOCK_ROWS = 65536    # rows scored per block, bounds the temporaries
+
+# Quantized mode: "int8" (1 byte per dim, ~4x less than float32) or "pq" (PQ_SUBSPACES bytes per
+# vector, ~32x less at 768 dims). Candidates are re-ranked against the float32 rows on disk.
+VECTOR_QUANT = os.getenv("VECTOR_QUANT", "none")
+PQ_SUBSPACES = int(os.getenv("PQ_SUBSPACES", "0"))           # 0 = dims / 8
+PQ_TRAIN_SIZE = int(os.getenv("PQ_TRAIN_SIZE", "10000"))     # exact search until this many vectors
+PQ_KMEANS_ITERS = 12
+RERANK_FACTOR = int(os.getenv("RERANK_FACTOR", "10"))        # candidates re-ranked per result, more = better recall
+RERANK_MIN = 100
+INT8_BLOCK_ROWS = 256       # int8 rows upcast at a time - small enough to stay in cache
+SQL_BATCH = 500             # ids / rows per IN (...) lookup
+
+
+def _field(key):
+    if '"' in key or "'" in key:
+        raise ValueError(f"Unsupported metadata key: {key}")
+    return f"""json_extract(metadata, '$."{key}"')"""
+
+
+def where_sql(where):
+    """
+    Chroma-style metadata filter -> (SQL condition on the JSON metadata column, params).
+    {"key": value}, {"key": {"$eq" | "$ne" | "$in" | "$nin" | "$contains": ...}},
+    {"$and": [...]}, {"$or": [...]}. Like Chroma, $ne / $nin also match entries without the key.
+    """
+    clauses, params = [], []
+    for key, condition in (where or {}).items():
+        if key in ("$and", "$or"):
+            parts = [where_sql(part) for part in condition]
+            if parts:
+                joiner = " AND " if key == "$and" else " OR "
+                clauses.append("(" + joiner.join(sql for sql, _ in parts) + ")")
+                params += [param for _, part in parts for param in part]
+            else:
+                clauses.append("1" if key == "$and" else "0")
+            continue
+        field = _field(key)
+        for op, operand in (condition if isinstance(condition, dict) else {"$eq": condition}).items():
+            if op == "$eq":
+                clauses.append(f"{field} = ?")
+                params.append(operand)
+            elif op == "$ne":
+                clauses.append(f"{field} IS NOT ?")
+                params.append(operand)
+            elif op in ("$in", "$nin"):
+                operand = list(operand)
+                marks = ", ".join("?" * len(operand))
+                if op == "$in":
+                    clauses.append(f"{field} IN ({marks})" if operand else "0")
+                else:
+                    clauses.append(f"({field} IS NULL OR {field} NOT IN ({marks}))" if operand else "1")
+                params += operand
+            elif op == "$contains":
+                path = field[len("json_extract(metadata, "):-1]
+                clauses.append(f"(json_type(metadata, {path}) = 'array' AND "
+                               f"EXISTS (SELECT 1 FROM json_each(metadata, {path}) WHERE value = ?))")
+                params.append(operand)
+            else:
+                raise ValueError(f"Unsupported filter operator: {op}")
+    return " AND ".join(clauses) or "1", params
+
+
+def _chunks(values, size=SQL_BATCH):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class NumpyCollection:
+    """
+    Rows 0..size-1 of self.matrix are live; deleted rows are filled from the tail so the
+    matrix stays contiguous. Only the matrix is held (with a folder: memory-mapped from
+    <name>.npy). Ids, documents and metadata sit in an SQLite table next to it, keyed by
+    row, so a write touches only its own rows and filters run in SQL.
+    Several processes may share a folder: every call takes a file lock (shared to read,
+    exclusive to write) and first picks up what other processes committed.
+    """
+    
+    def __init__(self, name, metadata=None, folder=None, dtype=VECTOR_DTYPE):
+        self.name = name
+        self.metadata = metadata or {}
+        self.dtype = np.dtype(dtype)
+        self.folder = Path(folder) if folder else None
+        self.matrix = None
+        self.size = 0
+        self._version = None
+        self._lock = threading.RLock()
+        self._lock_file = None
+        
+        if self.folder:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            if fcntl is not None:
+                self._lock_file = open(self.folder / f"{self.name}.lock", "a+")
+        self.db = sqlite3.connect(str(self._db_path) if self.folder else ":memory:", check_same_thread=False)
+        with self._file_lock(write=True):
+            self._create(metadata)
+    
+    @property
+    def _db_path(self):
+        return self.folder / f"{self.name}.sqlite3"
+    
+    @property
+    def _matrix_path(self):
+        return self.folder / f"{self.name}.npy"
+    
+    def _create(self, metadata):
+        if self.folder:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS entries (row INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, document TEXT, metadata TEXT)")
+            self.db.execute(f"CREATE INDEX IF NOT EXISTS entries_doc_id ON entries ({_field('doc_id')})")
+            self.db.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+            stored = self.db.execute("SELECT value FROM info WHERE key = 'metadata'").fetchone()
+            if stored:
+                self.metadata = json.loads(stored[0])
+            else:
+                self.db.execute("INSERT INTO info VALUES ('metadata', ?)", (json.dumps(self.metadata),))
+        self._refresh(force=True)
+    
+    @contextmanager
+    def _file_lock(self, write=False):
+        """Thread lock plus, with a folder, the file lock other processes take too"""
+        with self._lock:
+            if self._lock_file is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if self._lock_file is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+    
+    @contextmanager
+    def _locked(self, write=False):
+        """_file_lock, with the changes other processes committed loaded first"""
+        with self._file_lock(write):
+            self._refresh()
+            yield
+    
+    def _refresh(self, force=False):
+        # data_version only moves when another connection commits
+        version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._version and not force:
+            return
+        self._version = version
+        self.size = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        self._reload()
+    
+    def _reload(self):
+        """Re-open the arrays on disk - another process may have grown (replaced) them"""
+        if self.folder and self._matrix_path.exists():
+            self.matrix = np.load(self._matrix_path, mmap_mode="r+")
+    
+    def _flush(self):
+        if isinstance(self.matrix, np.memmap):
+            self.matrix.flush()
+    
+    def close(self):
+        with self._lock:
+            self.db.close()
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+    
+    def _grow(self, array, suffix, shape, dtype, live):
+        """Zeroed array of the new shape holding array[live]; memory-mapped to <name><suffix>
+        when the collection has a folder"""
+        if not self.folder:
+            grown = np.zeros(shape, dtype=dtype)
+            if array is not None:
+                grown[live] = array[live]
+            return grown
+        path = self.folder / f"{self.name}{suffix}"
+        tmp = self.folder / f"{self.name}.tmp{suffix}"
+        grown = np.lib.format.open_memmap(tmp, mode="w+", dtype=dtype, shape=shape)
+        if array is not None:
+            grown[live] = array[live]
+        grown.flush()
+        del grown
+        os.replace(tmp, path)
+        return np.load(path, mmap_mode="r+")
+    
+    def _reserve(self, rows, dim):
+        """Room for `rows` more vectors - capacity doubles, so growth is amortised O(1)"""
+        if self.matrix is not None and self.matrix.shape[1] != dim:
+            raise ValueError(f"Embedding dimension {dim} does not match collection dimensionality {self.matrix.shape[1]}")
+        capacity = 0 if self.matrix is None else self.matrix.shape[0]
+        if self.matrix is not None and self.size + rows <= capacity:
+            return
+        capacity = max(64, capacity * 2, self.size + rows)
+        self.matrix = self._grow(self.matrix, ".npy", (capacity, dim), self.dtype, np.s_[:self.size])
+    
+    def _store(self, rows, vectors):
+        self.matrix[rows] = vectors
+    
+    def _move(self, src, dst):
+        self.matrix[dst] = self.matrix[src]
+    
+    def _vectors(self, rows):
+        """float32 copies of the given rows"""
+        return np.asarray(self.matrix[rows], dtype=np.float32)
+    
+    @staticmethod
+    def _normalise(embeddings):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+    
+    def _rows_of(self, ids):
+        """{entry id: row} for the ids that exist"""
+        found = {}
+        for part in _chunks(list(dict.fromkeys(ids))):
+            marks = ", ".join("?" * len(part))
+            found.update(self.db.execute(f"SELECT id, row FROM entries WHERE id IN ({marks})", part))
+        return found
+    
+    def _records(self, ids=None, where=None, columns=("document", "metadata"), limit=None):
+        """[(row, id, *columns)] - in ids order when ids are given, else in row order"""
+        select = ", ".join(("row", "id") + tuple(columns))
+        condition, params = where_sql(where) if where else ("1", [])
+        if ids is None:
+            sql = f"SELECT {select} FROM entries WHERE {condition} ORDER BY row"
+            if limit is not None:
+                sql += f" LIMIT {int(limit)}"
+            return self.db.execute(sql, params).fetchall()
+        by_id = {}
+        for part in _chunks(list(dict.fromkeys(ids))):
+            marks = ", ".join("?" * len(part))
+            for record in self.db.execute(f"SELECT {select} FROM entries WHERE id IN ({marks}) AND {condition}", part + params):
+                by_id[record[1]] = record
+        records = [by_id[entry_id] for entry_id in dict.fromkeys(ids) if entry_id in by_id]
+        return records[:limit] if limit is not None else records
+    
+    def _by_row(self, rows, columns):
+        found = {}
+        for part in _chunks(list({int(row) for row in rows})):
+            marks = ", ".join("?" * len(part))
+            for record in self.db.execute(f"SELECT row, id, {', '.join(columns)} FROM entries WHERE row IN ({marks})", part):
+                found[record[0]] = record
+        return found
+    
+    def count(self):
+        with self._locked():
+            return self.size
+    
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        vectors = self._normalise(embeddings)
+        with self._locked(write=True):
+            rows_of = self._rows_of(ids)
+            rows, records, new = [], [], 0
+            for i, entry_id in enumerate(ids):
+                if entry_id not in rows_of:
+                    rows_of[entry_id] = self.size + new
+                    new += 1
+                rows.append(rows_of[entry_id])
+                meta = metadatas[i] if metadatas else None
+                records.append((rows_of[entry_id], entry_id, documents[i] if documents else None,
+                                json.dumps(meta) if meta is not None else None))
+            self._reserve(new, vectors.shape[1])
+            self.size += new
+            self._store(np.asarray(rows, dtype=np.int64), vectors)
+            self._flush()
+            with self.db:
+                self.db.executemany(
+                    "INSERT INTO entries VALUES (?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET "
+                    "document = excluded.document, metadata = excluded.metadata",
+                    records
+                )
+    
+    def update(self, ids, metadatas=None, documents=None, embeddings=None):
+        """Like Chroma: metadata keys are merged, a None value removes the key"""
+        vectors = self._normalise(embeddings) if embeddings is not None else None
+        with self._locked(write=True):
+            found = {record[1]: record for record in self._records(ids, columns=("document", "metadata"))}
+            changes, rows, positions = [], [], []
+            for i, entry_id in enumerate(ids):
+                if entry_id not in found:
+                    continue
+                row, _, document, meta = found[entry_id]
+                if metadatas:
+                    merged = dict(json.loads(meta) if meta else {}, **metadatas[i])
+                    meta = json.dumps({k: v for k, v in merged.items() if v is not None})
+                if documents:
+                    document = documents[i]
+                changes.append((document, meta, row))
+                rows.append(row)
+                positions.append(i)
+            if vectors is not None and rows:
+                self._store(np.asarray(rows, dtype=np.int64), vectors[positions])
+                self._flush()
+            with self.db:
+                self.db.executemany("UPDATE entries SET document = ?, metadata = ? WHERE row = ?", changes)
+    
+    def delete(self, ids=None, where=None):
+        with self._locked(write=True):
+            if where is not None:
+                doomed = [record[0] for record in self._records(ids, where, columns=())]
+            else:
+                doomed = list(self._rows_of(ids or []).values())
+            if not doomed:
+                return
+            # Live rows from the tail fill the holes below the new size
+            size = self.size - len(doomed)
+            gone = set(doomed)
+            holes = np.asarray(sorted(row for row in doomed if row < size), dtype=np.int64)
+            tail = np.asarray([row for row in range(size, self.size) if row not in gone], dtype=np.int64)
+            if len(holes):
+                self._move(tail, holes)
+                self._flush()
+            with self.db:
+                self.db.executemany("DELETE FROM entries WHERE row = ?", ((row,) for row in doomed))
+                self.db.executemany("UPDATE entries SET row = ? WHERE row = ?", zip(holes.tolist(), tail.tolist()))
+            self.size = size
+    
+    def get(self, ids=None, where=None, include=("documents", "metadatas"), limit=None):
+        columns = tuple(column for field, column in (("documents", "document"), ("metadatas", "metadata")) if field in include)
+        with self._locked():
+            records = self._records(ids, where, columns, limit)
+            rows = [record[0] for record in records]
+            values = {column: [record[2 + i] for record in records] for i, column in enumerate(columns)}
+            return {
+                "ids": [record[1] for record in records],
+                "documents": values.get("document"),
+                "metadatas": [json.loads(meta) if meta else None for meta in values["metadata"]] if "metadata" in values else None,
+                "embeddings": (self._vectors(rows) if rows else np.empty((0, 0), np.float32))
+                              if "embeddings" in include else None
+            }
+    
+    def _score_block(self, queries, index):
+        """(queries x rows) cosine scores for matrix[index]"""
+        block = self.matrix[index]
+        return queries @ (block if block.dtype == np.float32 else block.astype(np.float32)).T
+    
+    def _top(self, queries, k, rows, score_block):
+        """Each query's best k (scores, rows), unsorted. rows=None means every live row.
+        Scored block by block, keeping the best k so far."""
+        total = self.size if rows is None else len(rows)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, total, QUERY_BLOCK_ROWS):
+            stop = min(start + QUERY_BLOCK_ROWS, total)
+            if rows is None:
+                block_rows, index = np.arange(start, stop), slice(start, stop)
+            else:
+                block_rows = index = rows[start:stop]
+            scores = np.concatenate([best_scores, score_block(queries, index)], axis=1)
+            candidates = np.concatenate([best_rows, np.broadcast_to(block_rows, (len(queries), len(block_rows)))], axis=1)
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+                candidates = np.take_along_axis(candidates, top, axis=1)
+            best_scores, best_rows = scores, candidates
+        return best_scores, best_rows
+    
+    def _search(self, queries, k, rows):
+        return self._top(queries, k, rows, self._score_block)
+    
+    def query(self, query_embeddings, n_results=10, where=None, include=("documents", "metadatas", "distances")):
+        """Exact cosine top-k for every query row at once. distances are 1 - cosine, like Chroma's cosine space."""
+        queries = self._normalise(query_embeddings)
+        columns = tuple(column for field, column in (("documents", "document"), ("metadatas", "metadata")) if field in include)
+        with self._locked():
+            rows = np.asarray([record[0] for record in self._records(None, where, ())], dtype=np.int64) if where else None
+            total = self.size if rows is None else len(rows)
+            k = min(n_results, total)
+            empty = [[] for _ in range(len(queries))]
+            if k == 0:
+                return {"ids": empty, "documents": empty, "metadatas": empty, "distances": empty}
+            
+            best_scores, best_rows = self._search(queries, k, rows)
+            
+            order = np.argsort(-best_scores, axis=1, kind="stable")
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+            best_rows = np.take_along_axis(best_rows, order, axis=1)
+            
+            # Texts and metadata only for the hits
+            found = self._by_row(best_rows.ravel().tolist(), columns)
+            hits = [[found[row] for row in row_hits.tolist()] for row_hits in best_rows]
+            documents = [[record[2 + columns.index("document")] for record in row] for row in hits] if "document" in columns else None
+            metadatas = [[json.loads(record[2 + columns.index("metadata")] or "null") for record in row] for row in hits] \
+                if "metadata" in columns else None
+            return {
+                "ids": [[record[1] for record in row] for row in hits],
+                "documents": documents,
+                "metadatas": metadatas,
+                "distances": (1.0 - best_scores).tolist() if "distances" in include else None
+            }
+
+
+class QuantizedCollection(NumpyCollection):
+    """
+    NumpyCollection whose full-precision float32 matrix stays on disk (only re-ranked rows
+    are read, with pread) while queries scan compact codes - the codes and scales are all
+    it keeps resident:
+      int8 - per-row scaled int8 codes, score = (q . codes) * scale
+      pq   - product quantization: m subspaces x 256 centroids, one byte each, scored with
+             per-query lookup tables. Codebooks are trained (k-means) once PQ_TRAIN_SIZE
+             vectors are in; smaller collections are searched exactly.
+    The top k * RERANK_FACTOR candidates are re-scored exactly.
+    """
+    
+    def __init__(self, name, metadata=None, folder=None, quantization="int8"):
+        if quantization not in ("int8", "pq"):
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.quantization = quantization
+        self.codes = None       # int8: (capacity x dim); pq: (subspaces x capacity), column-major for the lookups
+        self.scales = None
+        self.codebook = None    # pq: (subspaces x 256 x sub_dim)
+        self._buffer = None
+        super().__init__(name, metadata, folder, "float32")
+        
+    def _reload(self):
+        super()._reload()
+        if self.matrix is not None:
+            path = self.folder / f"{self.name}.pq.npy"
+            if self.quantization == "pq" and path.exists():
+                self.codebook = np.load(path)
+            self._load_codes()
+    
+    def _load_codes(self):
+        codes_path = self.folder / f"{self.name}.codes.npy"
+        scales_path = self.folder / f"{self.name}.scales.npy"
+        try:
+            codes = np.load(codes_path, mmap_mode="r+")
+            expected = self._codes_shape(self.matrix.shape[0])
+            if codes.shape == expected and (self.quantization == "pq" or scales_path.exists()):
+                self.codes = codes
+                self.scales = np.load(scales_path, mmap_mode="r+") if self.quantization == "int8" else None
+                return
+        except (OSError, ValueError):
+            pass
+        # Stored by the plain index (or another mode) - encode what is there
+        self._grow_codes(self.matrix.shape[0], keep=False)
+        if self.quantization == "int8" or self.codebook is not None:
+            self._encode_rows(np.arange(self.size))
+        else:
+            self._maybe_train()
+    
+    def _codes_shape(self, capacity):
+        dim = self.matrix.shape[1]
+        if self.quantization == "int8":
+            return (capacity, dim)
+        return (self._subspaces(dim), capacity)
+    
+    @staticmethod
+    def _subspaces(dim):
+        """Largest divisor of dim not above PQ_SUBSPACES (default dim / 8)"""
+        target = PQ_SUBSPACES or max(1, dim // 8)
+        return max(m for m in range(1, min(target, dim) + 1) if dim % m == 0)
+    
+    def _grow_codes(self, capacity, keep=True):
+        shape = self._codes_shape(capacity)
+        if self.quantization == "int8":
+            live = np.s_[:self.size] if keep else np.s_[:0]
+            self.codes = self._grow(self.codes if keep else None, ".codes.npy", shape, np.int8, live)
+            self.scales = self._grow(self.scales if keep else None, ".scales.npy", (capacity,), np.float32, live)
+        else:
+            live = np.s_[:, :self.size] if keep else np.s_[:, :0]
+            self.codes = self._grow(self.codes if keep else None, ".codes.npy", shape, np.uint8, live)
+    
+    def _reserve(self, rows, dim):
+        capacity = 0 if self.matrix is None else self.matrix.shape[0]
+        super()._reserve(rows, dim)
+        if self.matrix.shape[0] != capacity or self.codes is None:
+            self._grow_codes(self.matrix.shape[0], keep=self.codes is not None)
+    
+    def _store(self, rows, vectors):
+        super()._store(rows, vectors)
+        if self.quantization == "int8" or self.codebook is not None:
+            self._encode(rows, vectors)
+        else:
+            self._maybe_train()
+    
+    def _move(self, src, dst):
+        super()._move(src, dst)
+        if self.quantization == "int8":
+            self.codes[dst] = self.codes[src]
+            self.scales[dst] = self.scales[src]
+        else:
+            self.codes[:, dst] = self.codes[:, src]
+    
+    def _flush(self):
+        for array in (self.codes, self.scales):
+            if isinstance(array, np.memmap):
+                array.flush()
+        super()._flush()
+        if isinstance(self.matrix, np.memmap):
+            # Map the float32 rows afresh - the pages this write touched don't stay resident
+            self.matrix = np.load(self._matrix_path, mmap_mode="r+")
+    
+    def _vectors(self, rows):
+        """Rows read with pread instead of through the memory map: each read maps nothing, so
+        re-ranking doesn't page the float32 matrix into the process bit by bit"""
+        if not hasattr(os, "pread") or not isinstance(self.matrix, np.memmap):
+            return super()._vectors(rows)
+        dim = self.matrix.shape[1]
+        width = dim * 4
+        vectors = np.empty((len(rows), dim), dtype=np.float32)
+        with open(self._matrix_path, "rb", buffering=0) as f:
+            for i, row in enumerate(rows):
+                vectors[i] = np.frombuffer(os.pread(f.fileno(), width, self.matrix.offset + int(row) * width), dtype=np.float32)
+        return vectors
+    
+    # ---- encoding ----
+    
+    def _encode(self, rows, vectors):
+        if self.quantization == "int8":
+            peak = np.abs(vectors).max(axis=1)
+            peak[peak == 0] = 1.0
+            self.codes[rows] = np.rint(vectors / peak[:, None] * 127).astype(np.int8)
+            self.scales[rows] = peak / 127
+            return
+        m, sub_dim = self.codebook.shape[0], self.codebook.shape[2]
+        for j in range(m):
+            part = vectors[:, j * sub_dim:(j + 1) * sub_dim]
+            centroids = self.codebook[j]
+            distances = (centroids ** 2).sum(axis=1) - 2 * part @ centroids.T
+            self.codes[j, rows] = distances.argmin(axis=1).astype(np.uint8)
+    
+    def _encode_rows(self, rows):
+        for start in range(0, len(rows), QUERY_BLOCK_ROWS):
+            block = rows[start:start + QUERY_BLOCK_ROWS]
+            self._encode(block, np.asarray(self.matrix[block], dtype=np.float32))
+    
+    def _maybe_train(self):
+        """PQ codebooks: k-means per subspace over a sample of the stored vectors"""
+        if self.quantization != "pq" or self.codebook is not None or self.size < max(PQ_TRAIN_SIZE, 256):
+            return
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(self.size, size=min(self.size, 256 * 64), replace=False))
+        data = np.asarray(self.matrix[sample], dtype=np.float32)
+        dim = data.shape[1]
+        m = self._subspaces(dim)
+        sub_dim = dim // m
+        
+        codebook = np.empty((m, 256, sub_dim), dtype=np.float32)
+        for j in range(m):
+            part = data[:, j * sub_dim:(j + 1) * sub_dim]
+            centroids = part[rng.choice(len(part), size=256, replace=False)].copy()
+            for _ in range(PQ_KMEANS_ITERS):
+                assign = ((centroids ** 2).sum(axis=1) - 2 * part @ centroids.T).argmin(axis=1)
+                counts = np.bincount(assign, minlength=256)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, part)
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+            codebook[j] = centroids
+        
+        self.codebook = codebook
+        if self.folder:
+            np.save(self.folder / f"{self.name}.pq.npy", codebook)
+        self._encode_rows(np.arange(self.size))
+    
+    # ---- search ----
+    
+    def _int8_scores(self, queries, index):
+        codes, scales = self.codes[index], self.scales[index]
+        if self._buffer is None or self._buffer.shape[1] != codes.shape[1]:
+            self._buffer = np.empty((INT8_BLOCK_ROWS, codes.shape[1]), dtype=np.float32)
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), INT8_BLOCK_ROWS):
+            part = codes[start:start + INT8_BLOCK_ROWS]
+            buffer = self._buffer[:len(part)]
+            np.copyto(buffer, part, casting="unsafe")
+            scores[:, start:start + len(part)] = queries @ buffer.T
+        return scores * scales
+    
+    def _search(self, queries, k, rows):
+        if self.quantization == "pq" and self.codebook is None:
+            return super()._search(queries, k, rows)
+        
+        total = self.size if rows is None else len(rows)
+        depth = min(total, max(k * RERANK_FACTOR, RERANK_MIN))
+        if self.quantization == "int8":
+            _, candidates = self._top(queries, depth, rows, self._int8_scores)
+        else:
+            m, sub_dim = self.codebook.shape[0], self.codebook.shape[2]
+            # Per query and subspace: inner product with each of the 256 centroids
+            tables = np.einsum("qmd,mcd->qmc", queries.reshape(len(queries), m, sub_dim), self.codebook)
+            
+            def pq_scores(queries, index):
+                codes = self.codes[:, index]
+                scores = np.zeros((len(queries), codes.shape[1]), dtype=np.float32)
+                for qi in range(len(queries)):
+                    for j in range(m):
+                        scores[qi] += tables[qi, j].take(codes[j])
+                return scores
+            
+            _, candidates = self._top(queries, depth, rows, pq_scores)
+        
+        # Exact re-rank on the full-precision rows (sorted, so the disk is read in order)
+        best_scores = np.empty((len(queries), k), dtype=np.float32)
+        best_rows = np.empty((len(queries), k), dtype=np.int64)
+        for qi, query in enumerate(queries):
+            candidate_rows = np.sort(candidates[qi])
+            exact = self._vectors(candidate_rows) @ query
+            top = np.argpartition(-exact, k - 1)[:k] if len(exact) > k else np.arange(len(exact))
+            best_scores[qi], best_rows[qi] = exact[top], candidate_rows[top]
+        return best_scores, best_rows
+
+
+ListedCollection = namedtuple("ListedCollection", "name")
+
+
+class NumpyClient:
+    """Collections by name; persisted under folder when one is given. Quantized collections
+    keep their full-precision rows on disk, so without a folder they get a temporary one."""
+    
+    def __init__(self, folder=None, dtype=VECTOR_DTYPE, quantization=VECTOR_QUANT):
+        self.quantization = quantization
+        if quantization != "none" and not folder:
+            folder = tempfile.mkdtemp(prefix="docstudio-vectors-")
+        self.folder = Path(folder) if folder else None
+        self.dtype = dtype
+        self.collections = {}
+        self._lock = threading.Lock()
+        if self.folder:
+            self.folder.mkdir(parents=True, exist_ok=True)
+    
+    def get_or_create_collection(self, name, metadata=None):
+        with self._lock:
+            if name not in self.collections:
+                if self.quantization != "none":
+                    self.collections[name] = QuantizedCollection(name, metadata, self.folder, self.quantization)
+                else:
+                    self.collections[name] = NumpyCollection(name, metadata, self.folder, self.dtype)
+            return self.collections[name]
+    
+    def _names(self):
+        names = set(self.collections)
+        if self.folder:
+            names |= {path.stem for path in self.folder.glob("*.sqlite3")}
+        return names
+    
+    def get_collection(self, name):
+        if name not in self._names():
+            raise ValueError(f"Collection {name} does not exist")
+        return self.get_or_create_collection(name)
+    
+    def list_collections(self):
+        """Names only - listing doesn't open (load) anybody's collection"""
+        return [ListedCollection(name) for name in sorted(self._names())]
+    
+    def delete_collection(self, name):
+        with self._lock:
+            collection = self.collections.pop(name, None)
+            if collection is not None:
+                collection.close()
+            if self.folder:
+                for suffix in (".sqlite3", ".sqlite3-wal", ".sqlite3-shm", ".lock",
+                               ".npy", ".codes.npy", ".scales.npy", ".pq.npy"):
+                    (self.folder / f"{name}{suffix}").unlink(missing_ok=True)
@@ -0,0 +1,187 @@
+"""
+Section-level index for two-stage retrieval over long documents (no Streamlit).
+
+Every SECTION_PAGES pages of a document form a section. Its vector is the sum of its
+chunks' vectors - under cosine that is the centroid, so no extra embedding calls. A
+query first finds the closest sections, then is scored exactly against the chunks in
+those sections only: the work per query follows the number of sections plus a fixed
+candidate pool, not the number of chunks. Chunk vectors of recently hit sections stay
+in memory (SectionCache), so the second stage is one matrix product.
+"""
+
+import os
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+HIERARCHICAL_INDEX = os.getenv("HIERARCHICAL_INDEX", "0") == "1"   # default for workspaces that never chose
+SECTION_PAGES = int(os.getenv("SECTION_PAGES", "10"))
+SECTION_CANDIDATES = int(os.getenv("SECTION_CANDIDATES", "8"))     # sections searched per query
+SECTION_CACHE_ROWS = int(os.getenv("SECTION_CACHE_ROWS", "50000"))  # chunk vectors kept in memory per workspace
+
+
+def section_of(page):
+    """Section number of a page (pages that aren't numbers go to section 0)"""
+    page = str(page)
+    return (int(page) - 1) // SECTION_PAGES if page.isdigit() and int(page) > 0 else 0
+
+
+def section_name(name):
+    return f"{name}_h"
+
+
+def _normalise(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _version(meta):
+    # Changes whenever a section's members or their vectors do
+    return meta.get("size", 0), round(meta.get("norm", 0.0), 5)
+
+
+class SectionCache:
+    """LRU of section id -> (version, member ids, normalised member vectors), bounded by rows"""
+    
+    def __init__(self, max_rows: int = SECTION_CACHE_ROWS):
+        self.max_rows = max_rows
+        self.rows = 0
+        self.sections = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, section_id, version):
+        with self.lock:
+            entry = self.sections.get(section_id)
+            if entry is None or entry[0] != version:
+                return None
+            self.sections.move_to_end(section_id)
+            return entry[1], entry[2]
+    
+    def put(self, section_id, version, ids, matrix):
+        with self.lock:
+            old = self.sections.pop(section_id, None)
+            if old is not None:
+                self.rows -= len(old[1])
+            self.sections[section_id] = (version, ids, matrix)
+            self.rows += len(ids)
+            while self.rows > self.max_rows and len(self.sections) > 1:
+                _, (_, dropped, _) = self.sections.popitem(last=False)
+                self.rows -= len(dropped)
+
+
+class SectionIndex:
+    """
+    One record per (document, section): the summed vector of its chunks, their entry ids
+    as a JSON list in the record's document, and size / norm in metadata. Lives in its own
+    collection next to the chunk collection. Indexes may normalise what they store, so
+    the sum's length is kept too.
+    """
+    
+    def __init__(self, client, chunks, metadata=None, cache=None):
+        self.chunks = chunks
+        self.collection = client.get_or_create_collection(name=section_name(chunks.name), metadata=metadata)
+        self.cache = cache if cache is not None else SectionCache()
+    
+    def count(self):
+        return self.collection.count()
+    
+    def add(self, groups):
+        """groups: {(doc_id, section): {entry_id: vector}}, merged into the stored sections.
+        Entries a section already has are skipped, so adding the same chunks twice is harmless."""
+        keys = list(groups)
+        ids = [f"{doc_id}#{section}" for doc_id, section in keys]
+        found = self.collection.get(ids=ids, include=["embeddings", "documents", "metadatas"])
+        stored = {
+            section_id: (np.asarray(vector, dtype=np.float32), json.loads(members or "[]"), meta or {})
+            for section_id, vector, members, meta in zip(found["ids"], found["embeddings"], found["documents"], found["metadatas"])
+        }
+        
+        upserts, vectors, documents, metadatas = [], [], [], []
+        for (doc_id, section), section_id in zip(keys, ids):
+            vector, members, meta = stored.get(section_id, (None, [], {}))
+            seen = set(members)
+            new = {entry_id: v for entry_id, v in groups[(doc_id, section)].items() if entry_id not in seen and v is not None}
+            if not new:
+                continue
+            total = np.sum(np.asarray(list(new.values()), dtype=np.float32), axis=0)
+            if vector is not None:
+                total += _normalise(vector) * meta.get("norm", 1.0)
+            members += list(new)
+            upserts.append(section_id)
+            vectors.append(total.tolist())
+            documents.append(json.dumps(members))
+            metadatas.append({
+                "doc_id": doc_id,
+                "section": section,
+                "first_page": section * SECTION_PAGES + 1,
+                "last_page": (section + 1) * SECTION_PAGES,
+                "size": len(members),
+                "norm": float(np.linalg.norm(total)),
+            })
+        if upserts:
+            self.collection.upsert(ids=upserts, embeddings=vectors, documents=documents, metadatas=metadatas)
+    
+    def drop(self, doc_ids):
+        self.collection.delete(where={"doc_id": {"$in": list(doc_ids)}})
+    
+    def clear(self):
+        ids = self.collection.get(include=[])["ids"]
+        if ids:
+            self.collection.delete(ids=ids)
+    
+    def _members(self, sections):
+        """{section id: (member ids, normalised vectors)} for [(section id, version)], loading cache misses"""
+        loaded, missing = {}, []
+        for section_id, version in sections:
+            cached = self.cache.get(section_id, version)
+            if cached is None:
+                missing.append((section_id, version))
+            else:
+                loaded[section_id] = cached
+        if not missing:
+            return loaded
+        
+        found = self.collection.get(ids=[section_id for section_id, _ in missing], include=["documents"])
+        members = {section_id: json.loads(doc or "[]") for section_id, doc in zip(found["ids"], found["documents"])}
+        wanted = list(dict.fromkeys(entry_id for ids in members.values() for entry_id in ids))
+        chunks = self.chunks.get(ids=wanted, include=["embeddings"]) if wanted else {"ids": [], "embeddings": []}
+        vector_of = dict(zip(chunks["ids"], chunks["embeddings"]))
+        for section_id, version in missing:
+            ids = [entry_id for entry_id in members.get(section_id, []) if entry_id in vector_of]
+            dim = len(next(iter(vector_of.values()))) if vector_of else 0
+            matrix = _normalise([vector_of[entry_id] for entry_id in ids]) if ids else np.empty((0, dim), np.float32)
+            self.cache.put(section_id, version, ids, matrix)
+            loaded[section_id] = (ids, matrix)
+        return loaded
+    
+    def search(self, query_vectors, n, sections=SECTION_CANDIDATES):
+        """Exact cosine top-n among the chunks of each query's closest sections -> [[(entry_id, distance)]]"""
+        sections = min(sections, self.count())
+        if sections == 0:
+            return [[] for _ in query_vectors]
+        results = self.collection.query(query_embeddings=query_vectors, n_results=sections, include=["metadatas"])
+        picked = [list(zip(ids, (_version(meta or {}) for meta in metas))) for ids, metas in zip(results["ids"], results["metadatas"])]
+        members = self._members(list(dict.fromkeys(section for row in picked for section in row)))
+        
+        rankings = []
+        for query, row in zip(_normalise(query_vectors), picked):
+            ids = [entry_id for section_id, _ in row for entry_id in members[section_id][0]]
+            if not ids:
+                rankings.append([])
+                continue
+            scores = np.concatenate([members[section_id][1] for section_id, _ in row]) @ query
+            top = np.argsort(-scores, kind="stable")
+            hits, seen = [], set()
+            for j in top:
+                # Shared chunks can sit in several sections
+                if ids[j] not in seen:
+                    seen.add(ids[j])
+                    hits.append((ids[j], float(1.0 - scores[j])))
+                    if len(hits) == n:
+                        break
+            rankings.append(hits)
+        return rankings
@@ -0,0 +1,269 @@
+"""
+Sharded vector collections - one workspace spread over N collections (no Streamlit).
+
+ShardedCollection speaks the same collection API as a Chroma / NumPy collection, so
+VectorStore uses it unchanged. Entries are routed by a hash of their document id
+(entry ids start with it), writes to different shards run in parallel, and queries fan
+out to every shard and merge the per-shard top-k. Shard 0 keeps the unsharded
+collection name, so an existing workspace simply becomes a one-shard store and is
+split as it grows: whenever a shard goes over max_entries the shard count doubles.
+With crc32(key) % 2N every entry either stays put or moves to shard i + N.
+Another process (bulk_ingest) may split a workspace this one has open, so every call
+first checks whether the next shard has appeared.
+"""
+
+import os
+import zlib
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+VECTOR_SHARDS = int(os.getenv("VECTOR_SHARDS", "1"))                # 1 = no sharding
+SHARD_MAX_ENTRIES = int(os.getenv("SHARD_MAX_ENTRIES", "500000"))   # split threshold per shard
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", str(os.cpu_count() or 4)))
+REBALANCE_BATCH = 1000
+
+
+@lru_cache(maxsize=None)
+def get_shard_pool():
+    """Process-wide pool for shard fan-out"""
+    return ThreadPoolExecutor(max_workers=max(1, SHARD_WORKERS), thread_name_prefix="shard")
+
+
+def shard_name(name, index):
+    return name if index == 0 else f"{name}_s{index}"
+
+
+def shard_key(entry_id):
+    # Entry ids are "<doc_id>_<chunk id>", so one document's chunks share a shard
+    return entry_id.split("_", 1)[0]
+
+
+def open_collection(client, name, metadata=None, shards=VECTOR_SHARDS, max_entries=SHARD_MAX_ENTRIES):
+    """ShardedCollection over the workspace's shards. With sharding off it only splits once
+    the workspace already is split (by this or another process) - until then it is one
+    collection that keeps watching for shards."""
+    try:
+        existing = {collection.name for collection in client.list_collections()}
+    except:
+        existing = set()
+    return ShardedCollection(client, name, metadata, shards, max_entries, existing, split=shards > 1)
+
+
+class ShardedCollection:
+    def __init__(self, client, name, metadata=None, shards=VECTOR_SHARDS, max_entries=SHARD_MAX_ENTRIES,
+                 existing=None, split=True):
+        self.client = client
+        self.name = name
+        self.metadata = metadata or {}
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.RLock()
+        self._sole_keys = {}    # shard index -> the one document key an over-full shard holds
+        
+        existing = existing if existing is not None else {c.name for c in client.list_collections()}
+        count = 1
+        while shard_name(name, count) in existing:
+            count += 1
+        self.shards = [self._open(i) for i in range(count)]
+        self.split = split or count > 1     # double the shards when one goes over max_entries?
+        if shards > count:
+            # More shards configured than the workspace has - spread what is there
+            self._resize(shards)
+    
+    def _open(self, index):
+        return self.client.get_or_create_collection(name=shard_name(self.name, index), metadata=self.metadata)
+    
+    def _sync(self):
+        """Open the shards another process added since - shard counts only ever grow, so
+        routing is right again as soon as the next shard name exists"""
+        with self._lock:
+            count = len(self.shards)
+            while True:
+                try:
+                    self.client.get_collection(name=shard_name(self.name, count))
+                except:
+                    break
+                count += 1
+            if count > len(self.shards):
+                self.shards += [self._open(i) for i in range(len(self.shards), count)]
+                self._sole_keys.clear()
+                self.split = True
+    
+    @property
+    def configuration(self):
+        return self.shards[0].configuration
+    
+    def _route(self, entry_id, shards=None):
+        return zlib.crc32(shard_key(entry_id).encode("utf-8")) % (shards or len(self.shards))
+    
+    def _group(self, ids):
+        """{shard index: [positions in ids]}"""
+        groups = {}
+        for position, entry_id in enumerate(ids):
+            groups.setdefault(self._route(entry_id), []).append(position)
+        return groups
+    
+    @staticmethod
+    def _pick(values, positions):
+        if values is None:
+            return None
+        return [values[p] for p in positions]
+    
+    def _fan_out(self, calls):
+        """Run (shard, fn) pairs concurrently, results in order"""
+        if len(calls) == 1:
+            shard, fn = calls[0]
+            return [fn(shard)]
+        return list(get_shard_pool().map(lambda call: call[1](call[0]), calls))
+    
+    # ---- collection API ----
+    
+    def count(self):
+        self._sync()
+        return sum(shard.count() for shard in self.shards)
+    
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        with self._lock:
+            self._sync()
+            groups = self._group(ids)
+            self._fan_out([
+                (self.shards[index], lambda shard, p=positions: shard.upsert(
+                    ids=self._pick(ids, p),
+                    embeddings=self._pick(embeddings, p),
+                    documents=self._pick(documents, p),
+                    metadatas=self._pick(metadatas, p)
+                ))
+                for index, positions in groups.items()
+            ])
+            full = [index for index in groups if self.split and self.shards[index].count() > self.max_entries]
+            if any(self._splittable(index, [ids[p] for p in groups[index]]) for index in full):
+                self.rebalance()
+    
+    def update(self, ids, metadatas=None, documents=None, embeddings=None):
+        with self._lock:
+            self._sync()
+            for index, positions in self._group(ids).items():
+                kwargs = {"ids": self._pick(ids, positions)}
+                for key, values in (("metadatas", metadatas), ("documents", documents), ("embeddings", embeddings)):
+                    if values is not None:
+                        kwargs[key] = self._pick(values, positions)
+                self.shards[index].update(**kwargs)
+    
+    def delete(self, ids=None, where=None):
+        with self._lock:
+            self._sync()
+            if ids is None:
+                self._fan_out([(shard, lambda shard: shard.delete(where=where)) for shard in self.shards])
+                return
+            for index, positions in self._group(ids).items():
+                self.shards[index].delete(ids=self._pick(ids, positions))
+    
+    def get(self, ids=None, where=None, include=("documents", "metadatas"), limit=None):
+        self._sync()
+        include = list(include)
+        kwargs = {"where": where, "include": include} if where else {"include": include}
+        if limit is not None:
+            kwargs["limit"] = limit   # no shard needs to return more than the total
+        if len(self.shards) == 1:
+            return self.shards[0].get(ids=ids, **kwargs)
+        if ids is None:
+            calls = [(shard, lambda shard: shard.get(**kwargs)) for shard in self.shards]
+        else:
+            calls = [
+                (self.shards[index], lambda shard, p=positions: shard.get(ids=self._pick(ids, p), **kwargs))
+                for index, positions in self._group(ids).items()
+            ]
+        
+        merged = {"ids": [], "documents": None, "metadatas": None, "embeddings": None}
+        for field in ("documents", "metadatas", "embeddings"):
+            if field in include:
+                merged[field] = []
+        for result in self._fan_out(calls):
+            merged["ids"].extend(result["ids"])
+            for field in ("documents", "metadatas", "embeddings"):
+                if merged[field] is not None and result.get(field) is not None:
+                    merged[field].extend(list(result[field]))
+        if limit is not None:
+            merged = {field: values[:limit] if values is not None else None for field, values in merged.items()}
+        return merged
+    
+    def query(self, query_embeddings, n_results=10, where=None, include=("documents", "metadatas", "distances")):
+        """Every shard's top n_results, merged by distance"""
+        self._sync()
+        include = list(include)
+        if len(self.shards) == 1:
+            kwargs = {"where": where} if where else {}
+            return self.shards[0].query(query_embeddings=query_embeddings, n_results=n_results, include=include, **kwargs)
+        wanted = include if "distances" in include else include + ["distances"]
+        kwargs = {"query_embeddings": query_embeddings, "n_results": n_results, "include": wanted}
+        if where:
+            kwargs["where"] = where
+        results = self._fan_out([(shard, lambda shard: shard.query(**kwargs)) for shard in self.shards])
+        
+        fields = ["ids"] + [field for field in ("documents", "metadatas", "distances", "embeddings") if field in include]
+        merged = {field: [] for field in ("ids", "documents", "metadatas", "distances", "embeddings")}
+        for qi in range(len(query_embeddings)):
+            hits = sorted(
+                (distance, shard, position)
+                for shard, result in enumerate(results)
+                for position, distance in enumerate(result["distances"][qi])
+            )[:n_results]
+            for field in fields:
+                merged[field].append([results[shard][field][qi][position] for _, shard, position in hits])
+        return {field: (values if field in fields else None) for field, values in merged.items()}
+    
+    # ---- rebalancing ----
+    
+    def _splittable(self, index, added=None):
+        """Would splitting shard index help - does it hold more than one document? One
+        document stays in one shard however often the count doubles. added: ids just
+        written there, which skip the scan when they belong to its known sole document."""
+        sole = self._sole_keys.get(index)
+        if sole is not None and all(shard_key(entry_id) == sole for entry_id in added or []):
+            return False
+        keys = set()
+        for entry_id in self.shards[index].get(include=[])["ids"]:
+            keys.add(shard_key(entry_id))
+            if len(keys) > 1:
+                self._sole_keys.pop(index, None)
+                return True
+        if keys:
+            self._sole_keys[index] = keys.pop()
+        return False
+    
+    def _resize(self, shards):
+        with self._lock:
+            self.shards += [self._open(i) for i in range(len(self.shards), shards)]
+            self._sole_keys.clear()
+            self._migrate()
+    
+    def _migrate(self):
+        """Move entries whose route changed. Copy first, delete after - an interrupted run leaves
+        duplicates, never gaps, and the next run cleans them up."""
+        for index, shard in enumerate(self.shards):
+            stray = [entry_id for entry_id in shard.get(include=[])["ids"] if self._route(entry_id) != index]
+            for start in range(0, len(stray), REBALANCE_BATCH):
+                batch = stray[start:start + REBALANCE_BATCH]
+                found = shard.get(ids=batch, include=["embeddings", "documents", "metadatas"])
+                embeddings = list(found["embeddings"])
+                for target, positions in self._group(found["ids"]).items():
+                    self.shards[target].upsert(
+                        ids=self._pick(found["ids"], positions),
+                        embeddings=[list(embeddings[p]) for p in positions],
+                        documents=self._pick(found["documents"], positions),
+                        metadatas=self._pick(found["metadatas"], positions)
+                    )
+                shard.delete(ids=found["ids"])
+    
+    def rebalance(self):
+        """Double the shard count until every shard is under max_entries"""
+        with self._lock:
+            while True:
+                full = [index for index, shard in enumerate(self.shards) if shard.count() > self.max_entries]
+                if not any(self._splittable(index) for index in full):
+                    break  # every over-full shard is one document - splitting can't help
+                before = len(self.shards)
+                self._resize(before * 2)
+                if all(self.shards[i].count() == 0 for i in range(before, len(self.shards))):
+                    break  # nothing moved - the documents share a route at this count too
+            self._migrate()
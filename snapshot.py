@@ -0,0 +1,203 @@
+"""
+Workspace snapshots - a workspace's vector index and documents in one file (no Streamlit).
+
+A snapshot is a zip archive:
+    manifest.json                  format version, embedding model, one record per space
+    spaces/<backend>/vectors.npy   float32 (count x dim) - one contiguous array, stored raw
+    spaces/<backend>/entries.json  entry ids, chunk texts and metadata, column by column
+    docs/docs.json                 document headers
+    docs/spans.npy                 uint32 (3 x chunks): page, start, end of every chunk span
+    docs/pages.json                page texts behind the spans
+    docs/<doc id>.txt              content of streamed documents
+Restoring copies the vectors straight into the index - no embedding calls. Vectors are
+only loaded into a space whose backend tag matches, so they are never mixed with another
+model's.
+
+    python snapshot.py export --workspace course101 course101.dssnap
+    python snapshot.py import --workspace course101 course101.dssnap
+"""
+
+import sys
+import json
+import zipfile
+import argparse
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+from embeddings import EMBED_MODEL
+from document_processor import ChunkSpans
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_BATCH = 1000   # entries per read / write step - the whole index never sits in memory twice
+
+
+def _columns(rows):
+    """[{key: value}] -> {key: [value or None]}"""
+    keys = list(dict.fromkeys(key for row in rows for key in (row or {})))
+    return {key: [(row or {}).get(key) for row in rows] for key in keys}
+
+
+def _rows(columns, count):
+    return [{key: values[i] for key, values in columns.items() if values[i] is not None} for i in range(count)]
+
+
+def _write_json(archive, name, data):
+    archive.writestr(name, json.dumps(data), compress_type=zipfile.ZIP_DEFLATED)
+
+
+def write_snapshot(target, workspace, spaces, docs):
+    """
+    target: path or writable binary file. spaces: [{"backend", "tag", "dim", "count",
+    "batches"}], batches yielding (ids, embeddings, documents, metadatas). docs: document
+    dicts as the app keeps them. Returns the manifest.
+    """
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "workspace": workspace,
+        "embed_model": EMBED_MODEL,
+        "spaces": [],
+        "documents": len(docs),
+    }
+    
+    with zipfile.ZipFile(target, "w", allowZip64=True) as archive:
+        for space in spaces:
+            folder = f"spaces/{space['backend']}"
+            ids, texts, metas = [], [], []
+            with archive.open(f"{folder}/vectors.npy", "w", force_zip64=True) as f:
+                np.lib.format.write_array_header_1_0(f, {
+                    "descr": np.lib.format.dtype_to_descr(np.dtype("<f4")),
+                    "fortran_order": False,
+                    "shape": (space["count"], space["dim"])
+                })
+                written = 0
+                for batch_ids, embeddings, documents, metadatas in space["batches"]:
+                    f.write(np.ascontiguousarray(embeddings, dtype="<f4").tobytes())
+                    written += len(batch_ids)
+                    ids.extend(batch_ids)
+                    texts.extend(documents)
+                    metas.extend(metadatas)
+            if written != space["count"]:
+                raise ValueError(f"{space['backend']} space changed while exporting ({written} of {space['count']} entries)")
+            _write_json(archive, f"{folder}/entries.json", {"ids": ids, "documents": texts, "metadatas": _columns(metas)})
+            manifest["spaces"].append({key: space[key] for key in ("backend", "tag", "dim", "count")})
+        
+        # Documents: headers as JSON, chunk spans as one uint32 array, page texts alongside
+        headers, pages, spans = [], [], [array("I"), array("I"), array("I")]
+        for doc in docs:
+            header = {key: value for key, value in doc.items() if key not in ("chunks", "content")}
+            chunks = doc.get("chunks")
+            if isinstance(chunks, ChunkSpans):
+                header["spans"] = {"kind": chunks.kind, "pages": len(pages), "start": len(spans[0]), "count": len(chunks)}
+                pages.append({str(k): v for k, v in chunks.pages.items()})
+                for column, values in zip(spans, (chunks.page_nums, chunks.starts, chunks.ends)):
+                    column.extend(values)
+            else:
+                header["chunks"] = chunks or []
+                if "content" in doc:
+                    header["content"] = doc["content"]
+            if "content_path" in doc:
+                try:
+                    with open(doc["content_path"], "r", encoding="utf-8") as f:
+                        archive.writestr(f"docs/{doc['id']}.txt", f.read(), compress_type=zipfile.ZIP_DEFLATED)
+                except OSError:
+                    continue  # spooled content gone - the document can't be restored
+            headers.append(header)
+        
+        manifest["documents"] = len(headers)
+        _write_json(archive, "docs/docs.json", headers)
+        _write_json(archive, "docs/pages.json", pages)
+        with archive.open("docs/spans.npy", "w") as f:
+            np.save(f, np.array([column.tolist() for column in spans], dtype="<u4").reshape(3, -1))
+        _write_json(archive, "manifest.json", manifest)
+    return manifest
+
+
+class SnapshotReader:
+    """Reads a snapshot written by write_snapshot; use as a context manager"""
+    
+    def __init__(self, source):
+        self.archive = zipfile.ZipFile(source, "r")
+        try:
+            self.manifest = json.loads(self.archive.read("manifest.json"))
+        except KeyError:
+            self.archive.close()
+            raise ValueError("Not a workspace snapshot (no manifest.json)")
+        if self.manifest.get("format", 0) > SNAPSHOT_FORMAT:
+            self.archive.close()
+            raise ValueError(f"Snapshot format {self.manifest['format']} is newer than this version reads ({SNAPSHOT_FORMAT})")
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.archive.close()
+    
+    def metadatas(self, space):
+        """Entry metadata of one space from the manifest - to check it before anything is written"""
+        entries = json.loads(self.archive.read(f"spaces/{space['backend']}/entries.json"))
+        return _rows(entries["metadatas"], len(entries["ids"]))
+    
+    def batches(self, space, batch=SNAPSHOT_BATCH):
+        """(ids, float32 vectors, documents, metadatas) in batches of one space from the manifest"""
+        folder = f"spaces/{space['backend']}"
+        entries = json.loads(self.archive.read(f"{folder}/entries.json"))
+        count = len(entries["ids"])
+        metadatas = _rows(entries["metadatas"], count)
+        with self.archive.open(f"{folder}/vectors.npy") as f:
+            np.lib.format.read_magic(f)
+            shape, _, _ = np.lib.format.read_array_header_1_0(f)
+            if shape[0] != count:
+                raise ValueError(f"Corrupt snapshot: {shape[0]} vectors for {count} entries")
+            for start in range(0, count, batch):
+                rows = min(batch, count - start)
+                vectors = np.frombuffer(f.read(rows * shape[1] * 4), dtype="<f4").reshape(rows, shape[1])
+                end = start + rows
+                yield entries["ids"][start:end], vectors, entries["documents"][start:end], metadatas[start:end]
+    
+    def documents(self):
+        """([document dicts], {doc_id: content of streamed documents})"""
+        headers = json.loads(self.archive.read("docs/docs.json"))
+        pages = json.loads(self.archive.read("docs/pages.json"))
+        with self.archive.open("docs/spans.npy") as f:
+            spans = np.load(f)
+        
+        docs, contents = [], {}
+        names = set(self.archive.namelist())
+        for header in headers:
+            doc = dict(header)
+            layout = doc.pop("spans", None)
+            if layout:
+                chunks = ChunkSpans({int(k): v for k, v in pages[layout["pages"]].items()}, layout["kind"], doc["id"], doc["name"])
+                window = slice(layout["start"], layout["start"] + layout["count"])
+                chunks.page_nums, chunks.starts, chunks.ends = (array("I", column[window].tolist()) for column in spans)
+                doc["chunks"] = chunks
+            if f"docs/{doc['id']}.txt" in names:
+                contents[doc["id"]] = self.archive.read(f"docs/{doc['id']}.txt").decode("utf-8")
+            docs.append(doc)
+        return docs, contents
+
+
+def main(argv=None):
+    from vector_store import DEFAULT_WORKSPACE, VectorStore  # vector_store imports this module
+    
+    parser = argparse.ArgumentParser(description="Export or restore a Doc Studio workspace snapshot")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("path", help="Snapshot file")
+    parser.add_argument("--workspace", default=DEFAULT_WORKSPACE, help=f"Workspace / username (default: {DEFAULT_WORKSPACE})")
+    args = parser.parse_args(argv)
+    
+    store = VectorStore(namespace=args.workspace)
+    if args.action == "export":
+        report = store.export_snapshot(args.path)
+    else:
+        report = store.import_snapshot(args.path)
+        report.pop("documents")
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""
+Shared pytest setup. Every run gets its own data folder, and stores use the local
+hashing embedder on the NumPy index - no API key, no network, no Chroma files.
+"""
+
+import os
+import sys
+import uuid
+import random
+import tempfile
+
+# Config constants are read at import time, so this has to come before vector_store
+os.environ["DOC_STUDIO_DATA"] = tempfile.mkdtemp(prefix="docstudio-tests-")
+os.environ.setdefault("EMBED_BACKEND", "local")
+os.environ.setdefault("EMBED_FALLBACK", "")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from vector_store import VectorStore
+
+WORDS = [f"w{i}" for i in range(2000)]
+
+
+def make_text(seed, words=120):
+    """Random but repeatable chunk text - different seeds never look like near-duplicates"""
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def make_chunks(doc_id, texts):
+    """Chunks the way DocumentProcessor hands them over, one page each"""
+    return [
+        {"id": f"chunk_{i}", "text": text, "page": i + 1, "file": f"{doc_id}.pdf"}
+        for i, text in enumerate(texts)
+    ]
+
+
+@pytest.fixture
+def make_store():
+    """VectorStore factory - a fresh workspace per call, local backend, in-memory NumPy index"""
+    def make(namespace=None, **kwargs):
+        kwargs.setdefault("backend", "local")
+        kwargs.setdefault("fallback", "")
+        kwargs.setdefault("index", "numpy")
+        kwargs.setdefault("mode", "memory")
+        kwargs.setdefault("hierarchical", False)
+        return VectorStore(namespace=namespace or f"test{uuid.uuid4().hex[:12]}", **kwargs)
+    return make
@@ -0,0 +1,147 @@
+"""Duplicate chunks become back-references on one entry - and lose them again on update / delete"""
+
+from conftest import make_chunks, make_text
+
+
+def entry_docs(store):
+    """{entry_id: [doc ids it stands for]}"""
+    found = store.collection.get(include=["metadatas"])
+    return {entry_id: meta["docs"] for entry_id, meta in zip(found["ids"], found["metadatas"])}
+
+
+def near_duplicate(text):
+    words = text.split()
+    words[len(words) // 2] = "changed"
+    return " ".join(words)
+
+
+def test_duplicates_attach_to_existing_entries(make_store):
+    store = make_store()
+    shared, own_a, own_b = make_text(1), make_text(2), make_text(3)
+    store.add_documents([("docA", make_chunks("docA", [shared, own_a]), None, "hashA")])
+    
+    _, stats = store._index([("docB", make_chunks("docB", [shared, near_duplicate(own_a), own_b]), None, "hashB")])
+    
+    assert stats["merged"] == 2
+    assert stats["embedded"] == 1
+    assert store.count() == 3
+    docs = entry_docs(store)
+    assert docs["docA_chunk_0"] == ["docA", "docB"]
+    assert docs["docA_chunk_1"] == ["docA", "docB"]
+    assert docs["docB_chunk_2"] == ["docB"]
+    
+    listed = store.list_documents()
+    assert listed["docA"]["chunks"] == 2
+    assert listed["docB"]["chunks"] == 3
+    assert listed["docB"]["hash"] == "hashB"
+    chunks = store.get_document_chunks("docB")
+    assert sorted(chunk["page"] for chunk in chunks) == ["1", "2", "3"]
+    assert {chunk["file"] for chunk in chunks} == {"docB.pdf"}
+
+
+def test_update_detaches_and_reattaches(make_store):
+    store = make_store()
+    shared, own_a, old_b, kept_b, new_b = (make_text(seed) for seed in range(10, 15))
+    store.add_documents([("docA", make_chunks("docA", [shared, own_a]), None, "hashA")])
+    store.add_documents([("docB", make_chunks("docB", [shared, old_b, kept_b]), None, "hashB")])
+    assert store.count() == 4
+    
+    _, stats = store.update_document("docB", make_chunks("docB", [kept_b, shared, new_b]), "hashB2")
+    
+    # kept_b and shared land back on their entries, only new_b is embedded, old_b goes
+    assert stats["kept"] == 2
+    assert stats["embedded"] == 1
+    assert stats["removed"] == 1
+    assert store.count() == 4
+    docs = entry_docs(store)
+    assert docs["docA_chunk_0"] == ["docA", "docB"]
+    assert "docB_chunk_1" not in docs
+    assert docs["docB_chunk_2"] == ["docB"]
+    
+    listed = store.list_documents()
+    assert listed["docA"] == {"file": "docA.pdf", "hash": "hashA", "chunks": 2}
+    assert listed["docB"] == {"file": "docB.pdf", "hash": "hashB2", "chunks": 3}
+    pages = {chunk["text"]: chunk["page"] for chunk in store.get_document_chunks("docB")}
+    assert pages == {kept_b: "1", shared: "2", new_b: "3"}
+
+
+def test_update_drops_refs_the_new_version_lost(make_store):
+    store = make_store()
+    shared, own_a, own_b = make_text(20), make_text(21), make_text(22)
+    store.add_documents([("docA", make_chunks("docA", [shared, own_a]), None, "hashA")])
+    store.add_documents([("docB", make_chunks("docB", [shared, own_b]), None, "hashB")])
+    
+    _, stats = store.update_document("docB", make_chunks("docB", [own_b]), "hashB2")
+    
+    # The shared entry is docA's alone again - detached, not removed
+    assert stats["removed"] == 0
+    docs = entry_docs(store)
+    assert docs["docA_chunk_0"] == ["docA"]
+    meta = store.collection.get(ids=["docA_chunk_0"], include=["metadatas"])["metadatas"][0]
+    assert meta["ndocs"] == 1
+    assert meta["refs"] == ["docA|hashA|1|docA.pdf"]
+    assert store.list_documents()["docB"]["chunks"] == 1
+
+
+def test_delete_detaches_shared_entries(make_store):
+    store = make_store()
+    shared, own_a, own_b = make_text(30), make_text(31), make_text(32)
+    store.add_documents([
+        ("docA", make_chunks("docA", [shared, own_a]), None, "hashA"),
+        ("docB", make_chunks("docB", [own_b, shared]), None, "hashB"),
+        ("docC", make_chunks("docC", [shared]), None, "hashC")
+    ])
+    assert store.count() == 3
+    assert entry_docs(store)["docA_chunk_0"] == ["docA", "docB", "docC"]
+    
+    store.delete_documents(["docA", "docC"])
+    
+    docs = entry_docs(store)
+    assert docs == {"docA_chunk_0": ["docB"], "docB_chunk_0": ["docB"]}
+    meta = store.collection.get(ids=["docA_chunk_0"], include=["metadatas"])["metadatas"][0]
+    assert meta["ndocs"] == 1
+    assert (meta["doc_id"], meta["page"], meta["file"]) == ("docB", "2", "docB.pdf")
+    assert list(store.list_documents()) == ["docB"]
+    assert {chunk["text"] for chunk in store.get_document_chunks("docB")} == {shared, own_b}
+    assert store.search(shared, k=5, doc_id="docA") == []
+    
+    store.delete_document("docB")
+    assert store.count() == 0
+
+
+def test_readding_after_delete_embeds_again(make_store):
+    store = make_store()
+    text = make_text(40)
+    store.add_documents([("docA", make_chunks("docA", [text]), None, "hashA")])
+    store.delete_document("docA")
+    
+    _, stats = store._index([("docB", make_chunks("docB", [text]), None, "hashB")])
+    
+    # The LSH index still knew the deleted entry - it must not be attached to
+    assert stats["merged"] == 0
+    assert entry_docs(store) == {"docB_chunk_0": ["docB"]}
+
+
+def test_failed_write_is_not_reported_as_indexed(make_store, monkeypatch):
+    store = make_store()
+    shared = make_text(50)
+    store.add_documents([("docA", make_chunks("docA", [shared]), None, "hashA")])
+    
+    def reject(*args, **kwargs):
+        raise ValueError("Expected metadata value to be a str, int, float, bool, or None")
+    monkeypatch.setattr(store.collection, "upsert", reject)
+    monkeypatch.setattr(store.collection, "update", reject)
+    
+    # One new chunk (upsert) and one duplicate (update of docA's entry) - neither lands
+    indexed, stats = store._index([("docB", make_chunks("docB", [make_text(51), shared]), None, "hashB")])
+    
+    assert indexed == [[]]
+    assert stats["failed"] == 2
+    assert store.count() == 1
+    assert entry_docs(store) == {"docA_chunk_0": ["docA"]}
+    
+    # The entry that never got written isn't a dedup target either
+    monkeypatch.undo()
+    _, stats = store._index([("docC", make_chunks("docC", [make_text(51)]), None, "hashC")])
+    assert stats["merged"] == 0
+    assert stats["embedded"] == 1
@@ -0,0 +1,97 @@
+"""Quantized NumPy collections: recall against exact search, before and after reopening the folder"""
+
+import numpy as np
+import pytest
+
+import numpy_index
+from numpy_index import NumpyClient, QuantizedCollection
+
+DIM = 64
+ROWS = 3000
+K = 10
+
+
+def clustered(rows, seed):
+    """Unit vectors around 30 centres - neighbours are close but not trivially separated"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(30, DIM))
+    vectors = centres[rng.integers(0, 30, size=rows)] + 0.6 * rng.normal(size=(rows, DIM))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def fill(collection, vectors):
+    for start in range(0, len(vectors), 700):
+        block = range(start, min(start + 700, len(vectors)))
+        collection.upsert(
+            ids=[f"e{i}" for i in block],
+            embeddings=vectors[start:start + len(block)].tolist(),
+            documents=[f"text {i}" for i in block],
+            metadatas=[{"group": "even" if i % 2 == 0 else "odd"} for i in block]
+        )
+
+
+def recall(collection, vectors, queries, where=None, allowed=None):
+    """Mean share of the exact top K found by the collection"""
+    found = collection.query(query_embeddings=queries.tolist(), n_results=K, where=where)["ids"]
+    candidates = np.arange(len(vectors)) if allowed is None else allowed
+    scores = queries @ vectors[candidates].T
+    hits = 0
+    for qi, ids in enumerate(found):
+        exact = {f"e{candidates[i]}" for i in np.argsort(-scores[qi])[:K]}
+        hits += len(exact & set(ids))
+    return hits / (len(queries) * K)
+
+
+@pytest.fixture(autouse=True)
+def small_pq_training(monkeypatch):
+    # Train the PQ codebooks on this small corpus instead of searching it exactly
+    monkeypatch.setattr(numpy_index, "PQ_TRAIN_SIZE", 1000)
+
+
+@pytest.mark.parametrize("quantization, minimum", [("int8", 0.95), ("pq", 0.8)])
+def test_recall_after_reopen(tmp_path, monkeypatch, quantization, minimum):
+    vectors = clustered(ROWS, 1)
+    queries = clustered(50, 2)
+    collection = NumpyClient(tmp_path, quantization=quantization).get_or_create_collection("docs")
+    fill(collection, vectors)
+    assert isinstance(collection, QuantizedCollection)
+    assert (tmp_path / "docs.codes.npy").exists()
+    assert (tmp_path / "docs.pq.npy").exists() == (quantization == "pq")
+    before = recall(collection, vectors, queries)
+    assert before >= minimum
+    codes = np.array(collection.codes[..., :ROWS] if quantization == "pq" else collection.codes[:ROWS])
+    collection.close()
+    
+    # A reopened collection maps the stored codes - nothing is encoded (or trained) again
+    def no_encoding(*args):
+        raise AssertionError("codes were rebuilt on reopen")
+    monkeypatch.setattr(QuantizedCollection, "_encode_rows", no_encoding)
+    reopened = NumpyClient(tmp_path, quantization=quantization).get_collection("docs")
+    assert reopened.count() == ROWS
+    assert np.array_equal(reopened.codes[..., :ROWS] if quantization == "pq" else reopened.codes[:ROWS], codes)
+    assert recall(reopened, vectors, queries) == before
+    
+    even = np.arange(0, ROWS, 2)
+    assert recall(reopened, vectors, queries, where={"group": "even"}, allowed=even) >= minimum
+
+
+@pytest.mark.parametrize("quantization", ["int8", "pq"])
+def test_writes_after_reopen(tmp_path, quantization):
+    vectors = clustered(ROWS, 3)
+    fill(NumpyClient(tmp_path, quantization=quantization).get_or_create_collection("docs"), vectors)
+    
+    collection = NumpyClient(tmp_path, quantization=quantization).get_collection("docs")
+    deleted = [f"e{i}" for i in range(0, ROWS, 3)]
+    collection.delete(ids=deleted)
+    moved = clustered(1, 4)[0]
+    collection.upsert(ids=["e1"], embeddings=[moved.tolist()], documents=["moved"], metadatas=[{"group": "odd"}])
+    
+    # Holes are filled from the tail - the codes have to follow their rows
+    assert collection.count() == ROWS - len(deleted)
+    result = collection.query(query_embeddings=[moved.tolist()], n_results=1, include=["documents", "distances"])
+    assert result["ids"][0] == ["e1"]
+    assert result["distances"][0][0] == pytest.approx(0.0, abs=1e-5)
+    kept = np.array([i for i in range(ROWS) if i % 3 and i != 1])
+    found = collection.query(query_embeddings=vectors[kept[:20]].tolist(), n_results=1)["ids"]
+    assert [ids[0] for ids in found] == [f"e{i}" for i in kept[:20]]
+    assert not set(deleted) & set(collection.get(include=[])["ids"])
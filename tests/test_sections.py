@@ -0,0 +1,67 @@
+"""Two-stage (section) search: the section index has to match the chunks of the space it searches"""
+
+import json
+
+from conftest import make_chunks, make_text
+
+
+def top_ids(store, query, k=3):
+    return [hit["id"] for hit in store.search(query, k=k, mode="dense")]
+
+
+def test_turning_on_later_keeps_older_documents(make_store):
+    flat = make_store(hierarchical=False)
+    text_a = make_text(60)
+    flat.add_documents([("docA", make_chunks("docA", [text_a, make_text(61)]), None, "hashA")])
+    
+    store = make_store(namespace=flat.namespace, hierarchical=True)
+    assert store._sections(store.collection) is None
+    assert top_ids(store, text_a)[0] == "docA_chunk_0"
+    
+    # The first write builds the section index from the whole space, not just the new chunks
+    text_b = make_text(62)
+    store.add_documents([("docB", make_chunks("docB", [text_b]), None, "hashB")])
+    sections = store._sections(store.collection)
+    assert sections is not None
+    assert sections.count() == 2
+    assert top_ids(store, text_a)[0] == "docA_chunk_0"
+    assert top_ids(store, text_b)[0] == "docB_chunk_0"
+
+
+def test_switching_off_and_on_rebuilds(make_store):
+    store = make_store(hierarchical=True)
+    texts = [make_text(seed) for seed in range(70, 74)]
+    store.add_documents([("docA", make_chunks("docA", texts), None, "hashA")])
+    assert store._sections(store.collection).count() == 1
+    
+    store.set_hierarchical(False)
+    assert store._sections(store.collection) is None
+    store.add_documents([("docB", make_chunks("docB", [make_text(75)]), None, "hashB")])
+    
+    store.set_hierarchical(True)
+    assert store._sections(store.collection).count() == 2
+    assert top_ids(store, texts[2])[0] == "docA_chunk_2"
+    
+    store.delete_document("docA")
+    assert store._sections(store.collection).count() == 1
+    assert top_ids(store, make_text(75))[0] == "docB_chunk_0"
+
+
+def test_filtered_delete_rebuilds_the_sections_hit(make_store):
+    store = make_store(hierarchical=True)
+    texts = [make_text(seed) for seed in range(80, 92)]
+    chunks = make_chunks("docA", texts)
+    for chunk in chunks[10:]:
+        chunk["page"] = 11 + chunk["page"]  # pages 22, 23: a second section
+    store.add_documents([("docA", chunks, None, "hashA"), ("docB", make_chunks("docB", [make_text(92)]), None, "hashB")])
+    sections = store._sections(store.collection)
+    assert sections.count() == 3
+    
+    store.delete_where({"page": {"$in": ["21", "22", "23"]}})
+    
+    # docA's second section is empty now and gone; the others still point at live entries only
+    assert sections.count() == 2
+    found = sections.collection.get(include=["documents", "metadatas"])
+    members = {meta["doc_id"]: len(json.loads(doc)) for doc, meta in zip(found["documents"], found["metadatas"])}
+    assert members == {"docA": 10, "docB": 1}
+    assert top_ids(store, texts[3])[0] == "docA_chunk_3"
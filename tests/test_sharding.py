@@ -0,0 +1,139 @@
+"""Sharded collections: splitting as shards fill up, and per-shard results merged back into one"""
+
+import numpy as np
+
+from numpy_index import NumpyClient
+from sharding import ShardedCollection, open_collection, shard_name
+
+DIM = 16
+
+
+def entries(doc_ids, per_doc, seed=0):
+    """(ids, embeddings, documents, metadatas) for per_doc chunks of each document"""
+    ids = [f"{doc_id}_c{i}" for doc_id in doc_ids for i in range(per_doc)]
+    vectors = np.random.default_rng(seed).normal(size=(len(ids), DIM))
+    metadatas = [{"doc_id": entry_id.split("_")[0], "n": i} for i, entry_id in enumerate(ids)]
+    return ids, vectors.tolist(), [f"text of {entry_id}" for entry_id in ids], metadatas
+
+
+def add(collection, data, batch=25):
+    ids, vectors, documents, metadatas = data
+    for start in range(0, len(ids), batch):
+        window = slice(start, start + batch)
+        collection.upsert(ids=ids[window], embeddings=vectors[window], documents=documents[window], metadatas=metadatas[window])
+
+
+def assert_routed(collection):
+    for index, shard in enumerate(collection.shards):
+        assert all(collection._route(entry_id) == index for entry_id in shard.get(include=[])["ids"])
+
+
+def test_splits_as_shards_fill_up():
+    collection = ShardedCollection(NumpyClient(), "docs", shards=1, max_entries=50)
+    data = entries([f"doc{i}" for i in range(20)], 10)
+    add(collection, data)
+    
+    assert len(collection.shards) > 1
+    assert collection.count() == 200
+    assert all(shard.count() <= 50 for shard in collection.shards)
+    assert_routed(collection)
+    assert sorted(collection.get(include=[])["ids"]) == sorted(data[0])
+    found = collection.get(ids=data[0][::7], include=["documents", "metadatas"])
+    assert sorted(zip(found["ids"], found["documents"])) == sorted((i, f"text of {i}") for i in data[0][::7])
+
+
+def test_one_document_never_splits():
+    collection = ShardedCollection(NumpyClient(), "docs", shards=1, max_entries=10)
+    add(collection, entries(["big"], 120), batch=10)
+    
+    assert len(collection.shards) == 1
+    assert collection.count() == 120
+    collection.rebalance()
+    assert len(collection.shards) == 1
+
+
+def test_reopen_finds_every_shard():
+    client = NumpyClient()
+    collection = ShardedCollection(client, "docs", shards=1, max_entries=50)
+    add(collection, entries([f"doc{i}" for i in range(20)], 10))
+    
+    # Unsharded config: the split workspace stays sharded
+    reopened = open_collection(client, "docs", shards=1)
+    assert isinstance(reopened, ShardedCollection)
+    assert [shard.name for shard in reopened.shards] == [shard_name("docs", i) for i in range(len(collection.shards))]
+    assert reopened.count() == 200
+    assert_routed(reopened)
+
+
+def test_sees_shards_another_process_added(tmp_path):
+    # A long-lived session with sharding off, and bulk_ingest splitting the same folder
+    session = open_collection(NumpyClient(tmp_path), "docs", shards=1)
+    add(session, entries(["doc0"], 5))
+    ingest = ShardedCollection(NumpyClient(tmp_path), "docs", shards=1, max_entries=50)
+    data = entries([f"doc{i}" for i in range(1, 21)], 10, seed=1)
+    add(ingest, data)
+    assert len(ingest.shards) > 1
+    
+    assert session.count() == 205
+    assert len(session.shards) == len(ingest.shards)
+    assert sorted(session.get(ids=data[0][::9], include=[])["ids"]) == sorted(data[0][::9])
+    nearest = session.query(query_embeddings=data[1][::40], n_results=1)["ids"]
+    assert [ids[0] for ids in nearest] == data[0][::40]
+    
+    # The session's writes land where the other process looks for them
+    extra = entries(["late"], 3, seed=2)
+    add(session, extra)
+    assert sorted(ingest.get(ids=extra[0], include=[])["ids"]) == sorted(extra[0])
+    assert_routed(ingest)
+
+
+def test_resize_spreads_an_existing_collection():
+    client = NumpyClient()
+    plain = open_collection(client, "docs", shards=1)
+    data = entries([f"doc{i}" for i in range(12)], 5)
+    add(plain, data)
+    
+    collection = open_collection(client, "docs", shards=4)
+    assert len(collection.shards) == 4
+    assert collection.count() == 60
+    assert all(shard.count() > 0 for shard in collection.shards)
+    assert_routed(collection)
+
+
+def test_migration_cleans_up_after_interruption():
+    collection = ShardedCollection(NumpyClient(), "docs", shards=2, max_entries=1000)
+    add(collection, entries([f"doc{i}" for i in range(8)], 4))
+    
+    # An interrupted move: entries copied to the wrong shard, originals not deleted yet
+    stray = collection.shards[0].get(include=["embeddings", "documents", "metadatas"], limit=3)
+    collection.shards[1].upsert(ids=stray["ids"], embeddings=[list(v) for v in stray["embeddings"]],
+                                documents=stray["documents"], metadatas=stray["metadatas"])
+    assert collection.count() == 35
+    collection._migrate()
+    
+    assert collection.count() == 32
+    assert_routed(collection)
+
+
+def test_merged_results_match_one_collection():
+    client = NumpyClient()
+    collection = ShardedCollection(client, "docs", shards=4)
+    single = client.get_or_create_collection("single")
+    data = entries([f"doc{i}" for i in range(16)], 6)
+    add(collection, data)
+    add(single, data)
+    queries = np.random.default_rng(1).normal(size=(5, DIM)).tolist()
+    
+    for where in (None, {"doc_id": {"$in": ["doc1", "doc2", "doc9"]}}):
+        sharded = collection.query(query_embeddings=queries, n_results=8, where=where)
+        expected = single.query(query_embeddings=queries, n_results=8, where=where)
+        assert sharded["ids"] == expected["ids"]
+        assert np.allclose(sharded["distances"], expected["distances"])
+        assert sharded["documents"] == expected["documents"]
+    
+    # Limits and filtered deletes apply across shards
+    assert len(collection.get(include=[], limit=7)["ids"]) == 7
+    assert len(collection.get(where={"doc_id": "doc3"}, include=["metadatas"])["metadatas"]) == 6
+    collection.delete(where={"doc_id": {"$in": ["doc3", "doc4"]}})
+    assert collection.count() == 84
+    assert not {"doc3", "doc4"} & {entry_id.split("_")[0] for entry_id in collection.get(include=[])["ids"]}
@@ -0,0 +1,128 @@
+"""Snapshot export / import round trip - vectors, metadata and documents come back unchanged"""
+
+import io
+import json
+
+import numpy as np
+import pytest
+
+from conftest import make_text
+from document_processor import DocumentProcessor
+from vector_store import WORKSPACES_FILE, get_ingest_cache
+
+DOC_A, DOC_B, DOC_C, DOC_S = "a" * 16, "b" * 16, "c" * 16, "5" * 16
+
+
+def make_doc(doc_id, pages):
+    chunks = DocumentProcessor()._create_chunks(pages, f"{doc_id}.pdf", doc_id, ".pdf")
+    return {"id": doc_id, "hash": f"hash-{doc_id}", "name": f"{doc_id}.pdf", "type": "PDF",
+            "chunks": chunks, "pages": len(pages), "size": 1, "uploaded": "", "word_count": 0}
+
+
+def fill(store):
+    """Two documents sharing a page plus one streamed document. Returns them as the app keeps them."""
+    shared = make_text(100, 150)
+    docs = [
+        make_doc(DOC_A, {1: shared, 2: make_text(101, 150)}),
+        make_doc(DOC_B, {1: make_text(102, 150), 2: shared})
+    ]
+    for doc in docs:
+        store.add_documents([(doc["id"], doc["chunks"], None, doc["hash"])])
+    
+    streamed = make_doc(DOC_S, {1: make_text(103, 150)})
+    store.add_documents([(DOC_S, streamed["chunks"], None, streamed["hash"])])
+    content = store.content_path(DOC_S, ".txt")
+    content.write_text("streamed content", encoding="utf-8")
+    header = dict(streamed, chunks=[], chunk_count=len(streamed["chunks"]), content_path=str(content))
+    store.content_path(DOC_S, ".json").write_text(json.dumps(header), encoding="utf-8")
+    return docs + [header]
+
+
+def entries(store):
+    found = store.collection.get(include=["embeddings", "documents", "metadatas"])
+    order = np.argsort(found["ids"])
+    return ([found["ids"][i] for i in order], np.asarray(found["embeddings"])[order],
+            [found["documents"][i] for i in order], [found["metadatas"][i] for i in order])
+
+
+def hits(store, queries):
+    return [[(hit["id"], hit["sources"]) for hit in results] for results in store.search_many(queries, k=3)]
+
+
+def test_round_trip(make_store, tmp_path):
+    source = make_store()
+    docs = fill(source)
+    path = tmp_path / "workspace.dssnap"
+    manifest = source.export_snapshot(path, docs)
+    assert manifest["documents"] == 3
+    assert [space["count"] for space in manifest["spaces"]] == [source.count()]
+    
+    target = make_store()
+    report = target.import_snapshot(path)
+    
+    assert report["entries"] == source.count() == target.count()
+    ids, vectors, texts, metas = entries(source)
+    new_ids, new_vectors, new_texts, new_metas = entries(target)
+    assert new_ids == ids
+    assert new_texts == texts
+    assert new_metas == metas
+    assert np.allclose(new_vectors, vectors, atol=1e-6)
+    assert target.list_documents() == source.list_documents()
+    
+    queries = [make_text(100, 20), make_text(103, 20)]
+    expected = hits(source, queries)
+    assert all(expected)
+    assert hits(target, queries) == expected
+    
+    # Documents come back as files of the workspace, with their content
+    restored = {doc["id"]: doc for doc in target.stored_documents()}
+    assert sorted(restored) == sorted([DOC_A, DOC_B, DOC_S])
+    for doc in docs[:2]:
+        with open(restored[doc["id"]]["content_path"], encoding="utf-8") as f:
+            assert f.read() == doc["chunks"].content()
+        assert restored[doc["id"]]["chunk_count"] == len(doc["chunks"])
+    assert target.content_path(DOC_S, ".txt").read_text(encoding="utf-8") == "streamed content"
+    # ... and never in the ingest cache every workspace reads from
+    assert all(get_ingest_cache().get(doc["hash"]) is None for doc in docs)
+
+
+def test_rejects_ids_that_leave_the_workspace(make_store, tmp_path):
+    WORKSPACES_FILE.parent.mkdir(parents=True, exist_ok=True)
+    WORKSPACES_FILE.write_text("{}", encoding="utf-8")
+    source = make_store()
+    fill(source)
+    path = tmp_path / "crafted.dssnap"
+    source.export_snapshot(path, [{"id": "../../../workspaces", "hash": "x", "name": "x.pdf", "chunks": [], "content": "owned"}])
+    
+    target = make_store()
+    with pytest.raises(ValueError):
+        target.import_snapshot(path)
+    assert target.count() == 0
+    assert WORKSPACES_FILE.read_text(encoding="utf-8") == "{}"
+    with pytest.raises(ValueError):
+        target.content_path("../../../workspaces", ".json")
+    
+    # Entries citing such an id are refused as well - the app opens files by the ids it lists
+    source.add_documents([("../escape", [{"id": "c0", "text": make_text(104), "page": 1, "file": "x.pdf"}], None, "x")])
+    source.export_snapshot(path, [])
+    with pytest.raises(ValueError):
+        target.import_snapshot(path)
+    assert target.count() == 0
+
+
+def test_import_keeps_dedup_working(make_store):
+    source = make_store()
+    fill(source)
+    snapshot = io.BytesIO()
+    source.export_snapshot(snapshot, docs=[])
+    snapshot.seek(0)
+    
+    target = make_store()
+    target.import_snapshot(snapshot)
+    
+    # Imported entries carry their MinHash signatures - a re-sent page is not embedded again
+    doc = make_doc(DOC_C, {1: make_text(101, 150)})
+    _, stats = target._index([(DOC_C, doc["chunks"], None, doc["hash"])])
+    assert stats["embedded"] == 0
+    assert stats["merged"] == len(doc["chunks"])
+    assert DOC_C in target.list_documents()
@@ -0,0 +1,65 @@
+"""Private (per-session) workspaces keep nothing process-wide, and drop() frees a workspace"""
+
+from conftest import make_chunks, make_text
+from vector_store import (WORKSPACES_FILE, get_bm25_index, get_lsh_index, get_section_cache,
+                          update_workspace_settings, workspace_settings)
+
+
+def cached_names():
+    return get_lsh_index.cache_info().currsize, get_bm25_index.cache_info().currsize, get_section_cache.cache_info().currsize
+
+
+def fill(store, seed):
+    text = make_text(seed)
+    store.add_documents([("docA", make_chunks("docA", [text, make_text(seed + 1)]), None, "hashA")])
+    return text
+
+
+def test_private_workspaces_stay_out_of_shared_state(make_store):
+    before = cached_names()
+    one = make_store(private=True, hierarchical=True)
+    other = make_store(private=True, hierarchical=True)
+    text = fill(one, 200)
+    fill(other, 210)
+    
+    assert [hit["id"] for hit in one.search(text, k=1)] == ["docA_chunk_0"]
+    assert one.client is not other.client
+    assert one.count() == other.count() == 2
+    assert cached_names() == before
+    
+    # Reopening with the session's client keeps its documents
+    again = make_store(namespace=one.namespace, private=True, client=one.client)
+    assert list(again.list_documents()) == ["docA"]
+
+
+def test_drop_frees_a_private_workspace(make_store):
+    store = make_store(private=True, hierarchical=True)
+    text = fill(store, 220)
+    store.search(text, k=1, mode="hybrid")
+    store.content_path("docA", ".txt").write_text("spooled", encoding="utf-8")
+    update_workspace_settings(store.namespace, hierarchical=True)
+    folder = store.content_path("docA", ".txt").parent
+    
+    store.drop()
+    
+    assert store.client.list_collections() == []
+    assert store._caches == {}
+    assert not folder.exists()
+    assert store.namespace not in WORKSPACES_FILE.read_text(encoding="utf-8")
+    assert workspace_settings(store.namespace) == {}
+
+
+def test_drop_empties_the_shared_caches(make_store):
+    store = make_store(hierarchical=True)
+    text = fill(store, 230)
+    store.search(text, k=1, mode="hybrid")
+    name = store.collection.name
+    assert len(get_bm25_index(name)) == 2
+    
+    store.drop()
+    
+    existing = {collection.name for collection in store.client.list_collections()}
+    assert not {name, f"{name}_h"} & existing
+    assert len(get_bm25_index(name)) == 0
+    assert len(get_lsh_index(name)) == 0
+    assert get_section_cache(name).rows == 0
@@ -0,0 +1,1650 @@
+"""Embedding + vector index layer (caches, rate limiting, Chroma workspaces) - no Streamlit,
+so the app and the bulk ingestion CLI share it"""
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+import sqlite3
+import threading
+import zlib
+from array import array
+from contextlib import closing
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# Vector DB
+import chromadb
+from chromadb.config import Settings as ChromaSettings
+
+from embeddings import EMBED_MODEL, BACKENDS, EmbeddingBackend, get_backend
+from numpy_index import VECTOR_QUANT, NumpyClient
+from sharding import VECTOR_SHARDS, open_collection
+from snapshot import SNAPSHOT_BATCH, SnapshotReader, write_snapshot
+from diversity import MMR_POOL, MMR_RERANK, mmr_select
+from sections import HIERARCHICAL_INDEX, SECTION_CANDIDATES, SectionCache, SectionIndex, section_name, section_of
+from hnsw_tuning import TUNE_QUERIES, TUNE_RECALL, TUNE_SAMPLE, autotune, built_params, hnsw_metadata, hnsw_params
+from dedup import DEDUP_THRESHOLD, LSHIndex, MinHasher
+from lexical import BM25Index
+from document_processor import ChunkSpans, fingerprint
+
+DATA_DIR = Path(os.getenv("DOC_STUDIO_DATA", "data"))
+CACHE_DIR = DATA_DIR / "cache"
+INGEST_CACHE_MAX_MB = int(os.getenv("INGEST_CACHE_MAX_MB", "512"))
+CONTENT_DIR = CACHE_DIR / "content"
+VECTOR_DB_DIR = DATA_DIR / "vector_db"
+WORKSPACES_FILE = DATA_DIR / "workspaces.json"
+DEFAULT_WORKSPACE = "guest"   # workspace of the CLIs when none is given
+DOC_ID_PATTERN = re.compile(r"[0-9a-f]{16}")   # file hash / md5 prefix every document id is
+# "persistent" keeps workspaces in VECTOR_DB_DIR across restarts, "memory" for read-only hosts
+VECTOR_STORE_MODE = os.getenv("VECTOR_STORE_MODE", "persistent")
+# "chroma" (HNSW) or "numpy" (exact search on one matrix - faster for small and medium corpora)
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "chroma")
+
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "gemini")    # default for workspaces that never picked one
+EMBED_FALLBACK = os.getenv("EMBED_FALLBACK", "local")   # takes over when the remote quota runs out, "" = off
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))  # API limit: 100 texts per request
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "4"))
+EMBED_RPM = int(os.getenv("EMBED_RPM", "100"))    # requests per minute for EMBED_MODEL
+EMBED_RPD = int(os.getenv("EMBED_RPD", "1000"))   # requests per day, 0 = no daily cap
+EMBED_MAX_RETRIES = 5
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))  # ~3 KB each at 768 dims
+
+SEARCH_MODE = os.getenv("SEARCH_MODE", "hybrid")  # "hybrid", "dense" or "lexical"
+HYBRID_MAX_ENTRIES = int(os.getenv("HYBRID_MAX_ENTRIES", "100000"))  # bigger spaces search dense unless asked for hybrid
+LEXICAL_SYNC_BATCH = 1000  # chunk texts fetched per step when a keyword index loads or catches up
+RRF_K = 60          # reciprocal rank fusion constant
+HYBRID_DEPTH = 4    # each ranking contributes k * HYBRID_DEPTH candidates to the fusion
+SEARCH_BATCH = 256  # query vectors per collection query in search_many
+REBUILD_BATCH = 1000  # entries per copy step when apply_hnsw rebuilds a collection
+
+logger = logging.getLogger("DocProcessor")
+
+
+# ============================================
+# 💾 INGESTION CACHE
+# ============================================
+
+class IngestionCache:
+    """
+    Disk cache of processed documents + chunk embeddings, keyed by SHA-256 of the file bytes.
+    Embeddings are stored with the backend tag they came from and only handed back to
+    callers embedding with that same backend. SQLite keeps it safe across sessions/processes;
+    least recently used entries are evicted once the total size goes over max_bytes.
+    """
+
+    def __init__(self, path=None, max_bytes=INGEST_CACHE_MAX_MB * 1024 * 1024):
+        self.path = Path(path or CACHE_DIR / "ingest_cache.sqlite3")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    doc BLOB NOT NULL,
+                    embeddings BLOB,
+                    dim INTEGER NOT NULL DEFAULT 0,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_lru ON entries(last_used)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+            if "backend" not in columns:
+                # Caches from before backends were pluggable only hold Gemini vectors
+                conn.execute(f"ALTER TABLE entries ADD COLUMN backend TEXT NOT NULL DEFAULT 'gemini:{EMBED_MODEL}'")
+    
+    def _connect(self):
+        # autocommit mode; transactions are opened explicitly where needed
+        return sqlite3.connect(str(self.path), timeout=30, isolation_level=None, check_same_thread=False)
+    
+    def get(self, key, backend=None):
+        """Returns (doc, embeddings) or None. Embeddings are [] unless they were made by backend (a tag)."""
+        try:
+            with self._lock, closing(self._connect()) as conn:
+                row = conn.execute(
+                    "SELECT doc, embeddings, dim, backend FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if not row:
+                    return None
+                conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            
+            doc = json.loads(zlib.decompress(row[0]).decode("utf-8"))
+            if isinstance(doc.get("chunks"), dict):
+                doc["chunks"] = ChunkSpans.from_json(doc["chunks"], doc["id"], doc["name"])
+            embeddings = []
+            if row[1] and row[2] and (backend is None or row[3] == backend):
+                flat = array("f")
+                flat.frombytes(row[1])
+                dim = row[2]
+                embeddings = [flat[i:i + dim].tolist() for i in range(0, len(flat), dim)]
+            return doc, embeddings
+        except Exception:
+            return None
+    
+    def put(self, key, doc, embeddings, backend=f"gemini:{EMBED_MODEL}"):
+        if isinstance(doc.get("chunks"), ChunkSpans):
+            doc = dict(doc, chunks=doc["chunks"].to_json())
+        doc_blob = zlib.compress(json.dumps(doc).encode("utf-8"))
+        dim = len(embeddings[0]) if embeddings else 0
+        flat = array("f")
+        for vector in embeddings:
+            flat.extend(vector)
+        emb_blob = flat.tobytes()
+        size = len(doc_blob) + len(emb_blob)
+        
+        if size > self.max_bytes:
+            return
+        
+        try:
+            with self._lock, closing(self._connect()) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO entries (key, doc, embeddings, dim, size, last_used, backend) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (key, doc_blob, emb_blob, dim, size, time.time(), backend)
+                    )
+                    self._evict(conn)
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+        except Exception:
+            pass
+    
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_used ASC").fetchall():
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+    
+    def stats(self):
+        try:
+            with closing(self._connect()) as conn:
+                count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            return {"entries": count, "bytes": total, "max_bytes": self.max_bytes}
+        except Exception:
+            return {"entries": 0, "bytes": 0, "max_bytes": self.max_bytes}
+
+
+@lru_cache(maxsize=None)
+def get_ingest_cache():
+    """One cache per server process, shared by every session"""
+    return IngestionCache()
+
+
+class EmbeddingCache:
+    """
+    Disk cache of single embeddings keyed by (model, task_type, sha256(text)).
+    Catches repeats across documents, sessions, overlapping chunks and queries.
+    LRU-trimmed to max_entries; hits/misses count the API calls it saved.
+    """
+
+    def __init__(self, path=None, max_entries=EMBED_CACHE_MAX_ENTRIES):
+        self.path = Path(path or CACHE_DIR / "embed_cache.sqlite3")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    task TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model, task, text_hash)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_lru ON embeddings(last_used)")
+    
+    def _connect(self):
+        return sqlite3.connect(str(self.path), timeout=30, isolation_level=None, check_same_thread=False)
+    
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+    
+    def get_many(self, model, task, texts):
+        """Cached vector per text, None where missing"""
+        hashes = [self.text_hash(t) for t in texts]
+        found = {}
+        try:
+            with self._lock, closing(self._connect()) as conn:
+                unique = list(set(hashes))
+                for start in range(0, len(unique), 500):
+                    part = unique[start:start + 500]
+                    rows = conn.execute(
+                        f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND task = ? "
+                        f"AND text_hash IN ({','.join('?' * len(part))})",
+                        [model, task, *part]
+                    ).fetchall()
+                    found.update(rows)
+                if found:
+                    now = time.time()
+                    conn.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE model = ? AND task = ? AND text_hash = ?",
+                        [(now, model, task, h) for h in found]
+                    )
+        except Exception:
+            found = {}
+        
+        vectors = []
+        for h in hashes:
+            blob = found.get(h)
+            if blob is None:
+                vectors.append(None)
+            else:
+                vector = array("f")
+                vector.frombytes(blob)
+                vectors.append(vector.tolist())
+        
+        hit_count = sum(v is not None for v in vectors)
+        self.hits += hit_count
+        self.misses += len(vectors) - hit_count
+        return vectors
+    
+    def put_many(self, model, task, texts, vectors):
+        now = time.time()
+        rows = [
+            (model, task, self.text_hash(t), array("f", v).tobytes(), now)
+            for t, v in zip(texts, vectors) if v is not None
+        ]
+        if not rows:
+            return
+        try:
+            with self._lock, closing(self._connect()) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings (model, task, text_hash, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                        rows
+                    )
+                    self._evict(conn)
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+        except Exception:
+            pass
+    
+    def _evict(self, conn):
+        count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        # Trim to 90% so we don't evict on every single insert
+        excess = count - int(self.max_entries * 0.9)
+        conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+            (excess,)
+        )
+    
+    def stats(self):
+        try:
+            with closing(self._connect()) as conn:
+                count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        except Exception:
+            count = 0
+        total = self.hits + self.misses
+        return {
+            "entries": count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+@lru_cache(maxsize=None)
+def get_embed_cache():
+    return EmbeddingCache()
+
+
+# ============================================
+# 🗄️ VECTOR DATABASE
+# ============================================
+
+def is_quota_error(error) -> bool:
+    err = str(error).lower()
+    return "429" in err or "quota" in err or "rate limit" in err or "resource_exhausted" in err
+
+
+def is_zero_quota(error) -> bool:
+    """429 for a model whose quota limit is 0 - retrying can never succeed"""
+    return bool(re.search(r"\b(?:limit|quota_value)\W+0\b", str(error)))
+
+
+def retry_delay_seconds(error, default=10.0) -> float:
+    """Server-suggested wait from a 429 ('retry_delay { seconds: N }' or 'Please retry in Ns')"""
+    text = str(error)
+    match = (re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", text)
+             or re.search(r"retry in ([\d.]+)\s*s", text, re.IGNORECASE))
+    return float(match.group(1)) if match else default
+
+
+class EmbeddingError(Exception):
+    """Embedding could not be produced - never replaced by a fake vector"""
+
+
+class RateLimiter:
+    """
+    Token bucket for embed requests: refills at rpm/60 tokens per second and
+    enforces a per-day cap. A 429 pauses every caller until retry_delay has passed.
+    """
+
+    def __init__(self, rpm=EMBED_RPM, rpd=EMBED_RPD):
+        self.rpm = max(1, rpm)
+        self.rpd = rpd
+        self.tokens = float(self.rpm)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.day = datetime.now().date()
+        self.used_today = 0
+        self.requests = 0  # total granted, for throughput reports
+        self.exhausted_on = None
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        while True:
+            with self._lock:
+                today = datetime.now().date()
+                if today != self.day:
+                    self.day, self.used_today = today, 0
+                if self.exhausted_on == today or (self.rpd and self.used_today >= self.rpd):
+                    raise EmbeddingError("Daily embedding quota used up")
+                
+                now = time.monotonic()
+                self.tokens = min(self.rpm, self.tokens + (now - self.updated) * self.rpm / 60)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    self.used_today += 1
+                    self.requests += 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) * 60 / self.rpm)
+            time.sleep(wait)
+    
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+    
+    def exhaust_day(self):
+        """Server says the daily quota is gone - stop asking until tomorrow"""
+        with self._lock:
+            self.exhausted_on = datetime.now().date()
+    
+    def day_used_up(self):
+        with self._lock:
+            today = datetime.now().date()
+            return self.exhausted_on == today or bool(self.rpd and self.day == today and self.used_today >= self.rpd)
+
+
+@lru_cache(maxsize=None)
+def get_embed_limiter():
+    """Process-wide: every session shares the same API key quota"""
+    return RateLimiter()
+
+
+@lru_cache(maxsize=None)
+def get_chroma_client(mode: str = VECTOR_STORE_MODE):
+    """One Chroma client per server process, shared by every session"""
+    os.environ['ANONYMIZED_TELEMETRY'] = 'False'
+    settings = ChromaSettings(anonymized_telemetry=False, allow_reset=True)
+    
+    if mode == "persistent":
+        try:
+            VECTOR_DB_DIR.mkdir(parents=True, exist_ok=True)
+            return chromadb.PersistentClient(path=str(VECTOR_DB_DIR), settings=settings)
+        except Exception as e:
+            logger.warning(f"Persistent vector store unavailable, using memory: {e}")
+    
+    # Memory-based DB setup (Vercel ke liye best)
+    return chromadb.EphemeralClient(settings=settings)
+
+
+@lru_cache(maxsize=None)
+def get_numpy_client(mode: str = VECTOR_STORE_MODE, quantization: str = VECTOR_QUANT):
+    """One NumPy client per server process and quantization; persistent mode memory-maps the matrices"""
+    if mode == "persistent":
+        folder = VECTOR_DB_DIR / ("numpy" if quantization == "none" else f"numpy_{quantization}")
+        try:
+            return NumpyClient(folder, quantization=quantization)
+        except Exception as e:
+            logger.warning(f"Persistent vector store unavailable, using memory: {e}")
+    return NumpyClient(quantization=quantization)
+
+
+@lru_cache(maxsize=None)
+def get_lsh_index(collection_name: str):
+    """One near-duplicate index per workspace, shared by every session"""
+    return LSHIndex()
+
+
+@lru_cache(maxsize=None)
+def get_bm25_index(collection_name: str):
+    """One keyword index per workspace, shared by every session"""
+    return BM25Index()
+
+
+@lru_cache(maxsize=None)
+def get_section_cache(collection_name: str):
+    """Chunk vectors of recently searched sections, per workspace, shared by every session"""
+    return SectionCache()
+
+
+def as_list(vector):
+    return vector.tolist() if hasattr(vector, "tolist") else list(vector)
+
+
+def make_ref(ref):
+    return f"{ref['doc_id']}|{ref['hash']}|{ref['page']}|{ref['file']}"
+
+
+def entry_refs(meta):
+    """Every (doc_id, hash, page, file) an index entry stands for. Entries from before
+    dedup carry only their own."""
+    if meta.get("refs"):
+        refs = []
+        for ref in meta["refs"]:
+            doc_id, doc_hash, page, file = ref.split("|", 3)
+            refs.append({"doc_id": doc_id, "hash": doc_hash, "page": page, "file": file})
+        return refs
+    return [{
+        "doc_id": meta.get("doc_id"),
+        "hash": meta.get("doc_hash", ""),
+        "page": str(meta.get("page", "")),
+        "file": meta.get("file", "Unknown")
+    }]
+
+
+def valid_doc_id(doc_id) -> bool:
+    """Is this an id DocumentProcessor hands out? Ids from outside (snapshots) become file names."""
+    return isinstance(doc_id, str) and DOC_ID_PATTERN.fullmatch(doc_id) is not None
+
+
+def entry_sources(meta):
+    """Distinct {"file", "page"} citations of an entry, owner first"""
+    return list({(ref["file"], ref["page"]): {"file": ref["file"], "page": ref["page"]}
+                 for ref in entry_refs(meta)}.values())
+
+
+def workspace_key(namespace: str) -> str:
+    """Workspaces are case-insensitive - "Guest" in the app and "guest" on the command line are one"""
+    return (namespace or DEFAULT_WORKSPACE).strip().lower()
+
+
+def workspace_collection(namespace: str, backend: EmbeddingBackend = None) -> str:
+    """Chroma-safe collection name for a user/workspace. Each embedding backend gets its
+    own collection; the Gemini one keeps the original name so existing workspaces stay put."""
+    namespace = workspace_key(namespace)
+    slug = re.sub(r"[^a-z0-9_-]", "_", namespace)[:40]
+    name = f"docs_{slug}_{hashlib.md5(namespace.encode()).hexdigest()[:8]}"
+    if backend is not None and backend.name != "gemini":
+        name += f"_{backend.name}"
+    return name
+
+
+def workspace_settings(namespace: str) -> dict:
+    """Per-workspace settings saved in WORKSPACES_FILE ({} if none)"""
+    try:
+        return json.loads(WORKSPACES_FILE.read_text(encoding="utf-8")).get(workspace_key(namespace), {})
+    except:
+        return {}
+
+
+def update_workspace_settings(namespace: str, **values):
+    try:
+        settings = json.loads(WORKSPACES_FILE.read_text(encoding="utf-8"))
+    except:
+        settings = {}
+    settings.setdefault(workspace_key(namespace), {}).update(values)
+    _save_workspace_settings(settings)
+
+
+def _save_workspace_settings(settings):
+    try:
+        WORKSPACES_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp = WORKSPACES_FILE.with_suffix(".tmp")
+        tmp.write_text(json.dumps(settings, indent=2), encoding="utf-8")
+        tmp.replace(WORKSPACES_FILE)
+    except Exception as e:
+        logger.warning(f"Could not save workspace settings: {e}")
+
+
+def forget_workspace_settings(namespace: str):
+    """Drop a deleted workspace's entry from WORKSPACES_FILE"""
+    try:
+        settings = json.loads(WORKSPACES_FILE.read_text(encoding="utf-8"))
+    except:
+        return
+    if settings.pop(workspace_key(namespace), None) is not None:
+        _save_workspace_settings(settings)
+
+
+def workspace_backend(namespace: str) -> str:
+    """Embedding backend picked for a workspace (EMBED_BACKEND if it never picked one)"""
+    return workspace_settings(namespace).get("backend") or EMBED_BACKEND
+
+
+def set_workspace_backend(namespace: str, backend: str):
+    get_backend(backend)  # unknown names fail here, not on the next open
+    update_workspace_settings(namespace, backend=backend)
+
+
+def workspace_hnsw(namespace: str) -> dict:
+    """HNSW parameters for a workspace's Chroma collections (HNSW_* defaults if never tuned)"""
+    return hnsw_params(workspace_settings(namespace).get("hnsw"))
+
+
+def set_workspace_hnsw(namespace: str, params: dict):
+    update_workspace_settings(namespace, hnsw=hnsw_params(params))
+
+
+class VectorStore:
+    """
+    One workspace = one Chroma collection per embedding backend ("space"), so vectors from
+    different models never meet. Writes go to the active backend's space; reads cover every
+    space the workspace has. When the remote quota runs out, writes move to the fallback
+    backend's space for the rest of the session.
+    """
+    
+    def __init__(self, namespace: str = "default", mode: str = VECTOR_STORE_MODE,
+                 batch_size: int = EMBED_BATCH_SIZE, workers: int = EMBED_WORKERS,
+                 limiter: RateLimiter = None, embed_cache: EmbeddingCache = None,
+                 dedup_threshold: float = DEDUP_THRESHOLD, backend: str = None,
+                 fallback: str = EMBED_FALLBACK, index: str = VECTOR_INDEX,
+                 quantization: str = VECTOR_QUANT, shards: int = VECTOR_SHARDS, hnsw: dict = None,
+                 hierarchical: bool = None, private: bool = False, client=None):
+        self.namespace = namespace
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self.limiter = limiter or get_embed_limiter()
+        self.embed_cache = embed_cache or get_embed_cache()
+        self.dedup_threshold = dedup_threshold
+        self.hasher = MinHasher()
+        
+        self.backend = get_backend(backend or workspace_backend(namespace))
+        self.fallback = get_backend(fallback) if fallback else None
+        self.fell_back = False
+        self.quota_hit = False
+        self.shards = shards
+        # HNSW params only shape collections built from now on - apply_hnsw() rebuilds old ones
+        self.hnsw = hnsw_params(dict(workspace_settings(namespace).get("hnsw") or {}, **(hnsw or {})))
+        # Two-stage search through section vectors - see sections.py
+        if hierarchical is None:
+            hierarchical = workspace_settings(namespace).get("hierarchical", HIERARCHICAL_INDEX)
+        self.hierarchical = hierarchical
+        self._section_indexes = {}
+        
+        # Private (per-session) workspaces get their own in-memory index (client: the one the
+        # session already has) and per-collection caches, so they go away with the session
+        # instead of piling up in the shared ones
+        self.private = private
+        self._caches = {} if private else None
+        
+        # Quantized storage ("int8" / "pq") only exists on the NumPy index
+        if private:
+            self.client = client or NumpyClient(quantization="none")
+        elif index == "numpy" or quantization != "none":
+            self.client = get_numpy_client(mode, quantization)
+        else:
+            self.client = get_chroma_client(mode)
+        self.collection = self._open(self.backend)
+    
+    
+    def _open(self, backend):
+        metadata = {"hnsw:space": "cosine", "embedder": backend.tag}
+        if not isinstance(self.client, NumpyClient):
+            metadata.update(hnsw_metadata(self.hnsw))
+        return open_collection(
+            self.client,
+            workspace_collection(self.namespace, backend),
+            metadata=metadata,
+            shards=self.shards
+        )
+    
+    def _cache(self, getter, name):
+        """get_lsh_index / get_bm25_index / get_section_cache for a collection - the process-wide
+        one, or for a private workspace its own"""
+        if self._caches is None:
+            return getter(name)
+        key = (getter.__name__, name)
+        if key not in self._caches:
+            self._caches[key] = getter.__wrapped__(name)  # uncached: a fresh index
+        return self._caches[key]
+    
+    def _sections(self, collection, create=False):
+        """Section index next to a space's chunk collection - None until it has been built
+        from the whole space: one holding only the chunks written since would hide the rest"""
+        if collection.name not in self._section_indexes:
+            if not create:
+                try:
+                    existing = {c.name for c in self.client.list_collections()}
+                except:
+                    existing = set()
+                if section_name(collection.name) not in existing:
+                    return None
+            metadata = {"hnsw:space": "cosine"}
+            if not isinstance(self.client, NumpyClient):
+                metadata.update(hnsw_metadata(self.hnsw))
+            self._section_indexes[collection.name] = SectionIndex(self.client, collection, metadata, self._cache(get_section_cache, collection.name))
+        return self._section_indexes[collection.name]
+    
+    def spaces(self):
+        """[(backend, collection)] for every space this workspace has, the active one first"""
+        spaces = [(self.backend, self.collection)]
+        try:
+            existing = {collection.name for collection in self.client.list_collections()}
+        except:
+            return spaces
+        for name in BACKENDS:
+            backend = get_backend(name)
+            if backend is not self.backend and workspace_collection(self.namespace, backend) in existing:
+                spaces.append((backend, self._open(backend)))
+        return spaces
+    
+    def _fall_back(self):
+        """Switch writes to the fallback space after a quota error. True if it switched."""
+        if not self.quota_hit or self.fallback is None or self.fallback is self.backend:
+            return False
+        logger.warning(f"{self.backend.name} embedding quota used up - indexing with {self.fallback.name} from now on")
+        self.backend = self.fallback
+        self.collection = self._open(self.backend)
+        self.fell_back = True
+        return True
+    
+    def content_path(self, doc_id, suffix):
+        """Where a streamed document's spooled content (.txt) and header (.json) live"""
+        folder = CONTENT_DIR / workspace_collection(self.namespace)
+        folder.mkdir(parents=True, exist_ok=True)
+        path = folder / f"{doc_id}{suffix}"
+        if path.resolve().parent != folder.resolve():
+            raise ValueError(f"Invalid document id: {str(doc_id)[:40]!r}")
+        return path
+    
+    def _request(self, content, task, backend=None):
+        """One embed call. Remote backends are rate-limited and back off on 429 using the server's retry_delay."""
+        backend = backend or self.backend
+        if not backend.remote:
+            try:
+                return backend.embed(content, task)
+            except Exception as e:
+                raise EmbeddingError(str(e)[:200]) from e
+        
+        for attempt in range(EMBED_MAX_RETRIES):
+            self.limiter.acquire()
+            try:
+                return backend.embed(content, task)
+            except Exception as e:
+                if not is_quota_error(e):
+                    raise EmbeddingError(str(e)[:200]) from e
+                if "PerDay" in str(e) or is_zero_quota(e):
+                    self.limiter.exhaust_day()
+                    raise EmbeddingError("Daily embedding quota used up") from e
+                delay = retry_delay_seconds(e)
+                logger.warning(f"Embed quota hit, retrying in {delay:.0f}s (attempt {attempt + 1})")
+                self.limiter.pause(delay)
+        raise EmbeddingError("Embedding quota still exceeded after retries")
+    
+    def _embed(self, text, task="retrieval_document", backend=None):
+        """Raises EmbeddingError instead of returning a placeholder vector"""
+        backend = backend or self.backend
+        text = text[:8000]
+        if not backend.remote:
+            return self._request(text, task, backend)  # cheaper than a cache lookup
+        cached = self.embed_cache.get_many(backend.tag, task, [text])[0]
+        if cached is not None:
+            return cached
+        vector = self._request(text, task, backend)
+        self.embed_cache.put_many(backend.tag, task, [text], [vector])
+        return vector
+    
+    def _embed_batch(self, texts, task="retrieval_document", backend=None):
+        """Embed texts with one request per batch_size group, groups running concurrently.
+        Cached and repeated texts are not sent. Failed items come back as None."""
+        backend = backend or self.backend
+        texts = [t[:8000] for t in texts]
+        if not backend.remote:
+            try:
+                return self._request(texts, task, backend)
+            except EmbeddingError as e:
+                logger.error(f"Embedding failed for {len(texts)} texts: {e}")
+                return [None] * len(texts)
+        
+        model = backend.tag
+        vectors = self.embed_cache.get_many(model, task, texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        if not missing:
+            return vectors
+        
+        groups = [missing[start:start + self.batch_size] for start in range(0, len(missing), self.batch_size)]
+        if len(groups) <= 1 or self.workers == 1:
+            results = [self._embed_group(group, task, backend) for group in groups]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(groups))) as pool:
+                results = list(pool.map(lambda group: self._embed_group(group, task, backend), groups))
+        
+        fresh = dict(zip(missing, (vector for group in results for vector in group)))
+        self.embed_cache.put_many(model, task, list(fresh), list(fresh.values()))
+        return [v if v is not None else fresh.get(t) for t, v in zip(texts, vectors)]
+    
+    def _embed_group(self, texts, task, backend=None):
+        try:
+            embeddings = self._request(texts, task, backend)
+            if len(embeddings) == len(texts):
+                return embeddings
+        except EmbeddingError as e:
+            # Quota errors hit every item alike - splitting would only burn more requests
+            if is_quota_error(e):
+                self.quota_hit = True
+            if is_quota_error(e) or len(texts) == 1:
+                logger.error(f"Embedding failed for {len(texts)} chunks: {e}")
+                return [None] * len(texts)
+        
+        if len(texts) == 1:
+            return [None]
+        
+        # Halve the group so one bad chunk doesn't sink the whole batch
+        mid = len(texts) // 2
+        return self._embed_group(texts[:mid], task, backend) + self._embed_group(texts[mid:], task, backend)
+    
+    def add_document(self, doc_id, chunks, vectors=None, doc_hash=""):
+        """Index chunks. Precomputed vectors (one per chunk) skip the embed calls.
+        Returns the embeddings that were indexed."""
+        return self.add_documents([(doc_id, chunks, vectors, doc_hash)])[0]
+    
+    def add_documents(self, items):
+        """Index several (doc_id, chunks, vectors, doc_hash) at once: chunks from all
+        documents share embedding batches and go in with a single upsert.
+        Returns the indexed embeddings per document."""
+        return self._index(items)[0]
+    
+    @property
+    def lsh(self):
+        """Workspace near-duplicate index, loaded from the stored signatures on first use"""
+        index = self._cache(get_lsh_index, self.collection.name)
+        with index.lock:
+            if not index.loaded:
+                try:
+                    results = self.collection.get(include=["metadatas"])
+                    for entry_id, meta in zip(results['ids'], results['metadatas']):
+                        if meta and meta.get("minhash"):
+                            index.add(entry_id, MinHasher.decode(meta["minhash"]))
+                except:
+                    pass
+                index.loaded = True
+        return index
+    
+    @staticmethod
+    def _doc_filter(doc_id):
+        # Entries from before dedup only carry their owner's doc_id
+        return {"$or": [{"doc_id": doc_id}, {"docs": {"$contains": doc_id}}]}
+    
+    @staticmethod
+    def _docs_filter(doc_ids):
+        """Entries citing any of doc_ids"""
+        doc_ids = list(doc_ids)
+        return {"$or": [{"doc_id": {"$in": doc_ids}}] + [{"docs": {"$contains": doc_id}} for doc_id in doc_ids]}
+    
+    @classmethod
+    def search_filter(cls, doc_id=None, file=None, page=None):
+        """
+        Index filter for search(): entries of one document, file and/or page (a page
+        number or a list of them). file and page match the citation an entry is shown with.
+        """
+        clauses = []
+        if doc_id:
+            clauses.append(cls._doc_filter(doc_id))
+        if file:
+            clauses.append({"file": file})
+        if page is not None:
+            pages = [str(p) for p in page] if isinstance(page, (list, tuple, set)) else [str(page)]
+            clauses.append({"page": {"$in": pages}})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+    
+    @staticmethod
+    def _entry_meta(meta, refs):
+        """Entry metadata for a set of back-references; the first one is the owner shown in citations"""
+        owner = refs[0]
+        meta = dict(meta, doc_id=owner["doc_id"], doc_hash=owner["hash"], page=owner["page"], file=owner["file"])
+        meta["docs"] = list(dict.fromkeys(ref["doc_id"] for ref in refs))
+        meta["ndocs"] = len(meta["docs"])  # lets deletes tell shared entries apart server-side
+        meta["refs"] = [make_ref(ref) for ref in refs]
+        return meta
+    
+    def _fetch_entries(self, ids):
+        """{entry_id: (meta, embedding)} for entries that still exist"""
+        if not ids:
+            return {}
+        try:
+            results = self.collection.get(ids=list(ids), include=["metadatas", "embeddings"])
+        except:
+            return {}
+        embeddings = results['embeddings'] if results['embeddings'] is not None else [None] * len(results['ids'])
+        return {
+            entry_id: (meta or {}, as_list(embedding) if embedding is not None else None)
+            for entry_id, meta, embedding in zip(results['ids'], results['metadatas'], embeddings)
+        }
+    
+    def _index(self, items, detached=None):
+        """
+        Shared write path. items are (doc_id, chunks, vectors, doc_hash); a missing or None
+        vector means "embed this chunk". Exact and near-duplicate chunks (MinHash/LSH) are
+        not embedded again - they become back-references on the entry they duplicate.
+        detached: {entry_id: {"meta", "refs", "vector"}} of existing entries whose refs from
+        the documents being re-indexed were already removed; chunks may attach to them again.
+        Returns (indexed embeddings per document, stats).
+        """
+        detached = detached or {}
+        collection = self.collection
+        stats = {"kept": 0, "reused": 0, "embedded": 0, "merged": 0, "removed": 0, "failed": 0}
+        lsh = self.lsh if self.dedup_threshold > 0 else None
+        
+        rows = []
+        for position, (doc_id, chunks, vectors, doc_hash) in enumerate(items):
+            vectors = vectors or []
+            for i, chunk in enumerate(chunks):
+                try:
+                    ref = {"doc_id": doc_id, "hash": doc_hash or "", "page": str(chunk['page']), "file": chunk['file']}
+                    rows.append((position, f"{doc_id}_{chunk['id']}", chunk['text'], ref,
+                                 vectors[i] if i < len(vectors) else None))
+                except:
+                    continue
+        signatures = self.hasher.signatures([row[2] for row in rows]) if lsh is not None else [None] * len(rows)
+        
+        # Existing entries that chunks are likely to land on, fetched in one go
+        existing = {}
+        if lsh is not None:
+            candidates = {lsh.query(sig, self.dedup_threshold)[0] for sig in signatures} - {None} - set(detached)
+            existing = self._fetch_entries(candidates)
+            for stale in candidates - set(existing):
+                lsh.remove(stale)  # deleted by another process
+        
+        new_entries, attached, placement = {}, {}, []
+        for (position, own_id, text, ref, vector), sig in zip(rows, signatures):
+            target = None
+            if lsh is not None:
+                target, _ = lsh.query(sig, self.dedup_threshold)
+                if target and target not in new_entries and target not in detached and target not in existing:
+                    existing.update(self._fetch_entries([target]))
+                    if target not in existing:
+                        lsh.remove(target)
+                        target = None
+            
+            if target is None:
+                entry_id = own_id
+                if entry_id in new_entries or entry_id in detached or (lsh is not None and entry_id in lsh.signatures):
+                    # Same position, different text - never overwrite an entry others may cite
+                    entry_id = f"{own_id}_{fingerprint(text)[:8]}"
+                new_entries[entry_id] = {"text": text, "refs": [ref], "vector": vector, "sig": sig}
+                if lsh is not None:
+                    lsh.add(entry_id, sig)
+            else:
+                entry_id = target
+                if target in new_entries:
+                    new_entries[target]["refs"].append(ref)
+                else:
+                    attached.setdefault(target, []).append(ref)
+                stats["kept" if target in detached else "merged"] += 1
+            placement.append((position, entry_id))
+        
+        # Only entries without a vector go to the embedding API
+        pending = [entry_id for entry_id, entry in new_entries.items() if entry["vector"] is None]
+        pending_ids = set(pending)
+        stats["reused"] = len(new_entries) - len(pending)
+        if pending:
+            for entry_id, vector in zip(pending, self._embed_batch([new_entries[e]["text"] for e in pending])):
+                new_entries[entry_id]["vector"] = vector
+            if any(new_entries[e]["vector"] is None for e in pending) and self._fall_back():
+                # Quota gone mid-batch: nothing is written yet, so index the whole batch in the
+                # fallback space instead (given vectors belong to the old one)
+                if lsh is not None:
+                    for entry_id in new_entries:
+                        lsh.remove(entry_id)
+                return self._index([(doc_id, chunks, None, doc_hash) for doc_id, chunks, _, doc_hash in items])
+        for entry_id, entry in list(new_entries.items()):
+            if entry["vector"] is None:
+                del new_entries[entry_id]
+                if lsh is not None:
+                    lsh.remove(entry_id)
+            elif entry_id in pending_ids:
+                stats["embedded"] += 1
+        
+        upserts = {
+            entry_id: self._entry_meta({"fp": fingerprint(entry["text"]), "embedder": self.backend.tag,
+                                        "minhash": MinHasher.encode(entry["sig"]) if entry["sig"] is not None else ""},
+                                       entry["refs"])
+            for entry_id, entry in new_entries.items()
+        }
+        updates, deletes = {}, []
+        for entry_id, refs in attached.items():
+            if entry_id in detached:
+                continue
+            meta, _ = existing[entry_id]
+            updates[entry_id] = self._entry_meta(meta, entry_refs(meta) + refs)
+        for entry_id, entry in detached.items():
+            refs = entry["refs"] + attached.get(entry_id, [])
+            if refs:
+                updates[entry_id] = self._entry_meta(entry["meta"], refs)
+            else:
+                deletes.append(entry_id)
+        
+        # New entries go in before leftovers come out, so search never sees a gap.
+        # Only chunks whose entry write went through count as indexed.
+        written = set()
+        try:
+            if upserts:
+                collection.upsert(
+                    ids=list(upserts),
+                    embeddings=[new_entries[e]["vector"] for e in upserts],
+                    documents=[new_entries[e]["text"] for e in upserts],
+                    metadatas=list(upserts.values())
+                )
+            written.update(upserts)
+            if updates:
+                collection.update(ids=list(updates), metadatas=list(updates.values()))
+            written.update(updates)
+            if deletes:
+                collection.delete(ids=deletes)
+                if lsh is not None:
+                    for entry_id in deletes:
+                        lsh.remove(entry_id)
+            self._sync_lexical({e: new_entries[e]["text"] for e in upserts}, deletes, collection)
+            stats["removed"] = len(deletes)
+        except Exception as e:
+            logger.error(f"Indexing failed: {e}")
+            if lsh is not None:
+                for entry_id in set(upserts) - written:
+                    lsh.remove(entry_id)
+        
+        indexed = [[] for _ in items]
+        sections = {}
+        for (position, entry_id), row in zip(placement, rows):
+            if entry_id not in written:
+                stats["failed"] += 1
+                continue
+            if entry_id in new_entries:
+                vector = new_entries[entry_id]["vector"]
+            elif entry_id in detached:
+                vector = detached[entry_id]["vector"]
+            else:
+                vector = existing[entry_id][1]
+            indexed[position].append(vector)
+            if self.hierarchical:
+                ref = row[3]
+                sections.setdefault((ref["doc_id"], section_of(ref["page"])), {})[entry_id] = vector
+        if sections:
+            try:
+                index = self._sections(collection)
+                if index is None:
+                    self._build_sections(collection)  # first write since two-stage search came on
+                else:
+                    index.add(sections)
+            except Exception as e:
+                logger.error(f"Section index update failed: {e}")
+        return indexed, stats
+    
+    def update_document(self, doc_id, chunks, doc_hash=""):
+        """
+        Swap a new version of an indexed document in place. The document's refs are taken
+        off its old entries first; chunks whose text is still there land back on them
+        (kept), moved text reuses stored vectors, and only new text is embedded.
+        Entries nobody references any more are removed afterwards, in every space.
+        Returns (indexed embeddings, {"kept", "reused", "embedded", "merged", "removed", "failed"}).
+        """
+        try:
+            old = self.collection.get(where=self._doc_filter(doc_id), include=["documents", "metadatas", "embeddings"])
+            old_embeddings = old['embeddings'] if old['embeddings'] is not None else []
+        except:
+            old, old_embeddings = {"ids": [], "documents": [], "metadatas": []}, []
+        
+        lsh = self.lsh if self.dedup_threshold > 0 else None
+        detached, vectors_by_fp = {}, {}
+        for entry_id, text, meta, embedding in zip(old['ids'], old['documents'], old['metadatas'], old_embeddings):
+            meta, text = meta or {}, text or ""
+            vector = as_list(embedding)
+            vectors_by_fp.setdefault(meta.get("fp") or fingerprint(text), vector)
+            if lsh is not None and entry_id not in lsh.signatures:
+                # Entry from before dedup - make it findable so unchanged chunks land on it
+                signature = self.hasher.signature(text)
+                lsh.add(entry_id, signature)
+                meta = dict(meta, minhash=MinHasher.encode(signature), fp=meta.get("fp") or fingerprint(text))
+            detached[entry_id] = {
+                "meta": meta,
+                "refs": [ref for ref in entry_refs(meta) if ref["doc_id"] != doc_id],
+                "vector": vector
+            }
+        
+        vectors = [vectors_by_fp.get(fingerprint(chunk['text'])) for chunk in chunks]
+        sections = self._sections(self.collection) if self.hierarchical else None
+        if sections is not None:
+            sections.drop([doc_id])  # rebuilt from the new version below
+        indexed, stats = self._index([(doc_id, chunks, vectors, doc_hash)], detached)
+        # The old version may sit in another space (switched backend, or the quota ran out just now)
+        for _, collection in self.spaces()[1:]:
+            stats["removed"] += self._release(collection, [doc_id])
+        return indexed[0], stats
+    
+    def add_stream(self, doc_id, chunks, doc_hash="", batch_chunks=None, on_batch=None):
+        """Index a chunk iterator in bounded batches so memory stays O(batch), not O(document).
+        Returns (indexed, total) chunk counts."""
+        batch_chunks = batch_chunks or self.batch_size * self.workers
+        indexed = total = 0
+        chunks = iter(chunks)
+        
+        while True:
+            batch = list(islice(chunks, batch_chunks))
+            if not batch:
+                break
+            indexed += len(self.add_document(doc_id, batch, doc_hash=doc_hash))
+            total += len(batch)
+            if on_batch:
+                on_batch(indexed, total)
+        
+        return indexed, total
+    
+    @property
+    def bm25(self):
+        return self._bm25(self.collection)
+    
+    def _bm25(self, collection):
+        """Keyword index of one space, built from the stored chunk texts on first search.
+        When another process changed the collection behind our back, only the entries
+        that differ are removed / fetched."""
+        index = self._cache(get_bm25_index, collection.name)
+        with index.lock:
+            try:
+                count = collection.count()
+            except:
+                return index
+            if index.loaded and len(index) == count:
+                return index
+            if not index.loaded:
+                index.clear()
+            try:
+                stored = collection.get(include=[])["ids"]
+                known = index.keys()
+                for entry_id in known.difference(stored):
+                    index.remove(entry_id)
+                missing = [entry_id for entry_id in stored if entry_id not in known]
+                for start in range(0, len(missing), LEXICAL_SYNC_BATCH):
+                    results = collection.get(ids=missing[start:start + LEXICAL_SYNC_BATCH], include=["documents"])
+                    for entry_id, text in zip(results['ids'], results['documents']):
+                        index.add(entry_id, text or "")
+            except:
+                pass
+            index.loaded = True
+        return index
+    
+    def _sync_lexical(self, added, removed, collection=None):
+        """Keep a loaded keyword index in step with writes (an unloaded one is built on first search)"""
+        index = self._cache(get_bm25_index, (collection or self.collection).name)
+        with index.lock:
+            if not index.loaded:
+                return
+            for entry_id in removed:
+                index.remove(entry_id)
+            for entry_id, text in added.items():
+                index.add(entry_id, text)
+    
+    def _result(self, entry_id, text, meta, distance=None):
+        meta = meta or {}
+        return {"id": entry_id, "text": text, "meta": meta, "sources": entry_sources(meta), "distance": distance}
+    
+    def _dense_search_many(self, queries, n, backend=None, collection=None, where=None, embeddings=None):
+        """One ranking per query (None where it couldn't be embedded). Queries are embedded by
+        the space's own backend - vectors are only comparable within a space - in batched
+        requests (unless embeddings are passed in), then sent as multi-vector collection queries."""
+        collection = collection or self.collection
+        if embeddings is None:
+            embeddings = self._embed_batch(queries, "retrieval_query", backend)
+        embedded = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+        
+        rankings = [None] * len(queries)
+        for start in range(0, len(embedded), SEARCH_BATCH):
+            part = embedded[start:start + SEARCH_BATCH]
+            kwargs = {"where": where} if where else {}
+            results = collection.query(query_embeddings=[embeddings[i] for i in part], n_results=n, **kwargs)
+            for row, i in enumerate(part):
+                output = []
+                for j, doc in enumerate(results['documents'][row] if results['documents'] else []):
+                    output.append(self._result(
+                        results['ids'][row][j],
+                        doc,
+                        results['metadatas'][row][j] if results['metadatas'] else {},
+                        results['distances'][row][j] if results.get('distances') else 0
+                    ))
+                rankings[i] = sorted(output, key=lambda x: x.get('distance', 999))
+        return rankings
+    
+    def _section_search_many(self, queries, n, backend=None, collection=None, embeddings=None):
+        """
+        Two-stage dense search: the SECTION_CANDIDATES closest sections per query, then
+        exact scoring of just their chunks. Spaces whose section index isn't built yet search flat.
+        """
+        collection = collection or self.collection
+        sections = self._sections(collection)
+        if sections is None or sections.count() == 0:
+            return self._dense_search_many(queries, n, backend, collection, embeddings=embeddings)
+        if embeddings is None:
+            embeddings = self._embed_batch(queries, "retrieval_query", backend)
+        embedded = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+        
+        rankings = [None] * len(queries)
+        for start in range(0, len(embedded), SEARCH_BATCH):
+            part = embedded[start:start + SEARCH_BATCH]
+            hits = sections.search([embeddings[i] for i in part], n, SECTION_CANDIDATES)
+            # Texts and metadata only for the winners
+            wanted = list(dict.fromkeys(entry_id for row in hits for entry_id, _ in row))
+            found = collection.get(ids=wanted, include=["documents", "metadatas"]) if wanted else {"ids": []}
+            by_id = {entry_id: (text, meta) for entry_id, text, meta in zip(found['ids'], found.get('documents') or [], found.get('metadatas') or [])}
+            for i, row in zip(part, hits):
+                rankings[i] = [self._result(entry_id, *by_id[entry_id], distance) for entry_id, distance in row if entry_id in by_id]
+        return rankings
+    
+    def _lexical_search(self, query, n, collection=None, keys=None):
+        collection = collection or self.collection
+        hits = self._bm25(collection).search(query, n, keys)
+        if not hits:
+            return []
+        found = collection.get(ids=[entry_id for entry_id, _ in hits], include=["documents", "metadatas"])
+        by_id = {entry_id: (text, meta) for entry_id, text, meta in zip(found['ids'], found['documents'], found['metadatas'])}
+        
+        output = []
+        for entry_id, score in hits:
+            if entry_id in by_id:
+                result = self._result(entry_id, *by_id[entry_id])
+                result["score"] = score
+                output.append(result)
+        return output
+    
+    @staticmethod
+    def _fuse(rankings, k):
+        """Reciprocal rank fusion: sum of 1 / (RRF_K + rank) over the rankings a hit appears in"""
+        fused = {}
+        for ranking in rankings:
+            for rank, result in enumerate(ranking, 1):
+                entry = fused.setdefault(result["id"], dict(result, score=0.0))
+                if entry.get("distance") is None:
+                    entry["distance"] = result.get("distance")
+                entry["score"] += 1.0 / (RRF_K + rank)
+        return sorted(fused.values(), key=lambda r: r["score"], reverse=True)[:k]
+    
+    @staticmethod
+    def _relevance(pool):
+        """What the pool was ranked by, on a 0-1 scale: the fused (or BM25) score where the
+        pool has one - exact keyword hits keep their weight - else the dense cosine"""
+        if all(result.get("score") is not None for result in pool):
+            top = max(result["score"] for result in pool) or 1.0
+            return [result["score"] / top for result in pool]
+        return [1.0 - (result.get("distance") or 0.0) for result in pool]
+    
+    def _diversify(self, pools, k):
+        """
+        MMR over each query's candidate pool (see diversity.py), with the vectors already
+        stored in the active space - no embedding calls. Candidates that have no vector
+        there (only in another space) keep their place after the diverse picks.
+        """
+        wanted = list(dict.fromkeys(result["id"] for pool in pools if len(pool) > k for result in pool))
+        if not wanted:
+            return [pool[:k] for pool in pools]
+        found = self.collection.get(ids=wanted, include=["embeddings"])
+        vector_of = dict(zip(found["ids"], found["embeddings"]))
+        
+        output = []
+        for pool in pools:
+            usable = [result for result in pool if result["id"] in vector_of]
+            if len(pool) <= k or len(usable) < 2:
+                output.append(pool[:k])
+                continue
+            vectors = [vector_of[result["id"]] for result in usable]
+            picked = [usable[i] for i in mmr_select(vectors, k, self._relevance(usable))]
+            chosen = {result["id"] for result in picked}
+            output.append((picked + [result for result in pool if result["id"] not in chosen])[:k])
+        return output
+    
+    def search(self, query, k=5, mode=None, doc_id=None, file=None, page=None, where=None, diverse=None):
+        """
+        mode: "dense" (embeddings), "lexical" (BM25 - no API call) or "hybrid", which fuses
+        both rankings with reciprocal rank fusion. Dense and hybrid fall back to keywords
+        when the query can't be embedded (quota used up, API down). Every space of the
+        workspace is searched and the rankings fused. Left to SEARCH_MODE, a space over
+        HYBRID_MAX_ENTRIES entries is searched dense until its keyword index is loaded.
+        doc_id / file / page (or a raw metadata where) restrict the search inside the index.
+        diverse: re-rank a k * MMR_POOL candidate pool with maximal marginal relevance, so
+        overlapping neighbour chunks don't fill the top k (default: MMR_RERANK).
+        """
+        return self.search_many([query], k, mode, doc_id, file, page, where, diverse)[0]
+    
+    def search_many(self, queries, k=5, mode=None, doc_id=None, file=None, page=None, where=None, diverse=None):
+        """
+        search() for many queries at once: per space, all queries are embedded in batched
+        requests (cached ones not at all) and sent as one multi-vector query.
+        Returns one result list per query, in order.
+        """
+        auto = mode is None
+        mode = mode or SEARCH_MODE
+        hybrid = mode not in ("dense", "lexical")
+        queries = list(queries)
+        diverse = MMR_RERANK if diverse is None else diverse
+        pool = k * max(1, MMR_POOL) if diverse else k
+        filters = [f for f in (where, self.search_filter(doc_id, file, page)) if f]
+        where = filters[0] if len(filters) == 1 else ({"$and": filters} if filters else None)
+        try:
+            rankings = [[] for _ in queries]
+            for backend, collection in self.spaces():
+                count = collection.count()
+                if count == 0:
+                    continue
+                # By default a big space only fuses keywords once its index is in memory anyway
+                fuse = hybrid and not (auto and count > HYBRID_MAX_ENTRIES and not self._cache(get_bm25_index, collection.name).loaded)
+            
+                dense = [None] * len(queries)
+                if mode != "lexical":
+                    depth = pool * HYBRID_DEPTH if fuse else pool
+                    embeddings = self._embed_batch(queries, "retrieval_query", backend)
+                    if self.hierarchical and not where:
+                        dense = self._section_search_many(queries, min(depth, count), backend, collection, embeddings)
+                    else:
+                        dense = self._dense_search_many(queries, min(depth, count), backend, collection, where, embeddings)
+                    missing = sum(ranking is None for ranking in dense)
+                    if missing:
+                        logger.warning(f"{missing} queries could not be embedded in the {backend.name} space, using keyword search")
+                
+                keys = None
+                if where and (fuse or None in dense):
+                    # Keyword search is scored over the matching entries only
+                    keys = set(collection.get(where=where, include=[])["ids"])
+                for i, query in enumerate(queries):
+                    if dense[i] is not None:
+                        rankings[i].append(dense[i])
+                    if dense[i] is None or fuse:
+                        rankings[i].append(self._lexical_search(query, pool * HYBRID_DEPTH if fuse else pool, collection, keys))
+            
+            results = [lists[0][:pool] if len(lists) == 1 else self._fuse(lists, pool) for lists in rankings]
+            return self._diversify(results, k) if diverse else results
+        except Exception as e:
+            logger.error(f"Search failed: {e}")
+            return [[] for _ in queries]
+    
+    def _release(self, collection, doc_ids):
+        """
+        Drop the documents' refs from one space. Entries other documents still cite get
+        their refs rewritten; everything left is theirs alone and goes in one filtered
+        delete. Returns how many entries were deleted.
+        """
+        doc_ids = set(doc_ids)
+        owned = self._docs_filter(doc_ids)
+        before = collection.count()
+        
+        # Shared entries - and ones from before ndocs was stored - need a look at their refs
+        results = collection.get(where={"$and": [owned, {"ndocs": {"$ne": 1}}]}, include=["metadatas"])
+        updates = {}
+        for entry_id, meta in zip(results['ids'], results['metadatas']):
+            refs = [ref for ref in entry_refs(meta or {}) if ref["doc_id"] not in doc_ids]
+            if refs:
+                updates[entry_id] = self._entry_meta(meta, refs)
+        if updates:
+            collection.update(ids=list(updates), metadatas=list(updates.values()))
+        
+        self._delete_where(collection, owned)
+        sections = self._sections(collection) if self.hierarchical else None
+        if sections is not None:
+            sections.drop(doc_ids)
+        return before - collection.count()
+    
+    def _delete_where(self, collection, where):
+        """One filtered delete in the index. A loaded keyword index has to drop the same
+        entries (or be rebuilt), so only then are their ids fetched first - ids only."""
+        if not self._cache(get_bm25_index, collection.name).loaded:
+            collection.delete(where=where)
+            return  # LSH drops deleted entries when it next runs into them
+        ids = collection.get(where=where, include=[])["ids"]
+        if ids:
+            collection.delete(ids=ids)
+            lsh = self._cache(get_lsh_index, collection.name)
+            for entry_id in ids:
+                lsh.remove(entry_id)
+            self._sync_lexical({}, ids, collection)
+    
+    def delete_document(self, doc_id):
+        """Drop the document's refs in every space; entries still cited by other documents stay"""
+        self.delete_documents([doc_id])
+    
+    def delete_documents(self, doc_ids):
+        """delete_document for many documents in one pass - a fixed number of index calls per space"""
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return
+        for _, collection in self.spaces():
+            try:
+                self._release(collection, doc_ids)
+            except:
+                pass
+    
+    def delete_where(self, where):
+        """Delete every entry matching a metadata filter, in every space. Unlike
+        delete_documents this ignores back-references - shared entries go too. Sections
+        of the documents hit are rebuilt from the entries they have left."""
+        for _, collection in self.spaces():
+            try:
+                sections = self._sections(collection) if self.hierarchical else None
+                doc_ids = set()
+                if sections is not None:
+                    for meta in collection.get(where=where, include=["metadatas"])["metadatas"]:
+                        doc_ids.update(ref["doc_id"] for ref in entry_refs(meta or {}))
+                self._delete_where(collection, where)
+                if doc_ids:
+                    self._build_sections(collection, doc_ids)
+            except:
+                pass
+    
+    def drop(self):
+        """Delete the whole workspace: every space's collections (shards and section index
+        included), its document files and settings, and what the per-collection caches hold.
+        The store can't be used afterwards."""
+        try:
+            existing = {c.name for c in self.client.list_collections()}
+        except:
+            existing = set()
+        for _, collection in self.spaces():
+            names = [shard.name for shard in getattr(collection, "shards", [collection])] + [section_name(collection.name)]
+            for name in names:
+                if name in existing:
+                    try:
+                        self.client.delete_collection(name)
+                    except:
+                        pass
+            self._forget(collection.name)
+        self._section_indexes = {}
+        shutil.rmtree(CONTENT_DIR / workspace_collection(self.namespace), ignore_errors=True)
+        forget_workspace_settings(self.namespace)
+    
+    def _forget(self, name):
+        if self._caches is not None:
+            for key in [key for key in self._caches if key[1] == name]:
+                del self._caches[key]
+            return
+        # The shared ones stay registered (other sessions hold them) but let go of their contents
+        lsh = get_lsh_index(name)
+        with lsh.lock:
+            for entry_id in list(lsh.signatures):
+                lsh.remove(entry_id)
+            lsh.loaded = False
+        bm25 = get_bm25_index(name)
+        with bm25.lock:
+            bm25.clear()
+            bm25.loaded = False
+        cache = get_section_cache(name)
+        with cache.lock:
+            cache.sections.clear()
+            cache.rows = 0
+    
+    def count(self):
+        total = 0
+        for _, collection in self.spaces():
+            try:
+                total += collection.count()
+            except:
+                pass
+        return total
+    
+    def list_documents(self):
+        """{doc_id: {"file", "hash", "chunks"}} for everything already indexed in this workspace"""
+        docs = {}
+        for _, collection in self.spaces():
+            try:
+                results = collection.get(include=["metadatas"])
+            except:
+                continue
+            for meta in results['metadatas'] or []:
+                for ref in entry_refs(meta or {}):
+                    entry = docs.setdefault(ref["doc_id"], {
+                        "file": ref["file"],
+                        "hash": ref["hash"],
+                        "chunks": 0
+                    })
+                    entry["chunks"] += 1
+        return docs
+    
+    def get_document_chunks(self, doc_id):
+        # One chunk per back-reference, so shared entries show up on every page they came from
+        chunks = []
+        for _, collection in self.spaces():
+            try:
+                results = collection.get(where=self._doc_filter(doc_id), include=["documents", "metadatas"])
+            except:
+                continue
+            chunks.extend(
+                {"id": chunk_id, "text": text, "page": ref["page"], "file": ref["file"]}
+                for chunk_id, text, meta in zip(results['ids'], results['documents'], results['metadatas'])
+                for ref in entry_refs(meta or {}) if ref["doc_id"] == doc_id
+            )
+        return sorted(chunks, key=lambda c: int(c["page"]) if str(c["page"]).isdigit() else 0)
+
+    def _hnsw_collections(self):
+        """Every Chroma collection (shards included) behind this workspace's spaces"""
+        if isinstance(self.client, NumpyClient):
+            return []  # exact index - nothing to tune
+        return [shard for _, collection in self.spaces() for shard in getattr(collection, "shards", [collection])]
+    
+    def tune_hnsw(self, k=5, target=TUNE_RECALL, queries=TUNE_QUERIES, sample=TUNE_SAMPLE, grid=None):
+        """
+        Sweep M / construction_ef / search_ef on vectors from the active space (held-out
+        queries, throwaway in-memory builds). Returns the recall@k / latency curve, the
+        cheapest setting meeting target ("best") and what the collection has now ("current").
+        """
+        found = self.collection.get(include=["embeddings"], limit=queries + sample)
+        vectors = [as_list(vector) for vector in found["embeddings"]]
+        report = autotune(get_chroma_client("memory"), vectors, k, target, queries, sample, grid)
+        report["current"] = built_params(self.collection) or self.hnsw
+        return report
+    
+    def apply_hnsw(self, params, rebuild=False):
+        """
+        Save params for the workspace. search_ef is updated in place (Chroma uses it from the
+        next index load); M and construction_ef need a rebuild of the existing collections,
+        done here when rebuild=True. Returns the number of collections changed.
+        """
+        self.hnsw = hnsw_params(params)
+        set_workspace_hnsw(self.namespace, self.hnsw)
+        
+        changed = 0
+        for collection in self._hnsw_collections():
+            current = built_params(collection)
+            if current == self.hnsw:
+                continue
+            if rebuild and (current.get("M"), current.get("construction_ef")) != (self.hnsw["M"], self.hnsw["construction_ef"]):
+                self._rebuild(collection)
+            else:
+                collection.modify(configuration={"hnsw": {"ef_search": self.hnsw["search_ef"]}})
+            changed += 1
+        
+        if changed:
+            # Handles to rebuilt collections are stale
+            self.collection = self._open(self.backend)
+            self._section_indexes = {}
+        return changed
+    
+    def _rebuild(self, collection):
+        """Rebuild one Chroma collection with self.hnsw: copy out, recreate, copy back. An
+        interrupted run leaves the copy in tmp_<hash> - nothing is deleted before it exists."""
+        name = collection.name
+        metadata = dict(collection.metadata or {}, **hnsw_metadata(self.hnsw))
+        
+        def copy(source, target):
+            ids = source.get(include=[])["ids"]
+            for start in range(0, len(ids), REBUILD_BATCH):
+                found = source.get(ids=ids[start:start + REBUILD_BATCH], include=["embeddings", "documents", "metadatas"])
+                target.upsert(
+                    ids=found["ids"],
+                    embeddings=[as_list(vector) for vector in found["embeddings"]],
+                    documents=found["documents"],
+                    metadatas=found["metadatas"]
+                )
+        
+        tmp_name = f"tmp_{hashlib.md5(name.encode()).hexdigest()[:16]}"
+        tmp = self.client.get_or_create_collection(name=tmp_name, metadata=metadata)
+        copy(collection, tmp)
+        self.client.delete_collection(name)
+        copy(tmp, self.client.get_or_create_collection(name=name, metadata=metadata))
+        self.client.delete_collection(tmp_name)
+        logger.info(f"Rebuilt {name} with {self.hnsw}")
+
+    def stored_documents(self):
+        """Document dicts for everything indexed here that the ingest cache or a streamed
+        header still describes"""
+        cache = get_ingest_cache()
+        docs = []
+        for doc_id, info in self.list_documents().items():
+            cached = cache.get(info["hash"]) if info["hash"] else None
+            header = self.content_path(doc_id, ".json")
+            if cached:
+                docs.append(dict(cached[0], name=info["file"]))
+            elif header.exists():
+                docs.append(dict(json.loads(header.read_text(encoding="utf-8")), name=info["file"]))
+        return docs
+    
+    def _snapshot_batches(self, collection, ids):
+        for start in range(0, len(ids), SNAPSHOT_BATCH):
+            found = collection.get(ids=ids[start:start + SNAPSHOT_BATCH], include=["embeddings", "documents", "metadatas"])
+            yield found["ids"], found["embeddings"], found["documents"], found["metadatas"]
+    
+    def export_snapshot(self, target, docs=None):
+        """
+        Write every space of the workspace plus its documents (docs, or stored_documents())
+        to a snapshot file / binary stream. Returns the manifest.
+        """
+        spaces = []
+        for backend, collection in self.spaces():
+            ids = collection.get(include=[])["ids"]
+            if not ids:
+                continue
+            first = collection.get(ids=ids[:1], include=["embeddings"])["embeddings"]
+            spaces.append({
+                "backend": backend.name,
+                "tag": backend.tag,
+                "dim": len(first[0]),
+                "count": len(ids),
+                "batches": self._snapshot_batches(collection, ids)
+            })
+        docs = self.stored_documents() if docs is None else list(docs)
+        return write_snapshot(target, self.namespace, spaces, docs)
+    
+    def import_snapshot(self, source):
+        """
+        Bulk-load a snapshot: vectors go straight into the matching spaces (no embedding
+        calls), documents into this workspace's document files, the way streamed documents
+        are kept - never into the shared ingest cache, whose keys (file hashes) a snapshot
+        can only claim. Returns {"manifest", "entries", "documents"}.
+        """
+        with SnapshotReader(source) as snapshot:
+            manifest = snapshot.manifest
+            docs, contents = snapshot.documents()
+            # Check everything before writing anything - document ids end up in file paths
+            for doc in docs:
+                if not valid_doc_id(doc.get("id")):
+                    raise ValueError(f"Snapshot has an invalid document id: {str(doc.get('id'))[:40]!r}")
+            for space in manifest["spaces"]:
+                backend = get_backend(space["backend"])
+                if backend.tag != space["tag"]:
+                    raise ValueError(f"Snapshot vectors come from {space['tag']}, this node's {backend.name} backend is {backend.tag}")
+                for meta in snapshot.metadatas(space):
+                    doc_ids = [ref["doc_id"] for ref in entry_refs(meta)] + list(meta.get("docs") or [])
+                    if not all(valid_doc_id(doc_id) for doc_id in doc_ids):
+                        raise ValueError(f"Snapshot has an entry with an invalid document id: {str(doc_ids)[:60]}")
+            
+            entries = 0
+            for space in manifest["spaces"]:
+                backend = get_backend(space["backend"])
+                collection = self.collection if backend is self.backend else self._open(backend)
+                lsh = self._cache(get_lsh_index, collection.name)
+                for ids, vectors, documents, metadatas in snapshot.batches(space):
+                    collection.upsert(ids=ids, embeddings=vectors.tolist(), documents=documents, metadatas=metadatas)
+                    self._sync_lexical(dict(zip(ids, documents)), [], collection)
+                    with lsh.lock:
+                        if lsh.loaded:
+                            for entry_id, meta in zip(ids, metadatas):
+                                if meta.get("minhash"):
+                                    lsh.add(entry_id, MinHasher.decode(meta["minhash"]))
+                    entries += len(ids)
+        
+        headers = []
+        for doc in docs:
+            chunks = doc.get("chunks") or []
+            if doc["id"] in contents:
+                content = contents[doc["id"]]
+            elif isinstance(chunks, ChunkSpans):
+                content = chunks.content()
+            else:
+                content = doc.get("content") or "\n\n".join(chunk.get("text", "") for chunk in chunks)
+            path = self.content_path(doc["id"], ".txt")
+            path.write_text(content, encoding="utf-8")
+            header = {key: value for key, value in doc.items() if key not in ("chunks", "content")}
+            header.update(chunks=[], chunk_count=doc.get("chunk_count", len(chunks)), content_path=str(path))
+            self.content_path(doc["id"], ".json").write_text(json.dumps(header), encoding="utf-8")
+            headers.append(header)
+        if self.hierarchical:
+            self.build_sections()
+        logger.info(f"Imported {entries} entries and {len(headers)} documents into {self.collection.name}")
+        return {"manifest": manifest, "entries": entries, "documents": headers}
+
+    def build_sections(self, doc_ids=None):
+        """(Re)build the section index of every space from the stored chunk vectors - for
+        workspaces indexed before hierarchical search was on, or restored from a snapshot.
+        No embedding calls."""
+        for _, collection in self.spaces():
+            # Only a space that has a section index can be rebuilt in part
+            self._build_sections(collection, doc_ids if self._sections(collection) is not None else None)
+    
+    def _build_sections(self, collection, doc_ids=None):
+        ids = collection.get(where=self._docs_filter(doc_ids) if doc_ids else None, include=[])["ids"]
+        groups = {}
+        for start in range(0, len(ids), REBUILD_BATCH):
+            found = collection.get(ids=ids[start:start + REBUILD_BATCH], include=["embeddings", "metadatas"])
+            for entry_id, vector, meta in zip(found['ids'], found['embeddings'], found['metadatas']):
+                for ref in entry_refs(meta or {}):
+                    if not doc_ids or ref["doc_id"] in doc_ids:
+                        groups.setdefault((ref["doc_id"], section_of(ref["page"])), {})[entry_id] = as_list(vector)
+        # Created only now, filled in one go - its existence marks the space as built
+        sections = self._sections(collection, create=True)
+        if doc_ids:
+            sections.drop(doc_ids)
+        else:
+            sections.clear()
+        if groups:
+            sections.add(groups)
+    
+    def set_hierarchical(self, enabled):
+        """Turn two-stage search on or off for the workspace; turning it on builds the section index"""
+        update_workspace_settings(self.namespace, hierarchical=bool(enabled))
+        self.hierarchical = bool(enabled)
+        if enabled:
+            self.build_sections()
+            return
+        for _, collection in self.spaces():
+            try:
+                self.client.delete_collection(section_name(collection.name))
+            except:
+                pass
+        self._section_indexes = {}